@@ -0,0 +1,67 @@
+"""
+Compares the mime type detection of the uploads: magic.from_file on every call, as the uploads
+did before, against the MimeDetector with a cold cache and with a warm cache, on a set of small
+files with common extensions and without extension. The threads detect the types of their own
+share of the files concurrently, as the upload workers do.
+
+Usage:
+    python benchmarks/mime_detection.py [--files 2000] [--threads 4]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gdrive_sync.MimeDetector import MimeDetector  # noqa: E402
+
+_SAMPLES = [('.txt', b'plain text\n'),
+            ('.json', b'{"key": "value"}\n'),
+            ('.jpg', b'\xff\xd8\xff\xe0\x00\x10JFIF\x00'),
+            ('.pdf', b'%PDF-1.4\n'),
+            ('.py', b'print("hello")\n'),
+            ('', b'#!/bin/sh\necho hello\n')]
+
+
+def _measure(detect, file_paths, threads):
+    shares = [file_paths[i::threads] for i in range(threads)]
+    workers = [threading.Thread(target=lambda share=share: [detect(each) for each in share]) for share in shares]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--files', type=int, default=2000, help='the number of files')
+    parser.add_argument('--threads', type=int, default=4, help='the number of detecting threads')
+    args = parser.parse_args()
+
+    import magic
+    with tempfile.TemporaryDirectory() as local_dir:
+        file_paths = []
+        for i in range(args.files):
+            extension, content = _SAMPLES[i % len(_SAMPLES)]
+            file_path = os.path.join(local_dir, 'file{}{}'.format(i, extension))
+            with open(file_path, 'wb') as _file:
+                _file.write(content)
+            file_paths.append(file_path)
+
+        mime_detector = MimeDetector(cache_size=args.files)
+        results = [('magic.from_file', _measure(lambda each: magic.from_file(each, True), file_paths, args.threads)),
+                   ('MimeDetector, cold cache', _measure(mime_detector.detect, file_paths, args.threads)),
+                   ('MimeDetector, warm cache', _measure(mime_detector.detect, file_paths, args.threads))]
+
+    print('{} files, {} threads'.format(args.files, args.threads))
+    for name, seconds in results:
+        print('{:>26}: {:8.1f} ms, {:6.1f} us per file'.format(name, seconds * 1000, seconds * 1e6 / args.files))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Measures the start up time of gdrive-sync: the time from the start of a new python process
+until the first sync decision, i.e. until the plan of the first synced dir pair is known.
+Every run is a new process with an empty home dir holding a warm discovery document cache,
+and the Drive API is replaced with canned responses, so that only the local work is measured.
+
+Usage:
+    python benchmarks/startup.py [--runs 10] [--files 100]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_CHILD = '''
+import json
+import sys
+import time
+start = time.perf_counter()
+
+from gdrive_sync import GdriveSync, utils
+imported = time.perf_counter()
+
+from googleapiclient.http import HttpMockSequence
+responses = [({'status': '200'}, json.dumps({'files': [{'id': 'remote_dir_id',
+                                                        'modifiedTime': '2020-01-01T00:00:00.000Z'}]})),
+             ({'status': '200'}, json.dumps({'files': []}))]
+service = utils.build_service(HttpMockSequence(responses))
+built = time.perf_counter()
+
+gdrive_sync = GdriveSync.GdriveSync()
+gdrive_sync._db_handler.load_index()
+plan = gdrive_sync._plan_dir_pairs(service, {sys.argv[1]: '/benchmark'})
+planned = time.perf_counter()
+
+print(json.dumps({'import': imported - start,
+                  'build_service': built - imported,
+                  'plan': planned - built,
+                  'actions': len(plan.actions)}))
+'''
+
+
+def _seed_discovery_cache(home_dir):
+    """
+    Writes the discovery document bundled with google-api-python-client into the cache,
+    as a previous run would have.
+    """
+    from googleapiclient import discovery_cache, version
+    cache_dir = os.path.join(home_dir, '.gdrive-sync', 'discovery')
+    os.makedirs(cache_dir)
+    with open(os.path.join(cache_dir, 'drive-v3-{}.json'.format(version.__version__)), 'w') as _file:
+        _file.write(discovery_cache.get_static_doc('drive', 'v3'))
+
+
+def _run_once(home_dir, local_dir):
+    env = dict(os.environ, HOME=home_dir, PYTHONPATH=_ROOT_DIR)
+    db_path = os.path.join(home_dir, '.gdrive-sync', 'gsync.db')
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', _CHILD, local_dir], env=env, cwd=_ROOT_DIR,
+                            check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+    result = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+    result['total'] = time.perf_counter() - started
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10, help='the number of measured processes')
+    parser.add_argument('--files', type=int, default=100, help='the number of files in the synced local dir')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as home_dir:
+        _seed_discovery_cache(home_dir)
+        local_dir = os.path.join(home_dir, 'synced')
+        os.makedirs(local_dir)
+        for i in range(args.files):
+            with open(os.path.join(local_dir, 'file{}'.format(i)), 'w') as _file:
+                _file.write('content {}'.format(i))
+
+        # The first run warms up the OS file cache and the bytecode cache
+        _run_once(home_dir, local_dir)
+        results = [_run_once(home_dir, local_dir) for _ in range(args.runs)]
+
+    print('{} runs, {} local files, {} planned actions'.format(args.runs, args.files, results[0]['actions']))
+    for phase in ('import', 'build_service', 'plan', 'total'):
+        timings = [result[phase] * 1000 for result in results]
+        print('{:>14}: median {:8.1f} ms, min {:8.1f} ms'.format(phase, statistics.median(timings), min(timings)))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,595 @@
+import array
+import bisect
+import contextlib
+import functools
+import itertools
+import math
+import os
 import sqlite3
-from gdrive_sync import utils
+import threading
+import time
+import weakref
+from gdrive_sync import configs, utils, Metrics
 
 LOGGER = utils.create_logger(__name__)
 
+_OPERATION_SECONDS = Metrics.get_default_registry().histogram(
+    'gdrive_sync_db_operation_seconds', 'The duration of the Db operations, by DbHandler method.', ('operation',))
+
+
+def _timed(operation):
+    '''
+    Observes the duration of every call of the decorated DbHandler method, whether it is
+    answered by a query or by the in-memory index.
+    Args:
+        operation: 'A String' name of the operation, the name of the method
+    '''
+    def decorator(method):
+        @functools.wraps(method)
+        def timed_method(*args, **kwargs):
+            with _OPERATION_SECONDS.time(operation=operation):
+                return method(*args, **kwargs)
+        return timed_method
+    return decorator
+
 
 class _Db_constants:
     FILE_MAPPING_INFO = 'file_mapping_info'
     LOCAL_PATH = 'local_path'
     REMOTE_ID = 'remote_id'
-    LOCAL_MODIFICATION_DATE = 'local_modification_date' 
+    LOCAL_MODIFICATION_DATE = 'local_modification_date'
     REMOTE_MODIFICATION_DATE = 'remote_modification_date'
+    SYNC_STATE = 'sync_state'
+    KEY = 'key'
+    VALUE = 'value'
+    UPLOAD_SESSION = 'upload_session'
+    SESSION_URI = 'session_uri'
+    FILE_SIZE = 'file_size'
+    COMMITTED_OFFSET = 'committed_offset'
+    LOCAL_HASH = 'local_hash'
+    DEVICE = 'device'
+    INODE = 'inode'
+    MTIME_NS = 'mtime_ns'
+    MD5_CHECKSUM = 'md5_checksum'
+    REMOTE_DIR = 'remote_dir'
+    REMOTE_PATH = 'remote_path'
+    LOCAL_DIR = 'local_dir'
+    CHILDREN = 'children'
+
+
+class _Db_statements:
+    '''
+    The SQL statements used by DbHandler. They are formatted once so that every call
+    passes the exact same string to sqlite3, which then reuses the prepared statement
+    from the connection's statement cache instead of compiling it again.
+    '''
+    UPSERT_RECORD = ('INSERT INTO {tn} values(?, ?, ?, ?) ON CONFLICT({cn1}) '
+                     'DO UPDATE SET {cn2}=excluded.{cn2}, {cn3}=excluded.{cn3}, {cn4}=excluded.{cn4}'
+                     .format(tn=_Db_constants.FILE_MAPPING_INFO,
+                             cn1=_Db_constants.LOCAL_PATH,
+                             cn2=_Db_constants.REMOTE_ID,
+                             cn3=_Db_constants.LOCAL_MODIFICATION_DATE,
+                             cn4=_Db_constants.REMOTE_MODIFICATION_DATE))
+    UPDATE_RECORD = ('UPDATE {tn} SET {cn1}=?, {cn2}=?, {cn3}=? WHERE {cn4}=?'
+                     .format(tn=_Db_constants.FILE_MAPPING_INFO,
+                             cn1=_Db_constants.REMOTE_ID,
+                             cn2=_Db_constants.LOCAL_MODIFICATION_DATE,
+                             cn3=_Db_constants.REMOTE_MODIFICATION_DATE,
+                             cn4=_Db_constants.LOCAL_PATH))
+    DELETE_RECORD = ('DELETE FROM {tn} WHERE {cn1}=?'
+                     .format(tn=_Db_constants.FILE_MAPPING_INFO,
+                             cn1=_Db_constants.LOCAL_PATH))
+    SELECT_REMOTE_ID = ('SELECT {cn1} FROM {tn} WHERE {cn2}=?'
+                        .format(tn=_Db_constants.FILE_MAPPING_INFO,
+                                cn1=_Db_constants.REMOTE_ID,
+                                cn2=_Db_constants.LOCAL_PATH))
+    SELECT_LOCAL_PATH = ('SELECT {cn1} FROM {tn} WHERE {cn2}=?'
+                         .format(tn=_Db_constants.FILE_MAPPING_INFO,
+                                 cn1=_Db_constants.LOCAL_PATH,
+                                 cn2=_Db_constants.REMOTE_ID))
+    SELECT_LOCAL_MODIFICATION_DATE = ('SELECT {cn1} FROM {tn} WHERE {cn2}=?'
+                                      .format(tn=_Db_constants.FILE_MAPPING_INFO,
+                                              cn1=_Db_constants.LOCAL_MODIFICATION_DATE,
+                                              cn2=_Db_constants.LOCAL_PATH))
+    SELECT_ALL_RECORDS = ('SELECT {cn1}, {cn2}, {cn3}, {cn4} FROM {tn}'
+                          .format(tn=_Db_constants.FILE_MAPPING_INFO,
+                                  cn1=_Db_constants.LOCAL_PATH,
+                                  cn2=_Db_constants.REMOTE_ID,
+                                  cn3=_Db_constants.LOCAL_MODIFICATION_DATE,
+                                  cn4=_Db_constants.REMOTE_MODIFICATION_DATE))
+    COUNT_RECORDS_UNDER = ('SELECT COUNT(*) FROM {tn} WHERE {cn1} > ? AND {cn1} < ?'
+                           .format(tn=_Db_constants.FILE_MAPPING_INFO,
+                                   cn1=_Db_constants.LOCAL_PATH))
+    SELECT_STATE = ('SELECT {cn1} FROM {tn} WHERE {cn2}=?'
+                    .format(tn=_Db_constants.SYNC_STATE,
+                            cn1=_Db_constants.VALUE,
+                            cn2=_Db_constants.KEY))
+    UPSERT_STATE = ('INSERT INTO {tn} values(?, ?) ON CONFLICT({cn1}) DO UPDATE SET {cn2}=excluded.{cn2}'
+                    .format(tn=_Db_constants.SYNC_STATE,
+                            cn1=_Db_constants.KEY,
+                            cn2=_Db_constants.VALUE))
+    SELECT_REMOTE_MODIFICATION_DATE = ('SELECT {cn1} FROM {tn} WHERE {cn2}=?'
+                                       .format(tn=_Db_constants.FILE_MAPPING_INFO,
+                                               cn1=_Db_constants.REMOTE_MODIFICATION_DATE,
+                                               cn2=_Db_constants.REMOTE_ID))
+    SELECT_UPLOAD_SESSION = ('SELECT {cn1}, {cn2}, {cn3}, {cn4} FROM {tn} WHERE {cn5}=?'
+                             .format(tn=_Db_constants.UPLOAD_SESSION,
+                                     cn1=_Db_constants.SESSION_URI,
+                                     cn2=_Db_constants.FILE_SIZE,
+                                     cn3=_Db_constants.LOCAL_MODIFICATION_DATE,
+                                     cn4=_Db_constants.COMMITTED_OFFSET,
+                                     cn5=_Db_constants.LOCAL_PATH))
+    UPSERT_UPLOAD_SESSION = ('INSERT INTO {tn} values(?, ?, ?, ?, ?) ON CONFLICT({cn1}) '
+                             'DO UPDATE SET {cn2}=excluded.{cn2}, {cn3}=excluded.{cn3}, '
+                             '{cn4}=excluded.{cn4}, {cn5}=excluded.{cn5}'
+                             .format(tn=_Db_constants.UPLOAD_SESSION,
+                                     cn1=_Db_constants.LOCAL_PATH,
+                                     cn2=_Db_constants.SESSION_URI,
+                                     cn3=_Db_constants.FILE_SIZE,
+                                     cn4=_Db_constants.LOCAL_MODIFICATION_DATE,
+                                     cn5=_Db_constants.COMMITTED_OFFSET))
+    DELETE_UPLOAD_SESSION = ('DELETE FROM {tn} WHERE {cn1}=?'
+                             .format(tn=_Db_constants.UPLOAD_SESSION,
+                                     cn1=_Db_constants.LOCAL_PATH))
+    DELETE_RECORDS_UNDER = ('DELETE FROM {tn} WHERE {cn1}=? OR ({cn1} > ? AND {cn1} < ?)'
+                            .format(tn=_Db_constants.FILE_MAPPING_INFO,
+                                    cn1=_Db_constants.LOCAL_PATH))
+    MOVE_RECORDS = ('UPDATE {tn} SET {cn1}=? || substr({cn1}, ?) WHERE {cn1}=? OR ({cn1} > ? AND {cn1} < ?)'
+                    .format(tn=_Db_constants.FILE_MAPPING_INFO,
+                            cn1=_Db_constants.LOCAL_PATH))
+    SELECT_LOCAL_HASH = ('SELECT {cn1} FROM {tn} WHERE {cn2}=? AND {cn3}=? AND {cn4}=? AND {cn5}=?'
+                         .format(tn=_Db_constants.LOCAL_HASH,
+                                 cn1=_Db_constants.MD5_CHECKSUM,
+                                 cn2=_Db_constants.DEVICE,
+                                 cn3=_Db_constants.INODE,
+                                 cn4=_Db_constants.FILE_SIZE,
+                                 cn5=_Db_constants.MTIME_NS))
+    UPSERT_LOCAL_HASH = ('INSERT INTO {tn} values(?, ?, ?, ?, ?) ON CONFLICT({cn1}, {cn2}) '
+                         'DO UPDATE SET {cn3}=excluded.{cn3}, {cn4}=excluded.{cn4}, {cn5}=excluded.{cn5}'
+                         .format(tn=_Db_constants.LOCAL_HASH,
+                                 cn1=_Db_constants.DEVICE,
+                                 cn2=_Db_constants.INODE,
+                                 cn3=_Db_constants.FILE_SIZE,
+                                 cn4=_Db_constants.MTIME_NS,
+                                 cn5=_Db_constants.MD5_CHECKSUM))
+    SELECT_ALL_REMOTE_DIRS = ('SELECT {cn1}, {cn2}, {cn3} FROM {tn}'
+                              .format(tn=_Db_constants.REMOTE_DIR,
+                                      cn1=_Db_constants.REMOTE_PATH,
+                                      cn2=_Db_constants.REMOTE_ID,
+                                      cn3=_Db_constants.REMOTE_MODIFICATION_DATE))
+    UPSERT_REMOTE_DIR = ('INSERT INTO {tn} values(?, ?, ?) ON CONFLICT({cn1}) '
+                         'DO UPDATE SET {cn2}=excluded.{cn2}, {cn3}=excluded.{cn3}'
+                         .format(tn=_Db_constants.REMOTE_DIR,
+                                 cn1=_Db_constants.REMOTE_PATH,
+                                 cn2=_Db_constants.REMOTE_ID,
+                                 cn3=_Db_constants.REMOTE_MODIFICATION_DATE))
+    DELETE_REMOTE_DIR = ('DELETE FROM {tn} WHERE {cn1}=?'
+                         .format(tn=_Db_constants.REMOTE_DIR,
+                                 cn1=_Db_constants.REMOTE_PATH))
+
+
+def _create_file_mapping_info(cursor):
+    '''
+    Schema version 1. Also adopts the Db files created before the schema was versioned.
+    '''
+    cursor.execute('CREATE TABLE IF NOT EXISTS {0} ({1} TEXT, {2} TEXT, {3} INTEGER, {4} INTEGER)'
+                   .format(_Db_constants.FILE_MAPPING_INFO,
+                           _Db_constants.LOCAL_PATH,
+                           _Db_constants.REMOTE_ID,
+                           _Db_constants.LOCAL_MODIFICATION_DATE,
+                           _Db_constants.REMOTE_MODIFICATION_DATE))
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS {0} on {1}({2})'
+                   .format('local_path_index',
+                           _Db_constants.FILE_MAPPING_INFO,
+                           _Db_constants.LOCAL_PATH))
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS {0} on {1}({2})'
+                   .format('remote_id_index',
+                           _Db_constants.FILE_MAPPING_INFO,
+                           _Db_constants.REMOTE_ID))
+
+
+def _create_sync_state(cursor):
+    '''
+    Schema version 2. A key value store for the state kept between the sync passes.
+    '''
+    cursor.execute('CREATE TABLE {0} ({1} TEXT PRIMARY KEY, {2} TEXT)'
+                   .format(_Db_constants.SYNC_STATE,
+                           _Db_constants.KEY,
+                           _Db_constants.VALUE))
+
+
+def _create_upload_session(cursor):
+    '''
+    Schema version 3. The resumable upload sessions of the uploads that have not completed yet.
+    '''
+    cursor.execute('CREATE TABLE {0} ({1} TEXT PRIMARY KEY, {2} TEXT, {3} INTEGER, {4} REAL, {5} INTEGER)'
+                   .format(_Db_constants.UPLOAD_SESSION,
+                           _Db_constants.LOCAL_PATH,
+                           _Db_constants.SESSION_URI,
+                           _Db_constants.FILE_SIZE,
+                           _Db_constants.LOCAL_MODIFICATION_DATE,
+                           _Db_constants.COMMITTED_OFFSET))
+
+
+def _create_local_hash(cursor):
+    '''
+    Schema version 4. The md5 checksums of the local files, by the device and inode of the file.
+    '''
+    cursor.execute('CREATE TABLE {0} ({1} INTEGER, {2} INTEGER, {3} INTEGER, {4} INTEGER, {5} TEXT, '
+                   'PRIMARY KEY({1}, {2}))'
+                   .format(_Db_constants.LOCAL_HASH,
+                           _Db_constants.DEVICE,
+                           _Db_constants.INODE,
+                           _Db_constants.FILE_SIZE,
+                           _Db_constants.MTIME_NS,
+                           _Db_constants.MD5_CHECKSUM))
+
+
+def _create_remote_dir(cursor):
+    '''
+    Schema version 5. The ids of the remote dirs by their remote path, like /parent_dir/child_dir.
+    '''
+    cursor.execute('CREATE TABLE {0} ({1} TEXT PRIMARY KEY, {2} TEXT, {3} TEXT)'
+                   .format(_Db_constants.REMOTE_DIR,
+                           _Db_constants.REMOTE_PATH,
+                           _Db_constants.REMOTE_ID,
+                           _Db_constants.REMOTE_MODIFICATION_DATE))
+
+
+def _create_local_dir(cursor):
+    '''
+    Schema version 6. The snapshot of the local dirs: the device, inode and mtime_ns of every
+    scanned dir and the names of its children, joined with '/'.
+    '''
+    cursor.execute('CREATE TABLE {0} ({1} TEXT PRIMARY KEY, {2} INTEGER, {3} INTEGER, {4} INTEGER, {5} BLOB)'
+                   .format(_Db_constants.LOCAL_DIR,
+                           _Db_constants.LOCAL_PATH,
+                           _Db_constants.DEVICE,
+                           _Db_constants.INODE,
+                           _Db_constants.MTIME_NS,
+                           _Db_constants.CHILDREN))
+
+
+def _drop_local_dir(cursor):
+    '''
+    Schema version 7. Drops the snapshot of the local dirs, the local dirs are listed on every scan again.
+    '''
+    cursor.execute('DROP TABLE {0}'.format(_Db_constants.LOCAL_DIR))
+
+
+# The schema migrations in order. The migration at index i upgrades the schema from
+# version i to version i + 1. The version of a Db file is stored in its user_version.
+# Append new migrations at the end, never modify the released ones.
+_MIGRATIONS = [_create_file_mapping_info,
+               _create_sync_state,
+               _create_upload_session,
+               _create_local_hash,
+               _create_remote_dir,
+               _create_local_dir,
+               _drop_local_dir]
+
+
+class _ThreadConnection:
+    '''
+    Holds the connection of a thread in its thread-local storage, which is cleared when the
+    thread exits.
+    '''
+    __slots__ = ('connection', '__weakref__')
+
+    def __init__(self, connection):
+        self.connection = connection
+
+
+def _close_thread_connection(connections, lock, connection):
+    with lock:
+        if connection not in connections:
+            # Already closed by close_all
+            return
+        connections.discard(connection)
+    connection.close()
+
+
+class _ConnectionManager:
+    '''
+    Keeps one long-lived sqlite3 connection per thread for a Db file.
+    sqlite3 connections must not be shared between threads, so each thread
+    (the sync thread, the watchdog observer threads and the worker threads) gets its own
+    connection on first use and keeps reusing it until the thread exits or close_all is called.
+    '''
+
+    def __init__(self, db_file_path):
+        self._db_file_path = db_file_path
+        self._cached_statements = configs.get_configs().getint('DB', 'cached_statements')
+        self._local = threading.local()
+        self._connections = set()
+        self._lock = threading.Lock()
+
+    def get_connection(self):
+        '''
+        Returns:
+            The sqlite3.Connection owned by the calling thread. It is created if not present.
+        '''
+        thread_connection = getattr(self._local, 'thread_connection', None)
+        if thread_connection is None:
+            # The connection is only ever used by this thread, check_same_thread is
+            # disabled so that close_all can close it from whichever thread shuts down.
+            connection = sqlite3.connect(self._db_file_path,
+                                         cached_statements=self._cached_statements,
+                                         check_same_thread=False)
+            # In WAL mode readers do not block the writer and the writer does not block readers.
+            # With synchronous NORMAL, commits do not fsync, only the checkpoints do.
+            connection.execute('PRAGMA journal_mode={}'.format(configs.get_config('DB', 'journal_mode')))
+            connection.execute('PRAGMA synchronous={}'.format(configs.get_config('DB', 'synchronous')))
+            thread_connection = self._local.thread_connection = _ThreadConnection(connection)
+            with self._lock:
+                self._connections.add(connection)
+            # The worker threads of every sync pass are new, the connection of a thread is
+            # closed once it exits instead of being kept open until close_all.
+            weakref.finalize(thread_connection, _close_thread_connection, self._connections, self._lock, connection)
+        return thread_connection.connection
+
+    def close_all(self):
+        '''
+        Closes the connections of all the threads.
+        '''
+        with self._lock:
+            connections = list(self._connections)
+            self._connections.clear()
+        for connection in connections:
+            connection.close()
+        self._local = threading.local()
+
+
+class _WriteBatch:
+    '''
+    A unit of work that buffers the record changes, the cached local hashes and the upload
+    sessions of one thread and writes them with executemany. The buffered changes are committed together once
+    max_size changes are pending or max_delay seconds have passed since the last commit,
+    so a sync pass needs a few transactions instead of one per file.
+    '''
+    _INSERT = 'insert'
+    _UPDATE = 'update'
+    _DELETE = 'delete'
+    _LOCAL_HASH = 'local_hash'
+    _UPLOAD_SESSION = 'upload_session'
+    _DELETE_UPLOAD_SESSION = 'delete_upload_session'
+    _STATEMENTS = {_INSERT: _Db_statements.UPSERT_RECORD,
+                   _UPDATE: _Db_statements.UPDATE_RECORD,
+                   _DELETE: _Db_statements.DELETE_RECORD,
+                   _LOCAL_HASH: _Db_statements.UPSERT_LOCAL_HASH,
+                   _UPLOAD_SESSION: _Db_statements.UPSERT_UPLOAD_SESSION,
+                   _DELETE_UPLOAD_SESSION: _Db_statements.DELETE_UPLOAD_SESSION}
+
+    def __init__(self, connection, max_size, max_delay, on_failure=None):
+        self._connection = connection
+        self._max_size = max_size
+        self._max_delay = max_delay
+        self._on_failure = on_failure
+        self._pending = []
+        self._uncommitted = 0
+        self._last_commit_time = time.monotonic()
+
+    def add_insert(self, local_path, remote_id, local_modification_date, remote_modification_date):
+        self._add(self._INSERT, (local_path, remote_id, local_modification_date, remote_modification_date))
+
+    def add_update(self, local_path, remote_id, local_modification_date, remote_modification_date):
+        self._add(self._UPDATE, (remote_id, local_modification_date, remote_modification_date, local_path))
+
+    def add_delete(self, local_path):
+        self._add(self._DELETE, (local_path,))
+
+    def add_local_hash(self, device, inode, file_size, mtime_ns, md5_checksum):
+        self._add(self._LOCAL_HASH, (device, inode, file_size, mtime_ns, md5_checksum))
+
+    def add_upload_session(self, local_path, session_uri, file_size, local_modification_date, committed_offset):
+        self._add(self._UPLOAD_SESSION,
+                  (local_path, session_uri, file_size, local_modification_date, committed_offset))
+
+    def add_delete_upload_session(self, local_path):
+        self._add(self._DELETE_UPLOAD_SESSION, (local_path,))
+
+    def _add(self, kind, parameters):
+        self._pending.append((kind, parameters))
+        if (len(self._pending) + self._uncommitted >= self._max_size or
+                time.monotonic() - self._last_commit_time >= self._max_delay):
+            self.commit()
+
+    def flush(self):
+        '''
+        Writes the pending changes into the open transaction without committing it,
+        so that reads on the same connection see them.
+        Returns:
+            False if the changes could not be written and the transaction was rolled back, else True
+        '''
+        if not self._pending:
+            return True
+        pending, self._pending = self._pending, []
+        cursor = self._connection.cursor()
+        try:
+            # Consecutive changes of the same kind are written together, which keeps their order.
+            for kind, group in itertools.groupby(pending, key=lambda each: each[0]):
+                cursor.executemany(self._STATEMENTS[kind], [each[1] for each in group])
+            self._uncommitted += len(pending)
+            return True
+        except Exception:
+            self._rollback(self._uncommitted + len(pending))
+            return False
+        finally:
+            cursor.close()
+
+    def commit(self):
+        '''
+        Writes the pending changes and commits the transaction.
+        '''
+        try:
+            with _OPERATION_SECONDS.time(operation='batch_commit'):
+                if self.flush():
+                    self._connection.commit()
+        except Exception:
+            self._rollback(self._uncommitted)
+        finally:
+            self._uncommitted = 0
+            self._last_commit_time = time.monotonic()
+
+    def _rollback(self, operation_count):
+        self._connection.rollback()
+        self._uncommitted = 0
+        LOGGER.error('Unable to commit %s batched db opearations:', operation_count, exc_info=True)
+        if self._on_failure:
+            self._on_failure()
+
+
+def _is_same_or_under(local_path, local_dir_path):
+    return local_path == local_dir_path or local_path.startswith(local_dir_path + '/')
+
+
+class _MappingIndex:
+    '''
+    An in-memory copy of the file_mapping_info table that answers the point lookups of
+    DbHandler without a Db round trip.
+    The records are kept column-wise in slots to keep the memory footprint of millions of
+    records low: the paths and ids in plain lists, the dates in arrays of doubles, and
+    the two dicts map the local_path and the remote_id to the slot of the record.
+    The local paths are also kept sorted, so that the records under a dir are found with a
+    binary search. The paths added since the last search are sorted in on the next one, and
+    the removed paths are only dropped from the sorted list once they outnumber the records.
+    '''
+
+    def __init__(self):
+        self._slot_by_local_path = {}
+        self._slot_by_remote_id = {}
+        self._local_paths = []
+        self._remote_ids = []
+        self._local_modification_dates = array.array('d')
+        self._remote_modification_dates = array.array('d')
+        self._free_slots = []
+        # May hold removed paths, and a path twice once it is removed and added again
+        self._sorted_local_paths = []
+        self._added_local_paths = []
+        self._removed_count = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._slot_by_local_path)
+
+    def put(self, local_path, remote_id, local_modification_date, remote_modification_date):
+        '''
+        Adds the record, or replaces the record with the same local_path.
+        '''
+        with self._lock:
+            slot = self._slot_by_local_path.get(local_path)
+            if slot is None:
+                if self._free_slots:
+                    slot = self._free_slots.pop()
+                else:
+                    slot = len(self._local_paths)
+                    self._local_paths.append(None)
+                    self._remote_ids.append(None)
+                    self._local_modification_dates.append(0)
+                    self._remote_modification_dates.append(0)
+                self._slot_by_local_path[local_path] = slot
+                self._local_paths[slot] = local_path
+                self._added_local_paths.append(local_path)
+            else:
+                self._slot_by_remote_id.pop(self._remote_ids[slot], None)
+            self._set(slot, remote_id, local_modification_date, remote_modification_date)
+
+    def update(self, local_path, remote_id, local_modification_date, remote_modification_date):
+        '''
+        Replaces the record with the same local_path. Does nothing if there is no such record.
+        '''
+        with self._lock:
+            slot = self._slot_by_local_path.get(local_path)
+            if slot is not None:
+                self._slot_by_remote_id.pop(self._remote_ids[slot], None)
+                self._set(slot, remote_id, local_modification_date, remote_modification_date)
+
+    def _set(self, slot, remote_id, local_modification_date, remote_modification_date):
+        self._remote_ids[slot] = remote_id
+        self._local_modification_dates[slot] = self._to_stored_date(local_modification_date)
+        self._remote_modification_dates[slot] = self._to_stored_date(remote_modification_date)
+        if remote_id is not None:
+            self._slot_by_remote_id[remote_id] = slot
+
+    def remove(self, local_path):
+        with self._lock:
+            slot = self._slot_by_local_path.pop(local_path, None)
+            if slot is not None:
+                self._slot_by_remote_id.pop(self._remote_ids[slot], None)
+                self._local_paths[slot] = None
+                self._remote_ids[slot] = None
+                self._free_slots.append(slot)
+                self._removed_count += 1
+
+    def move(self, old_local_path, new_local_path):
+        '''
+        Changes the local_path of the record of old_local_path and of all the records under it.
+        The records under new_local_path are removed first.
+        '''
+        with self._lock:
+            for local_path in self._get_local_paths_under(new_local_path):
+                self.remove(local_path)
+            for local_path in self._get_local_paths_under(old_local_path):
+                slot = self._slot_by_local_path.pop(local_path)
+                moved_local_path = new_local_path + local_path[len(old_local_path):]
+                self._slot_by_local_path[moved_local_path] = slot
+                self._local_paths[slot] = moved_local_path
+                self._added_local_paths.append(moved_local_path)
+                self._removed_count += 1
+
+    def _get_local_paths_under(self, local_dir_path):
+        '''
+        Returns:
+            A list of the local paths of the records of local_dir_path and of the records under it
+        '''
+        self._sort_local_paths()
+        # All the paths under a dir sort between 'dir/' and 'dir0', as '0' follows '/'
+        start = bisect.bisect_left(self._sorted_local_paths, local_dir_path)
+        end = bisect.bisect_left(self._sorted_local_paths, local_dir_path + '0', start)
+        return [local_path for local_path in dict.fromkeys(self._sorted_local_paths[start:end])
+                if local_path in self._slot_by_local_path and _is_same_or_under(local_path, local_dir_path)]
+
+    def _sort_local_paths(self):
+        if self._added_local_paths:
+            # Sorting two sorted runs merges them in linear time
+            self._added_local_paths.sort()
+            self._sorted_local_paths += self._added_local_paths
+            self._sorted_local_paths.sort()
+            self._added_local_paths = []
+        if self._removed_count > len(self._slot_by_local_path):
+            self._sorted_local_paths = [local_path for local_path in dict.fromkeys(self._sorted_local_paths)
+                                        if local_path in self._slot_by_local_path]
+            self._removed_count = 0
+
+    def get_remote_id(self, local_path):
+        with self._lock:
+            slot = self._slot_by_local_path.get(local_path)
+            return None if slot is None else self._remote_ids[slot]
+
+    def get_local_path(self, remote_id):
+        with self._lock:
+            slot = self._slot_by_remote_id.get(remote_id)
+            return None if slot is None else self._local_paths[slot]
+
+    def get_local_modification_date(self, local_path):
+        with self._lock:
+            slot = self._slot_by_local_path.get(local_path)
+            return None if slot is None else self._to_date(self._local_modification_dates[slot])
+
+    def get_remote_modification_date(self, remote_id):
+        with self._lock:
+            slot = self._slot_by_remote_id.get(remote_id)
+            return None if slot is None else self._to_date(self._remote_modification_dates[slot])
+
+    @staticmethod
+    def _to_stored_date(date):
+        return float('nan') if date is None else date
+
+    @staticmethod
+    def _to_date(stored_date):
+        if math.isnan(stored_date):
+            return None
+        return int(stored_date) if stored_date.is_integer() else stored_date
 
 
 class DbHandler:
@@ -19,23 +599,117 @@ class DbHandler:
 
     def __init__(self, db_file_path=None):
         self._db_file_path = db_file_path if db_file_path else '{}/gsync.db'.format(utils.get_gdrive_sync_home())
+        self._connection_manager = _ConnectionManager(self._db_file_path)
+        self._batches = threading.local()
+        self._index = None
+        self._index_loaded = False
+        self._remote_dirs = None
+        self._remote_dirs_lock = threading.Lock()
+        self._migrate()
 
-        def create_db_if_not_present(cursor):
-            cursor.execute('CREATE TABLE IF NOT EXISTS {0} ({1} TEXT, {2} TEXT, {3} INTEGER, {4} INTEGER)'
-                           .format(_Db_constants.FILE_MAPPING_INFO,
-                                   _Db_constants.LOCAL_PATH,
-                                   _Db_constants.REMOTE_ID,
-                                   _Db_constants.LOCAL_MODIFICATION_DATE,
-                                   _Db_constants.REMOTE_MODIFICATION_DATE))
-            cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS {0} on {1}({2})'
-                           .format('local_path_index',
-                                   _Db_constants.FILE_MAPPING_INFO,
-                                   _Db_constants.LOCAL_PATH))
-            cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS {0} on {1}({2})'
-                           .format('remote_id_index',
-                                   _Db_constants.FILE_MAPPING_INFO,
-                                   _Db_constants.REMOTE_ID))
-        self._execute_in_transaction(create_db_if_not_present)
+    def _migrate(self):
+        '''
+        Upgrades the schema of the Db file to the latest version by running the pending
+        _MIGRATIONS in a single transaction, and stamps the new version in the Db file.
+        '''
+        connection = self._connection_manager.get_connection()
+        try:
+            # The schema version is read within the write transaction so that two processes
+            # opening the same Db file do not run the same migration twice.
+            connection.execute('BEGIN IMMEDIATE')
+            version = connection.execute('PRAGMA user_version').fetchone()[0]
+            if version > len(_MIGRATIONS):
+                LOGGER.warning('Db schema version %s is newer than the supported version %s.',
+                               version, len(_MIGRATIONS))
+            cursor = connection.cursor()
+            for migration_version in range(version, len(_MIGRATIONS)):
+                LOGGER.info('Migrating Db schema to version %s.', migration_version + 1)
+                _MIGRATIONS[migration_version](cursor)
+                connection.execute('PRAGMA user_version={}'.format(migration_version + 1))
+            cursor.close()
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            LOGGER.error('Unable to migrate the db schema:', exc_info=True)
+
+    def get_schema_version(self):
+        '''
+        Returns:
+            Integer, the schema version stamped in the Db file.
+        '''
+        return self._execute_read_function(lambda cursor: cursor.execute('PRAGMA user_version').fetchone()[0])
+
+    def close(self):
+        '''
+        Closes all the Db connections opened by this handler.
+        '''
+        self._connection_manager.close_all()
+
+    @_timed('load_index')
+    def load_index(self):
+        '''
+        Loads all the records into an in-memory index with one streaming scan.
+        Afterwards the get_* methods are answered from the index, and the record changes
+        made through this handler are applied to the index and written through to the Db.
+        The index is loaded once, the later calls do nothing until a failed write dropped it.
+        It should be called while no other thread writes, as their changes could be missing from it.
+        '''
+        if self._index_loaded:
+            return
+        self._index_loaded = True
+
+        def read_function(cursor):
+            index = _MappingIndex()
+            cursor.execute(_Db_statements.SELECT_ALL_RECORDS)
+            for record in cursor:
+                index.put(*record)
+            return index
+        self._index = self._execute_read_function(read_function)
+        if self._index is not None:
+            LOGGER.info('Loaded %s records into the in-memory index.', len(self._index))
+
+    def _drop_index(self):
+        '''
+        Stops using the in-memory index, after a failed write left it out of sync with the Db.
+        It is loaded again by the next load_index.
+        '''
+        if self._index is not None:
+            LOGGER.warning('Dropping the in-memory index after a failed db write.')
+        self._index = None
+        self._index_loaded = False
+
+    @contextlib.contextmanager
+    def batch(self, max_size=None, max_delay=None):
+        '''
+        Groups the insert_record, update_record and delete_record calls made by the calling
+        thread within the with block into bounded transactions. Reads made by the same
+        thread within the block see the buffered changes.
+        Nested calls join the outermost batch.
+        Args:
+            max_size: Integer, maximum number of changes per transaction.
+                Defaults to batch_size from configs.ini
+            max_delay: Float, maximum number of seconds between two commits.
+                Defaults to batch_interval from configs.ini
+        '''
+        if self._get_batch():
+            yield
+            return
+        self._batches.batch = _WriteBatch(self._connection_manager.get_connection(),
+                                          max_size or configs.get_configs().getint('DB', 'batch_size'),
+                                          max_delay or configs.get_configs().getfloat('DB', 'batch_interval'),
+                                          self._drop_index)
+        try:
+            yield
+        finally:
+            current_batch, self._batches.batch = self._batches.batch, None
+            current_batch.commit()
+
+    def _get_batch(self):
+        '''
+        Returns:
+            The _WriteBatch open on the calling thread, None if there is no open batch.
+        '''
+        return getattr(self._batches, 'batch', None)
 
     def _execute_in_transaction(self, function):
         '''
@@ -43,21 +717,23 @@ class DbHandler:
         Args:
             function: A function that takes cursor as input argument and returns no value.
         '''
+        connection = self._connection_manager.get_connection()
+        cursor = connection.cursor()
         try:
-            connection = sqlite3.connect(self._db_file_path)
-            cursor = connection.cursor()
             function(cursor)
             connection.commit()
         except Exception:
             connection.rollback()
             LOGGER.error('Unable to commit db opearation:', exc_info=True)
+            self._drop_index()
         finally:
-            connection.close()
+            cursor.close()
 
-    def insert_record(self, 
-                      local_path, 
-                      remote_id, 
-                      local_modification_date, 
+    @_timed('insert_record')
+    def insert_record(self,
+                      local_path,
+                      remote_id,
+                      local_modification_date,
                       remote_modification_date):
         '''
         If no record with local_path exists, inserts the inputs as a record in Db.
@@ -68,29 +744,20 @@ class DbHandler:
             local_modification_date: Integer
             remote_modification_date: Integer
         '''
+        index = self._index
+        if index is not None:
+            index.put(local_path, remote_id, local_modification_date, remote_modification_date)
+        current_batch = self._get_batch()
+        if current_batch:
+            current_batch.add_insert(local_path, remote_id, local_modification_date, remote_modification_date)
+            return
+
         def insert_function(cursor):
-            cursor.execute('SELECT 1 FROM {tn} WHERE {cn1}=?'
-                           .format(tn=_Db_constants.FILE_MAPPING_INFO,
-                                   cn1=_Db_constants.LOCAL_PATH),
-                           (local_path,))
-            if len(cursor.fetchall()):
-                cursor.execute('UPDATE {tn} SET {cn1}=?, {cn2}=?, {cn3}=? WHERE {cn4}=?'
-                           .format(tn=_Db_constants.FILE_MAPPING_INFO,
-                                   cn1=_Db_constants.REMOTE_ID,
-                                   cn2=_Db_constants.LOCAL_MODIFICATION_DATE,
-                                   cn3=_Db_constants.REMOTE_MODIFICATION_DATE,
-                                   cn4=_Db_constants.LOCAL_PATH),
-                           (remote_id,
-                            local_modification_date, 
-                            remote_modification_date,
-                            local_path))
-            else:
-                cursor.execute('INSERT INTO {tn} values(?, ?, ?, ?)'
-                               .format(tn=_Db_constants.FILE_MAPPING_INFO),
-                               (local_path, 
-                                remote_id,
-                                local_modification_date, 
-                                remote_modification_date))
+            cursor.execute(_Db_statements.UPSERT_RECORD,
+                           (local_path,
+                            remote_id,
+                            local_modification_date,
+                            remote_modification_date))
         self._execute_in_transaction(insert_function)
 
     def _execute_read_function(self, function):
@@ -102,36 +769,63 @@ class DbHandler:
         Returns:
             The return value of the function
         '''
+        cursor = None
         try:
-            connection = sqlite3.connect(self._db_file_path)
-            cursor = connection.cursor()
+            current_batch = self._get_batch()
+            if current_batch:
+                current_batch.flush()
+            cursor = self._connection_manager.get_connection().cursor()
             return function(cursor)
         except Exception:
             LOGGER.error('Unable to complete db opearation:', exc_info=True)
         finally:
-            connection.close()
+            # Resets the statement so that the connection does not keep holding a read lock.
+            if cursor:
+                cursor.close()
 
-    def get_remote_file_id(self, local_path):
+    def _fetch_single_value(self, statement, parameter, warning_message, index_function):
         '''
-        Fetches the remote_file_id for the input local_path from DB.
+        Looks up a single value in the in-memory index if it is loaded, else runs
+        a single-column select statement and returns the value of the first row.
         Args:
-            local_path: 'A String'
+            statement: 'A String' one of the _Db_statements
+            parameter: The value to bind to the statement
+            warning_message: 'A String' to log with the parameter if no record is found
+            index_function: A function that takes the _MappingIndex and the parameter as input arguments
         Returns:
-            The remote_id as String if records available else None
+            The value if records available else None
         '''
+        index = self._index
+        if index is not None:
+            final_val = index_function(index, parameter)
+            if final_val is None:
+                LOGGER.warning(warning_message, parameter)
+            return final_val
+
         def read_function(cursor):
-            cursor.execute('SELECT {cn1} FROM {tn} WHERE {cn2}=?'
-                           .format(tn=_Db_constants.FILE_MAPPING_INFO,
-                                   cn1=_Db_constants.REMOTE_ID,
-                                   cn2=_Db_constants.LOCAL_PATH),
-                           (local_path,))
+            cursor.execute(statement, (parameter,))
             final_val = cursor.fetchone()
             if not final_val:
-                LOGGER.warning('No record available for local_path: %s', local_path)
+                LOGGER.warning(warning_message, parameter)
             else:
                 return final_val[0]
         return self._execute_read_function(read_function)
 
+    @_timed('get_remote_file_id')
+    def get_remote_file_id(self, local_path):
+        '''
+        Fetches the remote_file_id for the input local_path from DB.
+        Args:
+            local_path: 'A String'
+        Returns:
+            The remote_id as String if records available else None
+        '''
+        return self._fetch_single_value(_Db_statements.SELECT_REMOTE_ID,
+                                        local_path,
+                                        'No record available for local_path: %s',
+                                        _MappingIndex.get_remote_id)
+
+    @_timed('get_local_file_path')
     def get_local_file_path(self, remote_file_id):
         '''
         Fetches the local_file_path for the input local_path from DB.
@@ -140,19 +834,12 @@ class DbHandler:
         Returns:
             The local_path as String if records available else None
         '''
-        def read_function(cursor):
-            cursor.execute('SELECT {cn1} FROM {tn} WHERE {cn2}=?'
-                           .format(tn=_Db_constants.FILE_MAPPING_INFO,
-                                   cn1=_Db_constants.LOCAL_PATH,
-                                   cn2=_Db_constants.REMOTE_ID),
-                           (remote_file_id,))
-            final_val = cursor.fetchone()
-            if not final_val:
-                LOGGER.warning('No record available for remote_id: %s', remote_file_id)
-            else:
-                return final_val[0]
-        return self._execute_read_function(read_function)
-    
+        return self._fetch_single_value(_Db_statements.SELECT_LOCAL_PATH,
+                                        remote_file_id,
+                                        'No record available for remote_id: %s',
+                                        _MappingIndex.get_local_path)
+
+    @_timed('get_local_modification_date')
     def get_local_modification_date(self, local_file_path):
         '''
         Fetches the local modification date for the input local file path from Db.
@@ -161,19 +848,12 @@ class DbHandler:
         Returns:
             The local_modification_date as Integer if record available else None
         '''
-        def read_function(cursor):
-            cursor.execute('SELECT {cn1} FROM {tn} WHERE {cn2}=?'
-                           .format(tn=_Db_constants.FILE_MAPPING_INFO,
-                                   cn1=_Db_constants.LOCAL_MODIFICATION_DATE,
-                                   cn2=_Db_constants.LOCAL_PATH),
-                           (local_file_path,))
-            final_val = cursor.fetchone()
-            if not final_val:
-                LOGGER.warning('No record available for local file path: %s', local_file_path)
-            else:
-                return final_val[0]
-        return self._execute_read_function(read_function)
-    
+        return self._fetch_single_value(_Db_statements.SELECT_LOCAL_MODIFICATION_DATE,
+                                        local_file_path,
+                                        'No record available for local file path: %s',
+                                        _MappingIndex.get_local_modification_date)
+
+    @_timed('get_remote_modification_date')
     def get_remote_modification_date(self, remote_file_id):
         '''
         Fetches the remote modification date for the input remote file id from Db.
@@ -182,23 +862,16 @@ class DbHandler:
         Returns:
             The remote_modification_date as Integer if record available else None
         '''
-        def read_function(cursor):
-            cursor.execute('SELECT {cn1} FROM {tn} WHERE {cn2}=?'
-                           .format(tn=_Db_constants.FILE_MAPPING_INFO,
-                                   cn1=_Db_constants.REMOTE_MODIFICATION_DATE,
-                                   cn2=_Db_constants.REMOTE_ID),
-                           (remote_file_id,))
-            final_val = cursor.fetchone()
-            if not final_val:
-                LOGGER.warning('No record available for remote file id: %s', remote_file_id)
-            else:
-                return final_val[0]
-        return self._execute_read_function(read_function)
-    
-    def update_record(self, 
-                      local_path, 
-                      remote_id, 
-                      local_modification_date, 
+        return self._fetch_single_value(_Db_statements.SELECT_REMOTE_MODIFICATION_DATE,
+                                        remote_file_id,
+                                        'No record available for remote file id: %s',
+                                        _MappingIndex.get_remote_modification_date)
+
+    @_timed('update_record')
+    def update_record(self,
+                      local_path,
+                      remote_id,
+                      local_modification_date,
                       remote_modification_date):
         '''
         Updates an existing record with local_path in Db.
@@ -208,19 +881,23 @@ class DbHandler:
             local_modification_date: Integer
             remote_modification_date: Integer
         '''
+        index = self._index
+        if index is not None:
+            index.update(local_path, remote_id, local_modification_date, remote_modification_date)
+        current_batch = self._get_batch()
+        if current_batch:
+            current_batch.add_update(local_path, remote_id, local_modification_date, remote_modification_date)
+            return
+
         def update_function(cursor):
-            cursor.execute('UPDATE {tn} SET {cn1}=?, {cn2}=?, {cn3}=? WHERE {cn4}=?'
-                           .format(tn=_Db_constants.FILE_MAPPING_INFO,
-                                   cn1=_Db_constants.REMOTE_ID,
-                                   cn2=_Db_constants.LOCAL_MODIFICATION_DATE,
-                                   cn3=_Db_constants.REMOTE_MODIFICATION_DATE,
-                                   cn4=_Db_constants.LOCAL_PATH),
+            cursor.execute(_Db_statements.UPDATE_RECORD,
                            (remote_id,
-                            local_modification_date, 
+                            local_modification_date,
                             remote_modification_date,
                             local_path))
         self._execute_in_transaction(update_function)
-    
+
+    @_timed('delete_record')
     def delete_record(self,
                       local_path):
         '''
@@ -228,9 +905,309 @@ class DbHandler:
         Args:
             local_path: 'A String'
         '''
+        self._forget_remote_dir_of(local_path)
+        index = self._index
+        if index is not None:
+            index.remove(local_path)
+        current_batch = self._get_batch()
+        if current_batch:
+            current_batch.add_delete(local_path)
+            return
+
         def delete_function(cursor):
-            cursor.execute('DELETE FROM {tn} WHERE {cn1}=?'
-                           .format(tn=_Db_constants.FILE_MAPPING_INFO,
-                                   cn1=_Db_constants.LOCAL_PATH),
-                           (local_path,))
-        self._execute_in_transaction(delete_function)
\ No newline at end of file
+            cursor.execute(_Db_statements.DELETE_RECORD, (local_path,))
+        self._execute_in_transaction(delete_function)
+
+    @_timed('count_records_under')
+    def count_records_under(self, local_dir_path):
+        '''
+        Counts the records of the files and dirs under the input local dir, recursively.
+        Args:
+            local_dir_path: 'A String'
+        Returns:
+            Integer, the number of records
+        '''
+        local_dir_path = local_dir_path.rstrip('/')
+        # All the paths under the dir sort between 'dir/' and 'dir0', as '0' follows '/'
+        return self._execute_read_function(
+            lambda cursor: cursor.execute(_Db_statements.COUNT_RECORDS_UNDER,
+                                          (local_dir_path + '/', local_dir_path + '0')).fetchone()[0])
+
+    @_timed('move_records')
+    def move_records(self, old_local_path, new_local_path):
+        '''
+        Moves the record of a file or dir and the records of all the files and dirs under it
+        to a new local path, in one transaction. The records under the new local path are replaced.
+        Args:
+            old_local_path: 'A String'
+            new_local_path: 'A String'
+        '''
+        old_local_path = old_local_path.rstrip('/')
+        new_local_path = new_local_path.rstrip('/')
+        self._forget_remote_dir_of(old_local_path)
+        self._forget_remote_dir_of(new_local_path)
+        index = self._index
+        if index is not None:
+            index.move(old_local_path, new_local_path)
+        current_batch = self._get_batch()
+        if current_batch:
+            # The buffered changes of the moved records must be written before they are moved
+            current_batch.flush()
+
+        def move_function(cursor):
+            # All the paths under a dir sort between 'dir/' and 'dir0', as '0' follows '/'
+            cursor.execute(_Db_statements.DELETE_RECORDS_UNDER,
+                           (new_local_path, new_local_path + '/', new_local_path + '0'))
+            cursor.execute(_Db_statements.MOVE_RECORDS,
+                           (new_local_path, len(old_local_path) + 1,
+                            old_local_path, old_local_path + '/', old_local_path + '0'))
+        self._execute_in_transaction(move_function)
+
+    @_timed('get_state')
+    def get_state(self, key):
+        '''
+        Fetches a value stored with set_state.
+        Args:
+            key: 'A String'
+        Returns:
+            The value as String if available else None
+        '''
+        def read_function(cursor):
+            final_val = cursor.execute(_Db_statements.SELECT_STATE, (key,)).fetchone()
+            return final_val[0] if final_val else None
+        return self._execute_read_function(read_function)
+
+    @_timed('set_state')
+    def set_state(self, key, value):
+        '''
+        Stores a value that is kept between the sync passes.
+        Args:
+            key: 'A String'
+            value: 'A String'
+        '''
+        self._execute_in_transaction(lambda cursor: cursor.execute(_Db_statements.UPSERT_STATE, (key, value)))
+
+    @_timed('get_upload_session')
+    def get_upload_session(self, local_path):
+        '''
+        Fetches the resumable upload session stored for the input local file path.
+        Args:
+            local_path: 'A String'
+        Returns:
+            A tuple of the session uri, the file size, the local modification date of the file
+            and the committed offset if a session is stored, else None
+        '''
+        return self._execute_read_function(
+            lambda cursor: cursor.execute(_Db_statements.SELECT_UPLOAD_SESSION, (local_path,)).fetchone())
+
+    @_timed('set_upload_session')
+    def set_upload_session(self, local_path, session_uri, file_size, local_modification_date, committed_offset):
+        '''
+        Stores the resumable upload session of the input local file path and the number of
+        bytes the server has committed. It is committed right away so that it survives a crash,
+        together with the changes of the batch open on the calling thread if there is one.
+        Args:
+            local_path: 'A String'
+            session_uri: 'A String'
+            file_size: Integer
+            local_modification_date: Float
+            committed_offset: Integer
+        '''
+        current_batch = self._get_batch()
+        if current_batch:
+            # A separate transaction would wait for the one of the batch on the same Db file
+            current_batch.add_upload_session(local_path, session_uri, file_size, local_modification_date,
+                                             committed_offset)
+            current_batch.commit()
+            return
+        self._execute_in_transaction(
+            lambda cursor: cursor.execute(_Db_statements.UPSERT_UPLOAD_SESSION,
+                                          (local_path, session_uri, file_size, local_modification_date,
+                                           committed_offset)))
+
+    @_timed('delete_upload_session')
+    def delete_upload_session(self, local_path):
+        '''
+        Deletes the resumable upload session stored for the input local file path, right away.
+        Args:
+            local_path: 'A String'
+        '''
+        current_batch = self._get_batch()
+        if current_batch:
+            current_batch.add_delete_upload_session(local_path)
+            current_batch.commit()
+            return
+        self._execute_in_transaction(
+            lambda cursor: cursor.execute(_Db_statements.DELETE_UPLOAD_SESSION, (local_path,)))
+
+    @_timed('get_local_hash')
+    def get_local_hash(self, device, inode, file_size, mtime_ns):
+        '''
+        Fetches the md5 checksum stored for a local file. The checksum is only returned if the
+        file has not changed since it was stored, i.e. its size and mtime_ns are the same.
+        Args:
+            device: Integer, st_dev of the file
+            inode: Integer, st_ino of the file
+            file_size: Integer, st_size of the file
+            mtime_ns: Integer, st_mtime_ns of the file
+        Returns:
+            The md5 checksum as String if available else None
+        '''
+        def read_function(cursor):
+            final_val = cursor.execute(_Db_statements.SELECT_LOCAL_HASH,
+                                       (device, inode, file_size, mtime_ns)).fetchone()
+            return final_val[0] if final_val else None
+        return self._execute_read_function(read_function)
+
+    @_timed('set_local_hash')
+    def set_local_hash(self, device, inode, file_size, mtime_ns, md5_checksum):
+        '''
+        Stores the md5 checksum of a local file.
+        Args:
+            device: Integer, st_dev of the file
+            inode: Integer, st_ino of the file
+            file_size: Integer, st_size of the file
+            mtime_ns: Integer, st_mtime_ns of the file
+            md5_checksum: 'A String' hex digest
+        '''
+        current_batch = self._get_batch()
+        if current_batch:
+            current_batch.add_local_hash(device, inode, file_size, mtime_ns, md5_checksum)
+            return
+        self._execute_in_transaction(
+            lambda cursor: cursor.execute(_Db_statements.UPSERT_LOCAL_HASH,
+                                          (device, inode, file_size, mtime_ns, md5_checksum)))
+
+    def _get_remote_dirs(self):
+        '''
+        Returns:
+            The dict of the remote dir paths and tuples of their id and modification date,
+            loaded from the Db on the first call.
+        '''
+        with self._remote_dirs_lock:
+            if self._remote_dirs is None:
+                rows = self._execute_read_function(
+                    lambda cursor: cursor.execute(_Db_statements.SELECT_ALL_REMOTE_DIRS).fetchall())
+                self._remote_dirs = {remote_path: (remote_id, remote_modification_date)
+                                     for remote_path, remote_id, remote_modification_date in rows or []}
+            return self._remote_dirs
+
+    @_timed('get_remote_dir')
+    def get_remote_dir(self, remote_path):
+        '''
+        Fetches the remote dir stored for a remote path with set_remote_dir, from memory.
+        Args:
+            remote_path: 'A String' like /parent_dir/child_dir
+        Returns:
+            A tuple of the remote id and the modification date in rfc3339 format if available else None
+        '''
+        return self._get_remote_dirs().get(remote_path)
+
+    @_timed('set_remote_dir')
+    def set_remote_dir(self, remote_path, remote_id, remote_modification_date):
+        '''
+        Stores the id of the remote dir at a remote path, in memory and in the Db.
+        Args:
+            remote_path: 'A String' like /parent_dir/child_dir
+            remote_id: 'A String'
+            remote_modification_date: 'A String' in rfc3339 format
+        '''
+        self._get_remote_dirs()[remote_path] = (remote_id, remote_modification_date)
+        self._execute_in_transaction(
+            lambda cursor: cursor.execute(_Db_statements.UPSERT_REMOTE_DIR,
+                                          (remote_path, remote_id, remote_modification_date)))
+
+    def _forget_remote_dir_of(self, local_path):
+        '''
+        Deletes the stored remote paths of the remote dir synced with local_path and of all
+        the dirs under them, as the remote dir is deleted or moved.
+        '''
+        remote_dirs = self._get_remote_dirs()
+        if not remote_dirs:
+            return
+        def read_function(cursor):
+            final_val = cursor.execute(_Db_statements.SELECT_REMOTE_ID, (local_path,)).fetchone()
+            return final_val[0] if final_val else None
+        index = self._index
+        remote_id = index.get_remote_id(local_path) if index is not None else self._execute_read_function(read_function)
+        if remote_id is None:
+            return
+        with self._remote_dirs_lock:
+            forgotten_paths = [remote_path for remote_path, (each_id, _) in remote_dirs.items()
+                               if each_id == remote_id]
+        self._delete_remote_dirs(forgotten_paths)
+
+    @_timed('delete_remote_dirs_under')
+    def delete_remote_dirs_under(self, remote_path):
+        '''
+        Deletes the stored remote dirs of a remote path and of all the paths under it.
+        Args:
+            remote_path: 'A String' like /parent_dir/child_dir
+        '''
+        self._delete_remote_dirs([remote_path])
+
+    def _delete_remote_dirs(self, remote_paths):
+        remote_dirs = self._get_remote_dirs()
+        with self._remote_dirs_lock:
+            forgotten_paths = [remote_path for remote_path in remote_dirs
+                               if any(_is_same_or_under(remote_path, each) for each in remote_paths)]
+            for remote_path in forgotten_paths:
+                del remote_dirs[remote_path]
+        if forgotten_paths:
+            self._execute_in_transaction(
+                lambda cursor: cursor.executemany(_Db_statements.DELETE_REMOTE_DIR,
+                                                  [(remote_path,) for remote_path in forgotten_paths]))
+
+
+class DryRunDbHandler:
+    '''
+    A view of a DbHandler for planning a dry run. The records, the cached local hashes and the
+    remote dirs are read from the DbHandler, while the hashes and the remote dirs stored through
+    the view are only kept in memory, so that a dry run leaves the Db as it was.
+    '''
+
+    def __init__(self, db_handler):
+        '''
+        Args:
+            db_handler: The Db.DbHandler to read from
+        '''
+        self._db_handler = db_handler
+        self._local_hashes = {}
+        self._remote_dirs = {}
+        self._forgotten_remote_paths = []
+
+    def get_remote_file_id(self, local_path):
+        return self._db_handler.get_remote_file_id(local_path)
+
+    def get_local_file_path(self, remote_file_id):
+        return self._db_handler.get_local_file_path(remote_file_id)
+
+    def get_local_modification_date(self, local_file_path):
+        return self._db_handler.get_local_modification_date(local_file_path)
+
+    def get_remote_modification_date(self, remote_file_id):
+        return self._db_handler.get_remote_modification_date(remote_file_id)
+
+    def get_local_hash(self, device, inode, file_size, mtime_ns):
+        cache_key = (device, inode, file_size, mtime_ns)
+        if cache_key in self._local_hashes:
+            return self._local_hashes[cache_key]
+        return self._db_handler.get_local_hash(*cache_key)
+
+    def set_local_hash(self, device, inode, file_size, mtime_ns, md5_checksum):
+        self._local_hashes[(device, inode, file_size, mtime_ns)] = md5_checksum
+
+    def get_remote_dir(self, remote_path):
+        if remote_path in self._remote_dirs:
+            return self._remote_dirs[remote_path]
+        if any(_is_same_or_under(remote_path, each) for each in self._forgotten_remote_paths):
+            return None
+        return self._db_handler.get_remote_dir(remote_path)
+
+    def set_remote_dir(self, remote_path, remote_id, remote_modification_date):
+        self._remote_dirs[remote_path] = (remote_id, remote_modification_date)
+
+    def delete_remote_dirs_under(self, remote_path):
+        for each in [each for each in self._remote_dirs if _is_same_or_under(each, remote_path)]:
+            del self._remote_dirs[each]
+        self._forgotten_remote_paths.append(remote_path)
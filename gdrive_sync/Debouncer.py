@@ -0,0 +1,199 @@
+import os
+import threading
+import time
+
+from watchdog import events
+
+from gdrive_sync import utils
+
+logger = utils.create_logger(__name__)
+
+
+class _PendingEvent:
+    """
+    A file creation or modification that waits for the file to be quiescent.
+    """
+    __slots__ = ('event', 'first_seen', 'last_change', 'snapshot')
+
+    def __init__(self, event, now, snapshot):
+        self.event = event
+        self.first_seen = now
+        self.last_change = now
+        self.snapshot = snapshot
+
+
+class Debouncer:
+    """
+    Holds back the file creation and modification events of each path until the file is
+    quiescent, i.e. its size and modification time have not changed for quiet_period seconds,
+    or until max_delay seconds have passed since the first event. Then a single event is
+    forwarded for the path:
+        created + modified*   -> created
+        modified+             -> modified
+        created + modified* + deleted -> nothing
+        modified+ + deleted   -> deleted
+    A moved event re-keys the held back events of the source path to the destination path.
+    The synthetic move of a created file under a moved dir is dropped, as the held back
+    created event was re-keyed with the dir.
+    All the other events are forwarded right away.
+    """
+
+    def __init__(self, forward, quiet_period, max_delay, clock=time.monotonic):
+        """
+        Args:
+            forward: A function that takes a watchdog.events.FileSystemEvent as input argument
+            quiet_period: Float, the number of seconds a file must stay unchanged
+            max_delay: Float, the maximum number of seconds an event is held back
+            clock: A function that returns the current time in seconds
+        """
+        self._forward = forward
+        self._quiet_period = quiet_period
+        self._max_delay = max_delay
+        self._clock = clock
+        self._pending = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def start(self):
+        """
+        Starts the thread that forwards the held back events once they are due.
+        """
+        self._thread = threading.Thread(target=self._run, name='Debouncer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Forwards all the held back events and stops the thread.
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread:
+            self._thread.join()
+        self.forward_due(flush=True)
+
+    def submit(self, event):
+        """
+        Holds back or forwards the event.
+        Args:
+            event: A watchdog.events.FileSystemEvent object
+        """
+        if event.event_type in (events.EVENT_TYPE_CREATED, events.EVENT_TYPE_MODIFIED):
+            if event.is_directory:
+                if event.event_type == events.EVENT_TYPE_CREATED:
+                    self._forward(event)
+                return
+            self._hold(event)
+        elif event.event_type == events.EVENT_TYPE_DELETED:
+            with self._condition:
+                pending = self._pending.pop(event.src_path, None)
+            if pending is None or pending.event.event_type != events.EVENT_TYPE_CREATED:
+                self._forward(event)
+        elif event.event_type == events.EVENT_TYPE_MOVED:
+            self._move(event)
+        else:
+            self._forward(event)
+
+    def _hold(self, event):
+        now = self._clock()
+        snapshot = self._get_snapshot(event.src_path)
+        with self._condition:
+            pending = self._pending.get(event.src_path)
+            if pending is None:
+                self._pending[event.src_path] = _PendingEvent(event, now, snapshot)
+            else:
+                pending.last_change = now
+                pending.snapshot = snapshot
+            self._condition.notify()
+
+    def _move(self, event):
+        with self._condition:
+            pending = self._pending.pop(event.src_path, None)
+            if pending is None and event.is_synthetic:
+                dest_pending = self._pending.get(event.dest_path)
+                if dest_pending and dest_pending.event.event_type == events.EVENT_TYPE_CREATED:
+                    return
+            moved_children = {}
+            if event.is_directory:
+                src_prefix = event.src_path.rstrip(os.sep) + os.sep
+                for src_path in [each for each in self._pending if each.startswith(src_prefix)]:
+                    moved_children[src_path] = self._pending.pop(src_path)
+        # A created file that was moved before it was uploaded is created at its destination
+        if pending is None or pending.event.event_type != events.EVENT_TYPE_CREATED:
+            self._forward(event)
+        with self._condition:
+            if pending:
+                self._pending[event.dest_path] = self._rekey(pending, event.dest_path)
+            for src_path, child in moved_children.items():
+                dest_path = os.path.join(event.dest_path, os.path.relpath(src_path, event.src_path))
+                self._pending[dest_path] = self._rekey(child, dest_path)
+            self._condition.notify()
+
+    @staticmethod
+    def _rekey(pending, dest_path):
+        event_class = (events.FileCreatedEvent if pending.event.event_type == events.EVENT_TYPE_CREATED
+                       else events.FileModifiedEvent)
+        pending.event = event_class(dest_path)
+        return pending
+
+    def forward_due(self, flush=False):
+        """
+        Forwards the held back events that are due.
+        Args:
+            flush: Boolean, if True all the held back events are forwarded
+        Returns:
+            Float, the number of seconds until the next held back event may be due, None if there is none
+        """
+        now = self._clock()
+        due_events = []
+        next_check = None
+        with self._condition:
+            for src_path, pending in list(self._pending.items()):
+                overdue = now - pending.first_seen >= self._max_delay
+                if not (flush or overdue or now - pending.last_change >= self._quiet_period):
+                    deadline = min(pending.last_change + self._quiet_period, pending.first_seen + self._max_delay)
+                else:
+                    snapshot = self._get_snapshot(src_path)
+                    if snapshot is None:
+                        # The file is gone, its deleted or moved event follows
+                        del self._pending[src_path]
+                        continue
+                    if flush or overdue or snapshot == pending.snapshot:
+                        del self._pending[src_path]
+                        due_events.append(pending.event)
+                        continue
+                    # The file changed without an event, e.g. it is still being written
+                    pending.snapshot = snapshot
+                    pending.last_change = now
+                    deadline = min(now + self._quiet_period, pending.first_seen + self._max_delay)
+                next_check = deadline - now if next_check is None else min(next_check, deadline - now)
+        for event in due_events:
+            try:
+                self._forward(event)
+            except Exception:
+                logger.error('Unable to process %s:', event, exc_info=True)
+        return next_check
+
+    def _run(self):
+        next_check = None
+        while True:
+            with self._condition:
+                if self._stopped:
+                    return
+                self._condition.wait(next_check)
+                if self._stopped:
+                    return
+            next_check = self.forward_due()
+
+    @staticmethod
+    def _get_snapshot(file_path):
+        """
+        Returns:
+            A tuple of the size and the modification time in nanoseconds of the file, None if it does not exist
+        """
+        try:
+            file_stat = os.stat(file_path)
+        except OSError:
+            return None
+        return file_stat.st_size, file_stat.st_mtime_ns
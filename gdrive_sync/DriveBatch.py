@@ -0,0 +1,115 @@
+from gdrive_sync import utils, RateGovernor
+
+logger = utils.create_logger(__name__)
+
+
+class DriveBatch:
+    """
+    Collects metadata-only Drive API requests, like deletes and dir creations, and sends them
+    in batch requests of up to max_size requests, which cost one HTTP round trip each.
+    Every request has a callback that is called with the response of the request and None,
+    or with None and the exception if the request failed. The callbacks run on the thread
+    that calls add or flush.
+    """
+
+    # The maximum number of requests in a Drive API batch request
+    MAX_SIZE = 100
+
+    def __init__(self, service, max_size=MAX_SIZE, governor=None):
+        """
+        Args:
+            service: A googleapiclient.discovery.Resource object
+            max_size: Integer, the number of requests per batch request, at most MAX_SIZE
+            governor: A RateGovernor.RateGovernor object. Defaults to utils.get_rate_governor()
+        """
+        self._service = service
+        self._governor = governor if governor else utils.get_rate_governor()
+        self._max_size = min(max_size, self.MAX_SIZE)
+        self._requests = []
+
+    def __len__(self):
+        return len(self._requests)
+
+    def delete(self, remote_file_id, callback):
+        """
+        Deletes the file/directory on google drive.
+        Args:
+            remote_file_id: 'A String' id of the file/directory from google drive
+            callback: A function that takes the response and the exception as input arguments
+        """
+        self.add(self._service.files().delete(fileId=remote_file_id), callback)
+
+    def create_remote_dir(self, name, parent_dir_id, callback):
+        """
+        Creates a dir at remote.
+        Args:
+            name: 'A String' name of the remote dir
+            parent_dir_id: 'A String' id of the remote parent dir
+            callback: A function that takes the created dir object and the exception as input arguments
+        """
+        self.add(self._service.files().create(body={'parents': [parent_dir_id],
+                                                    'name': name,
+                                                    'mimeType': 'application/vnd.google-apps.folder'},
+                                              fields='id'),
+                 callback)
+
+    def add(self, request, callback):
+        """
+        Adds a request to the batch. The batch is sent once it is full.
+        Args:
+            request: A googleapiclient.http.HttpRequest object
+            callback: A function that takes the response and the exception as input arguments
+        """
+        self._requests.append((request, callback))
+        if len(self._requests) >= self._max_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Sends the collected requests and calls their callbacks. The requests the Drive API
+        throttled are sent again in a new batch request after the backoff of the RateGovernor.
+        """
+        requests, self._requests = self._requests, []
+        attempt = 0
+        while requests:
+            requests = self._send(requests, attempt < self._governor.max_retries)
+            if requests:
+                logger.debug('%s batched requests were throttled, retrying.', len(requests))
+                self._governor.backoff(attempt)
+                attempt += 1
+
+    def _send(self, requests, retry_throttled):
+        """
+        Sends the requests in one batch request.
+        Args:
+            requests: A list of tuples of the request and its callback
+            retry_throttled: Boolean, if True the callbacks of the throttled requests are not called
+        Returns:
+            The list of tuples of the throttled request and its callback, to be sent again
+        """
+        callbacks = {}
+        throttled_requests = []
+
+        def batch_callback(request_id, response, exception):
+            request, callback = callbacks.pop(request_id)
+            if exception and RateGovernor.is_throttled(getattr(getattr(exception, 'resp', None), 'status', None),
+                                                       getattr(exception, 'content', None)):
+                self._governor.throttled()
+                if retry_throttled:
+                    throttled_requests.append((request, callback))
+                    return
+            if exception:
+                logger.error('Batched request %s failed: %s', request_id, exception)
+            callback(response, exception)
+
+        batch_request = self._service.new_batch_http_request(callback=batch_callback)
+        for request_id, (request, callback) in enumerate(requests):
+            callbacks[str(request_id)] = (request, callback)
+            batch_request.add(request, request_id=str(request_id))
+        try:
+            batch_request.execute()
+        except Exception as exception:
+            logger.error('Batch request of %s requests failed:', len(requests), exc_info=True)
+            for _, callback in callbacks.values():
+                callback(None, exception)
+        return throttled_requests
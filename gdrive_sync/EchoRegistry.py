@@ -0,0 +1,205 @@
+import collections
+import os
+import threading
+import time
+
+from gdrive_sync import configs
+
+
+class _Expectation:
+    """
+    A local change made by the sync itself.
+    """
+    __slots__ = ('kind', 'snapshot', 'expires_at')
+
+    def __init__(self, kind, snapshot, expires_at):
+        self.kind = kind
+        self.snapshot = snapshot
+        self.expires_at = expires_at
+
+
+class EchoRegistry:
+    """
+    Remembers the local changes made by the sync itself, i.e. the downloaded files, the created
+    dirs and the deleted files and dirs, so that the file system events they cause are not
+    synced back to Drive. An event is an echo if the path is in the state the sync left it in:
+    a downloaded file still has the size and modification time it was written with, a created
+    dir still exists and a deleted path still does not. The events of the temporary files of
+    the downloads are echoes too.
+    An event for the path that is not an echo means that the path has been changed since, its
+    expectation is forgotten. The expectations expire after ttl seconds. They are only kept
+    while a watcher is active, as no events are seen otherwise.
+    """
+
+    DOWNLOADING = 'downloading'
+    FILE = 'file'
+    DIR = 'dir'
+    DELETED = 'deleted'
+
+    def __init__(self, ttl, clock=time.monotonic):
+        """
+        Args:
+            ttl: Float, the number of seconds an expectation is kept
+            clock: A function that returns the current time in seconds
+        """
+        self._ttl = ttl
+        self._clock = clock
+        self._expectations = collections.OrderedDict()
+        self._active = 0
+        self._lock = threading.Lock()
+
+    def activate(self):
+        """
+        Starts keeping the expectations, called when a watcher starts.
+        """
+        with self._lock:
+            self._active += 1
+
+    def deactivate(self):
+        """
+        Stops keeping the expectations once no watcher is active, called when a watcher stops.
+        """
+        with self._lock:
+            self._active = max(0, self._active - 1)
+            if not self._active:
+                self._expectations.clear()
+
+    def expect_download(self, local_file_path):
+        """
+        Registers a download into a temporary file that will replace local_file_path.
+        It must be called before the temporary file is created.
+        """
+        self._expect(local_file_path, self.DOWNLOADING)
+
+    def expect_file(self, local_file_path, file_stat):
+        """
+        Registers the content written to local_file_path.
+        Args:
+            local_file_path: 'A String' path of the local file
+            file_stat: An os.stat_result of the written file
+        """
+        self._expect(local_file_path, self.FILE, (file_stat.st_size, file_stat.st_mtime_ns))
+
+    def expect_dir(self, local_dir_path):
+        """
+        Registers the creation of a local dir. It must be called before the dir is created.
+        """
+        self._expect(local_dir_path, self.DIR)
+
+    def expect_deleted(self, local_path):
+        """
+        Registers the deletion of a local file or dir and of all the files and dirs under it.
+        It must be called before the path is deleted.
+        """
+        self._expect(local_path, self.DELETED)
+
+    def _expect(self, local_path, kind, snapshot=None):
+        with self._lock:
+            if not self._active:
+                return
+            now = self._clock()
+            while self._expectations:
+                oldest = next(iter(self._expectations.values()))
+                if oldest.expires_at > now:
+                    break
+                self._expectations.popitem(last=False)
+            self._expectations.pop(local_path, None)
+            self._expectations[local_path] = _Expectation(kind, snapshot, now + self._ttl)
+
+    def filter(self, event):
+        """
+        Args:
+            event: A watchdog.events.FileSystemEvent object
+        Returns:
+            None if the event is an echo of a change made by the sync, else the event to process.
+            The move of a temporary download file over a file changed since is a modification of the file.
+        """
+        from watchdog import events
+        with self._lock:
+            if not self._expectations:
+                return event
+            if event.event_type == events.EVENT_TYPE_MODIFIED and event.is_directory:
+                # Caused by any change of its files, and not synced anyway
+                return event
+            if event.event_type == events.EVENT_TYPE_MOVED:
+                if not self._is_temporary(event.src_path):
+                    self._forget(event.src_path, event.dest_path)
+                    return event
+                if self._is_expected(event.dest_path, event.is_directory):
+                    return None
+                self._forget(event.dest_path)
+                return events.FileModifiedEvent(event.dest_path)
+            if self._is_temporary(event.src_path):
+                return None
+            if event.event_type == events.EVENT_TYPE_DELETED:
+                if self._is_deleted(event.src_path):
+                    return None
+            elif self._is_expected(event.src_path, event.is_directory):
+                return None
+            self._forget(event.src_path)
+            return event
+
+    def _is_temporary(self, path):
+        """
+        Returns:
+            True if path is a temporary file of a download, named like .<file name>.<random>.part
+        """
+        dir_path, name = os.path.split(path)
+        if not (name.startswith('.') and name.endswith('.part')):
+            return False
+        local_file_name = name[1:-len('.part')].rpartition('.')[0]
+        expectation = self._get(os.path.join(dir_path, local_file_name))
+        return expectation is not None and expectation.kind in (self.DOWNLOADING, self.FILE)
+
+    def _is_expected(self, path, is_directory):
+        expectation = self._get(path)
+        if expectation is None:
+            return False
+        if is_directory:
+            return expectation.kind == self.DIR and os.path.isdir(path)
+        if expectation.kind != self.FILE:
+            return False
+        try:
+            file_stat = os.stat(path)
+        except OSError:
+            return False
+        return (file_stat.st_size, file_stat.st_mtime_ns) == expectation.snapshot
+
+    def _is_deleted(self, path):
+        if os.path.lexists(path):
+            return False
+        # The files and dirs under a deleted dir are deleted too
+        while True:
+            expectation = self._get(path)
+            if expectation is not None and expectation.kind == self.DELETED:
+                return True
+            parent_path = os.path.dirname(path)
+            if parent_path == path:
+                return False
+            path = parent_path
+
+    def _get(self, path):
+        expectation = self._expectations.get(path)
+        if expectation is None or expectation.expires_at <= self._clock():
+            return None
+        return expectation
+
+    def _forget(self, *paths):
+        for path in paths:
+            self._expectations.pop(path, None)
+
+
+_default_registry = None
+_default_registry_lock = threading.Lock()
+
+
+def get_default_registry():
+    """
+    Returns:
+        The EchoRegistry object shared by the whole process
+    """
+    global _default_registry
+    with _default_registry_lock:
+        if _default_registry is None:
+            _default_registry = EchoRegistry(configs.get_configs().getfloat('WATCH', 'echo_ttl'))
+        return _default_registry
@@ -0,0 +1,220 @@
+import collections
+import itertools
+import os
+import threading
+
+from watchdog import events
+
+from gdrive_sync import utils, Metrics
+
+logger = utils.create_logger(__name__)
+
+_DEPTH = Metrics.get_default_registry().gauge(
+    'gdrive_sync_event_queue_depth', 'The file system events queued or being processed.')
+_DROPPED_EVENTS = Metrics.get_default_registry().counter(
+    'gdrive_sync_event_queue_dropped_total', 'The file system events dropped because the event queue was full.')
+
+
+class _Job:
+    """
+    A queued event with the paths it touches, the number of earlier jobs it waits for and the
+    later jobs that wait for it.
+    """
+    __slots__ = ('event', 'paths', 'waiting_for', 'dependents')
+
+    def __init__(self, event):
+        self.event = event
+        if event.event_type == events.EVENT_TYPE_MOVED:
+            self.paths = (event.src_path, event.dest_path)
+        else:
+            self.paths = (event.src_path,)
+        self.waiting_for = 0
+        self.dependents = []
+
+
+def _get_ancestors(path):
+    parent_path = os.path.dirname(path)
+    while parent_path != path:
+        yield parent_path
+        path, parent_path = parent_path, os.path.dirname(parent_path)
+
+
+class EventQueue:
+    """
+    A bounded queue of file system events drained by a pool of worker threads.
+    An event waits for the events put before it on the same path, on its ancestor dirs and on
+    the files and dirs under it, so a dir is created before its files and its files are deleted
+    before it. A moved event is ordered with the events of both its source and destination paths.
+    The events of unrelated paths are processed concurrently.
+    While the queue is paused, the events are queued but not processed.
+    When the queue is full, put blocks for up to put_timeout seconds. If the queue is still
+    full, the event is dropped and on_overflow is called once the queue has drained, so that
+    the dropped changes can be recovered with a full sync.
+    """
+
+    def __init__(self, process, workers, max_size, put_timeout, on_overflow=None):
+        """
+        Args:
+            process: A function that takes a watchdog.events.FileSystemEvent as input argument
+            workers: Integer, the number of worker threads
+            max_size: Integer, the maximum number of queued and running events
+            put_timeout: Float, the maximum number of seconds put blocks on a full queue
+            on_overflow: A function without arguments, called after events were dropped
+        """
+        self._process = process
+        self._workers = workers
+        self._max_size = max_size
+        self._put_timeout = put_timeout
+        self._on_overflow = on_overflow
+        self._jobs_by_path = {}
+        # The paths with jobs under every dir
+        self._paths_under = {}
+        self._ready_jobs = collections.deque()
+        self._size = 0
+        self._running = 0
+        self._paused = 0
+        self._dropped = 0
+        self._stopped = False
+        self._condition = threading.Condition()
+        self._threads = []
+
+    def __len__(self):
+        return self._size
+
+    def start(self):
+        """
+        Starts the worker threads.
+        """
+        for i in range(self._workers):
+            thread = threading.Thread(target=self._run, name='EventQueue-{}'.format(i), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """
+        Waits for the queued events to be processed and stops the worker threads.
+        If the worker threads were not started, the queued events are processed on the calling thread.
+        """
+        with self._condition:
+            if self._threads:
+                self._condition.wait_for(lambda: not self._size)
+            self._stopped = True
+            self._condition.notify_all()
+        if not self._threads:
+            self._run()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def pause(self):
+        """
+        Waits for the events being processed and stops processing the queued events until resume is called.
+        The pauses are counted, the events are processed again once every pause is resumed.
+        """
+        with self._condition:
+            self._paused += 1
+            self._condition.wait_for(lambda: not self._running)
+
+    def resume(self):
+        """
+        Resumes processing the queued events after pause.
+        """
+        with self._condition:
+            self._paused -= 1
+            self._condition.notify_all()
+
+    def put(self, event):
+        """
+        Queues the event.
+        Args:
+            event: A watchdog.events.FileSystemEvent object
+        Returns:
+            True if the event was queued, False if it was dropped because the queue was full
+        """
+        job = _Job(event)
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._size < self._max_size, self._put_timeout):
+                self._dropped += 1
+                _DROPPED_EVENTS.inc()
+                logger.warning('The event queue is full, dropping %s.', event)
+                return False
+            self._size += 1
+            _DEPTH.inc()
+            blockers = self._get_blockers(job)
+            for blocker in blockers:
+                blocker.dependents.append(job)
+            job.waiting_for = len(blockers)
+            for each_path in job.paths:
+                path_jobs = self._jobs_by_path.get(each_path)
+                if path_jobs is None:
+                    path_jobs = self._jobs_by_path[each_path] = collections.deque()
+                    for ancestor_path in _get_ancestors(each_path):
+                        self._paths_under.setdefault(ancestor_path, set()).add(each_path)
+                path_jobs.append(job)
+            if not job.waiting_for:
+                self._ready_jobs.append(job)
+                self._condition.notify_all()
+        return True
+
+    def _get_blockers(self, job):
+        """
+        Returns:
+            The set of the latest queued or running jobs of the paths of the job, of their ancestor
+            dirs and of the paths under them. The jobs of a path wait for each other, so the earlier
+            jobs of these paths are waited for too.
+        """
+        blockers = set()
+        for each_path in job.paths:
+            for path in itertools.chain((each_path,), _get_ancestors(each_path),
+                                        self._paths_under.get(each_path, ())):
+                path_jobs = self._jobs_by_path.get(path)
+                if path_jobs:
+                    blockers.add(path_jobs[-1])
+        return blockers
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: (self._ready_jobs and not self._paused) or self._stopped)
+                if not self._ready_jobs:
+                    return
+                job = self._ready_jobs.popleft()
+                self._running += 1
+            try:
+                self._process(job.event)
+            except Exception:
+                logger.error('Unable to process %s:', job.event, exc_info=True)
+            self._complete(job)
+
+    def _complete(self, job):
+        with self._condition:
+            for each_path in job.paths:
+                path_jobs = self._jobs_by_path.get(each_path)
+                if path_jobs is None:
+                    # A move onto its own source path
+                    continue
+                path_jobs.remove(job)
+                if not path_jobs:
+                    del self._jobs_by_path[each_path]
+                    for ancestor_path in _get_ancestors(each_path):
+                        paths_under = self._paths_under[ancestor_path]
+                        paths_under.discard(each_path)
+                        if not paths_under:
+                            del self._paths_under[ancestor_path]
+            for dependent in job.dependents:
+                dependent.waiting_for -= 1
+                if not dependent.waiting_for:
+                    self._ready_jobs.append(dependent)
+            self._size -= 1
+            self._running -= 1
+            _DEPTH.dec()
+            dropped = self._dropped if not self._size else 0
+            if dropped:
+                self._dropped = 0
+            self._condition.notify_all()
+        if dropped and self._on_overflow:
+            logger.warning('%s events were dropped, recovering.', dropped)
+            try:
+                self._on_overflow()
+            except Exception:
+                logger.error('Unable to recover the dropped events:', exc_info=True)
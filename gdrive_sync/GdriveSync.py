@@ -1,11 +1,18 @@
+import argparse
 from os import path
-from watchdog import observers
-from gdrive_sync import utils, LocalFSEventHandler, Db
+from gdrive_sync import configs, utils, LocalFSEventHandler, Db, DriveBatch, Metrics, RemoteTreeWalker, ServicePool, \
+    SyncPlan, TransferEngine, TreeDiff
+import threading
 import time
 import os
 
 logger = utils.create_logger(__name__)
 
+_DRIVE_ITEM_COUNT = 'drive_item_count'
+
+_SYNC_PASS_SECONDS = Metrics.get_default_registry().histogram(
+    'gdrive_sync_sync_pass_seconds', 'The duration of the sync passes over all the synced dirs.', ('dry_run',))
+
 
 class GdriveSync:
     """
@@ -15,9 +22,13 @@ class GdriveSync:
 
     def __init__(self):
         self._local_dir_observer_dict = {}
+        self._local_dir_event_handler_dict = {}
         self._db_handler = Db.DbHandler()
+        self._remote_tree_walker = None
+        self._transfer_engine = None
+        self._sync_lock = threading.Lock()
 
-    def _process_dir_pairs(self, service, dir_pairs):
+    def _process_dir_pairs(self, service, dir_pairs, dry_run=False):
         """
         Syncs the local and remote dirs with each other.
         Also saves the local_dir_paths and remote_dir_ids in the Db
@@ -26,244 +37,391 @@ class GdriveSync:
             service: A googleapiclient.discovery.Resource object
             dir_pairs = A Dict of local dirs and remote dirs. It can be obtained by below:
                 "utils.get_user_settings()['synced_dirs']"
+            dry_run: Boolean, if True the changes are only planned
+        Returns:
+            The SyncPlan.SyncPlan of the changes
+        """
+        plan = self._plan_dir_pairs(service, dir_pairs, dry_run)
+        if not dry_run:
+            self._execute_plan(service, plan)
+        return plan
+
+    def _plan_dir_pairs(self, service, dir_pairs, dry_run=False):
         """
+        Compares the local and remote dirs and plans the changes that sync them,
+        without changing anything. Only the caches in the Db are updated, unless it is a dry run.
+
+        Args:
+            service: A googleapiclient.discovery.Resource object
+            dir_pairs = A Dict of local dirs and remote dirs
+            dry_run: Boolean, if True the Db is not changed
+        Returns:
+            A SyncPlan.SyncPlan
+        """
+        plan = SyncPlan.SyncPlan()
+        db_handler = Db.DryRunDbHandler(self._db_handler) if dry_run else self._db_handler
+        remote_tree = None
+        if self._should_list_whole_drive(dir_pairs):
+            logger.debug('Listing the whole drive.')
+            remote_tree = utils.list_all_remote_files(service,
+                                                      configs.get_configs().getint('REMOTE', 'listing_page_size'))
+            if not dry_run:
+                self._db_handler.set_state(_DRIVE_ITEM_COUNT,
+                                           str(sum(len(files) for files in remote_tree.values())))
+
         for local_dir, remote_dir in dir_pairs.items():
-            remote_dir = utils.get_remote_dir(service,
-                                              'root',
-                                              remote_dir.split('/')[1:])
-            self._db_handler.insert_record(local_dir,
-                                           remote_dir['id'],
-                                           os.stat(local_dir).st_mtime,
-                                           utils.convert_rfc3339_time_to_epoch(remote_dir['modifiedTime']))
-            remote_files_under_dir = utils.list_remote_files_from_dir(service,
-                                                                      remote_dir['id'])
+            remote_dir = utils.resolve_remote_dir(service, remote_dir, db_handler)
+            plan.add(SyncPlan.SyncAction(SyncPlan.SyncAction.RECORD,
+                                         local_dir,
+                                         remote_id=remote_dir['id'],
+                                         local_modification_date=os.stat(local_dir).st_mtime,
+                                         remote_modification_date=utils.convert_rfc3339_time_to_epoch(
+                                             remote_dir['modifiedTime'])))
+            if remote_tree is not None:
+                remote_files_under_dir = utils.list_remote_files_from_tree(remote_tree,
+                                                                           remote_dir['id'])
+            elif self._remote_tree_walker:
+                remote_files_under_dir = self._remote_tree_walker.list_remote_files_from_dir(remote_dir['id'])
+            else:
+                remote_files_under_dir = utils.list_remote_files_from_dir(service,
+                                                                          remote_dir['id'])
             local_files_under_dir = utils.list_files_under_local_dir(local_dir)
-            self._compare_and_sync_files(service,
-                                         remote_files_under_dir,
-                                         remote_dir['id'],
-                                         local_files_under_dir,
-                                         local_dir)
-
-    def _compare_and_sync_files(self,
-                                service,
-                                remote_files,
-                                remote_parent_dir_id,
-                                local_files,
-                                local_parent_dir):
+            self._compare_files(plan,
+                                remote_files_under_dir,
+                                remote_dir['id'],
+                                local_files_under_dir,
+                                local_dir,
+                                db_handler)
+        return plan
+
+    def _should_list_whole_drive(self, dir_pairs):
         """
-        Compares the local and remote files by name and modification date
-        and whichever is last modified replaces the other one with same name.
-
-        It also saves the local_file_paths and remote_file_ids to Db.
+        Decides whether the remote files are listed with a single paginated query over the
+        whole drive instead of one query per remote dir. That is the case when the synced
+        dirs hold a large share of the drive, going by the number of records in the Db and
+        the number of drive items seen by the last whole drive listing. If the drive has
+        never been listed whole, the synced dirs have to be large on their own.
 
-        TODO: If it's a directory, then the containing files are compared instead.
+        Args:
+            dir_pairs = A Dict of local dirs and remote dirs
+        Returns:
+            True if the whole drive is to be listed
+        """
+        synced_item_count = sum(self._db_handler.count_records_under(local_dir) or 0
+                                for local_dir in dir_pairs)
+        drive_item_count = self._db_handler.get_state(_DRIVE_ITEM_COUNT)
+        if drive_item_count is None:
+            return synced_item_count >= configs.get_configs().getint('REMOTE', 'whole_drive_listing_min_items')
+        return synced_item_count >= (configs.get_configs().getfloat('REMOTE', 'whole_drive_listing_ratio') *
+                                     int(drive_item_count))
+
+    def _compare_files(self,
+                       plan,
+                       remote_files,
+                       remote_parent_dir_id,
+                       local_files,
+                       local_parent_dir,
+                       db_handler=None):
+        """
+        Compares the local and remote files with the TreeDiff and plans the changes that sync them.
+        Of two files with the same name, whichever is last modified replaces the other one.
+        If it's a directory, then the containing files are compared instead.
 
         Args:
-            service: A googleapiclient.discovery.Resource object
+            plan: The SyncPlan.SyncPlan to add the changes to
             remote_files: A generator of objects has the below format
                 {
                 'id': 'A String' that represents the id of the remote file
                 'name': 'A String' that represents the name of the remote file
                 'modifiedTime': 'A String' that represents the last modifiedTime
                     of the remote file in rfc3339 format
+                'size': 'A String' that represents the size of the remote file in bytes
                 }
             remote_parent_dir_id: 'A String' representing the parent dir id for the remote_files
-            local_files: A list of os.DirEntry
+            local_files: A generator of LocalScanner.LocalEntry
             local_parent_dir: 'A String' representing the parent dir for the local_files
+            db_handler: The Db.DbHandler or Db.DryRunDbHandler with the records of the synced files.
+                Defaults to the DbHandler of the sync
         """
-        local_file_dict = {}
-        for file in local_files:
-            if type(file) == dict:
-                key = next(iter(file))
-                local_file_dict[key.name] = file[key]
-            else:
-                local_file_dict[file.name] = file
-
-        for each_remote_entry in remote_files:
-
-            # If remote file is a dir
-            if each_remote_entry['mimeType'] == 'application/vnd.google-apps.folder':
-                tmp_local_files = []
-
-                # If remote dir is not created in local
-                if not each_remote_entry['name'] in local_file_dict:
-                    local_dir_path = path.join(local_parent_dir, each_remote_entry['name'])
-
-                    if self._db_handler.get_local_file_path(each_remote_entry['id']):
-                        logger.debug('Dir %s was removed from local.', local_dir_path)
-
-                        utils.delete_file_on_remote(each_remote_entry['id'])
-
-                        self._db_handler.delete_record(local_dir_path)
-
-                        continue
-                    else:
-                        logger.debug('Creating dir %s in local.', local_dir_path)
-
-                        utils.create_local_dir(local_dir_path)
-
-                        self._db_handler.insert_record(local_dir_path,
-                                                       each_remote_entry['id'],
-                                                       int(time.time()),
-                                                       utils.convert_rfc3339_time_to_epoch(
-                                                           each_remote_entry['modifiedTime']))
-                else:
-                    tmp_local_files = local_file_dict[each_remote_entry['name']]
-                    del local_file_dict[each_remote_entry['name']]
-
-                self._compare_and_sync_files(service,
-                                             each_remote_entry['children'],
-                                             each_remote_entry['id'],
-                                             tmp_local_files,
-                                             os.path.join(local_parent_dir, each_remote_entry['name']))
-
-            # If remote file exists in local
-            elif each_remote_entry['name'] in local_file_dict:
-                local_file = local_file_dict[each_remote_entry['name']]
-
-                remote_file_modified_time = utils.convert_rfc3339_time_to_epoch(
-                    each_remote_entry['modifiedTime'])
-
-                # If local file modification time is newer than remote file modification time
-                if local_file.stat().st_mtime > remote_file_modified_time:
-
-                    local_modification_date_in_db = self._db_handler.get_local_modification_date(local_file.path)
-                    actual_local_modification_date = int(local_file.stat().st_mtime)
-
-                    # If local file modification time is newer than saved in db else don't do anything
-                    # This cancels the cases where remote file was earlier copied to local
-                    if (not local_modification_date_in_db or
-                            actual_local_modification_date > local_modification_date_in_db):
-                        logger.debug('local_file.stat().st_mtime %s, local_modification_date_in_db %s.',
-                                     local_file.stat().st_mtime,
-                                     local_modification_date_in_db)
-                        logger.debug('Overwriting %s in remote.', local_file.path)
-
-                        utils.overwrite_remote_file_with_local(service,
-                                                               each_remote_entry['id'],
-                                                               local_file.path)
-
-                        self._db_handler.insert_record(local_file.path,
-                                                       each_remote_entry['id'],
-                                                       actual_local_modification_date,
-                                                       int(time.time()))
-
-                # If remote file modification time is newer than local file modification time
-                elif remote_file_modified_time > local_file.stat().st_mtime:
-
-                    remote_file_modification_time_in_db = self._db_handler.get_remote_modification_date(
-                        each_remote_entry['id'])
-
-                    # If remote file modification time is newer than saved in db
-                    # This cancels the cases where local file was earlier copied to remote
-                    if (not remote_file_modification_time_in_db or
-                            remote_file_modified_time > remote_file_modification_time_in_db):
-                        logger.debug('remote_file_modified_time %s, remote_file_modification_time_in_db %s.',
-                                     remote_file_modified_time,
-                                     remote_file_modification_time_in_db)
-                        logger.debug('Overwriting %s in local.', local_file.path)
-
-                        utils.copy_remote_file_to_local(service,
-                                                        local_file.path,
-                                                        each_remote_entry['id'])
-
-                        self._db_handler.insert_record(local_file.path,
-                                                       each_remote_entry['id'],
-                                                       int(time.time()),
-                                                       remote_file_modified_time)
-                del local_file_dict[each_remote_entry['name']]
-
-            else:  # remote file does not exist in local
-
-                local_file_path = path.join(local_parent_dir, each_remote_entry['name'])
+        tree_diff = TreeDiff.TreeDiff(db_handler if db_handler else self._db_handler)
+        for change in tree_diff.diff(local_files, remote_files, local_parent_dir, remote_parent_dir_id):
+            action = self._get_sync_action(change)
+            if action:
+                plan.add(action)
+
+    @staticmethod
+    def _get_sync_action(change):
+        """
+        Args:
+            change: A TreeDiff.Change
+        Returns:
+            The SyncPlan.SyncAction that applies the change, None if there is nothing to do
+        """
+        local_entry = change.local_entry
+        remote_entry = change.remote_entry
+        if change.kind == TreeDiff.Change.CREATE_LOCAL:
+            if change.is_dir:
+                return SyncPlan.SyncAction(SyncPlan.SyncAction.CREATE_LOCAL_DIR,
+                                           change.local_path,
+                                           remote_id=remote_entry['id'],
+                                           remote_modification_date=change.remote_modification_date)
+            return SyncPlan.SyncAction(SyncPlan.SyncAction.DOWNLOAD,
+                                       change.local_path,
+                                       remote_id=remote_entry['id'],
+                                       size=int(remote_entry.get('size', 0)),
+                                       remote_modification_date=change.remote_modification_date)
+        if change.kind == TreeDiff.Change.CREATE_REMOTE:
+            if change.is_dir:
+                return SyncPlan.SyncAction(SyncPlan.SyncAction.CREATE_REMOTE_DIR,
+                                           change.local_path,
+                                           remote_parent_id=change.remote_parent_id,
+                                           local_modification_date=local_entry.mtime)
+            return SyncPlan.SyncAction(SyncPlan.SyncAction.UPLOAD,
+                                       change.local_path,
+                                       remote_parent_id=change.remote_parent_id,
+                                       size=local_entry.size,
+                                       local_modification_date=local_entry.mtime)
+        if change.kind == TreeDiff.Change.UPDATE_LOCAL:
+            return SyncPlan.SyncAction(SyncPlan.SyncAction.DOWNLOAD,
+                                       change.local_path,
+                                       remote_id=remote_entry['id'],
+                                       size=int(remote_entry.get('size', 0)),
+                                       remote_modification_date=change.remote_modification_date)
+        if change.kind == TreeDiff.Change.UPDATE_REMOTE:
+            return SyncPlan.SyncAction(SyncPlan.SyncAction.OVERWRITE_REMOTE,
+                                       change.local_path,
+                                       remote_id=remote_entry['id'],
+                                       size=local_entry.size,
+                                       local_modification_date=local_entry.mtime)
+        if change.kind == TreeDiff.Change.DELETE_LOCAL:
+            return SyncPlan.SyncAction(SyncPlan.SyncAction.DELETE_LOCAL, change.local_path)
+        if change.kind == TreeDiff.Change.DELETE_REMOTE:
+            return SyncPlan.SyncAction(SyncPlan.SyncAction.DELETE_REMOTE,
+                                       change.local_path,
+                                       remote_id=remote_entry['id'])
+        if change.kind == TreeDiff.Change.RECORD:
+            return SyncPlan.SyncAction(SyncPlan.SyncAction.RECORD,
+                                       change.local_path,
+                                       remote_id=remote_entry['id'],
+                                       local_modification_date=local_entry.mtime,
+                                       remote_modification_date=change.remote_modification_date)
+        return None
+
+    def _execute_plan(self, service, plan):
+        """
+        Applies the changes of the plan in SyncPlan.EXECUTION_ORDER, and saves the records of the
+        synced files and dirs in the Db. The file transfers run on the TransferEngine, the remote
+        dir creations and deletions are sent in DriveBatch batch requests.
 
-                if self._db_handler.get_local_file_path(each_remote_entry['id']):
-                    logger.debug('File %s was removed from local.', local_file_path)
-
-                    utils.delete_file_on_remote(each_remote_entry['id'])
-
-                    self._db_handler.delete_record(local_file_path)
-
-                else:
-                    logger.debug('Creating %s in local.', local_file_path)
-
-                    utils.copy_remote_file_to_local(service,
-                                                    local_file_path,
-                                                    each_remote_entry['id'])
-                    self._db_handler.insert_record(local_file_path,
-                                                   each_remote_entry['id'],
-                                                   int(time.time()),
-                                                   utils.convert_rfc3339_time_to_epoch(
-                                                       each_remote_entry['modifiedTime']))
-
-        # copy the local files that do not exist at remote
-        self._copy_local_to_remote(local_file_dict, remote_parent_dir_id, service)
-
-    def _copy_local_to_remote(self, local_file_dict, remote_parent_dir_id, service):
-        for file_name, local_file in local_file_dict.items():
-
-            if type(local_file) == dict:
-                dir_key = next(iter(local_file))
-
-                if self._db_handler.get_remote_file_id(dir_key.path):
-                    logger.debug('Remote dir %s was deleted.', dir_key.path)
-                    utils.delete_file_from_local(dir_key.path)
-                    self._db_handler.delete_record(dir_key.path)
-
-                else:
-                    logger.debug('Creating dir %s at remote.', dir_key.path)
-                    remote_dir_id = utils.create_remote_dir(file_name, remote_parent_dir_id)
-                    self._db_handler.insert_record(dir_key.path,
-                                                   remote_dir_id,
-                                                   dir_key.stat().st_mtime,
-                                                   int(time.time()))
-                    self._copy_local_to_remote({file.name: file for file in local_file[dir_key]},
-                                               remote_dir_id,
-                                               service)
-            else:
-                if self._db_handler.get_remote_file_id(local_file.path):
-                    logger.debug('Remote dir %s was deleted.', local_file.path)
-                    utils.delete_file_from_local(local_file.path)
-                    self._db_handler.delete_record(local_file.path)
-
-                else:
-                    logger.debug('Creating file %s at remote.', local_file.path)
-
-                    remote_file_id = utils.copy_local_file_to_remote(local_file.path,
-                                                                     remote_parent_dir_id,
-                                                                     service)
-                    self._db_handler.insert_record(local_file.path,
-                                                   remote_file_id,
-                                                   local_file.stat().st_mtime,
+        Args:
+            service: A googleapiclient.discovery.Resource object
+            plan: A SyncPlan.SyncPlan
+        """
+        drive_batch = DriveBatch.DriveBatch(service, configs.get_configs().getint('REMOTE', 'batch_size'))
+        created_remote_dir_ids = {}
+        batched_remote_dirs = set()
+
+        def get_remote_parent_id(action):
+            if action.remote_parent_id:
+                return action.remote_parent_id
+            local_parent_dir = path.dirname(action.local_path)
+            if local_parent_dir in batched_remote_dirs:
+                # The parent dir is created by the collected batch
+                drive_batch.flush()
+            return (created_remote_dir_ids.get(local_parent_dir) or
+                    self._db_handler.get_remote_file_id(local_parent_dir))
+
+        def remote_dir_created_callback(local_path, local_modification_date):
+            def callback(remote_dir, exception):
+                batched_remote_dirs.discard(local_path)
+                if not exception:
+                    created_remote_dir_ids[local_path] = remote_dir['id']
+                    self._db_handler.insert_record(local_path,
+                                                   remote_dir['id'],
+                                                   local_modification_date,
                                                    int(time.time()))
+            return callback
+
+        def remote_deleted_callback(local_path):
+            def callback(response, exception):
+                # A file that is already gone from remote counts as deleted
+                if not exception or getattr(getattr(exception, 'resp', None), 'status', None) == 404:
+                    self._db_handler.delete_record(local_path)
+            return callback
+
+        for action in plan.ordered_actions():
+            if action.kind == SyncPlan.SyncAction.RECORD:
+                self._db_handler.insert_record(action.local_path,
+                                               action.remote_id,
+                                               action.local_modification_date,
+                                               action.remote_modification_date)
+
+            elif action.kind == SyncPlan.SyncAction.CREATE_LOCAL_DIR:
+                logger.debug('Creating dir %s in local.', action.local_path)
+                utils.create_local_dir(action.local_path)
+                self._db_handler.insert_record(action.local_path,
+                                               action.remote_id,
+                                               int(time.time()),
+                                               action.remote_modification_date)
+
+            elif action.kind == SyncPlan.SyncAction.CREATE_REMOTE_DIR:
+                logger.debug('Creating dir %s at remote.', action.local_path)
+                remote_parent_id = get_remote_parent_id(action)
+                if not remote_parent_id:
+                    logger.warning('Skipping %s, its parent dir was not created at remote.', action.local_path)
+                    continue
+                batched_remote_dirs.add(action.local_path)
+                drive_batch.create_remote_dir(path.basename(action.local_path),
+                                              remote_parent_id,
+                                              remote_dir_created_callback(action.local_path,
+                                                                          action.local_modification_date))
+
+            elif action.kind == SyncPlan.SyncAction.UPLOAD:
+                logger.debug('Creating file %s at remote.', action.local_path)
+                remote_parent_id = get_remote_parent_id(action)
+                if not remote_parent_id:
+                    logger.warning('Skipping %s, its parent dir was not created at remote.', action.local_path)
+                    continue
+                self._transfer_engine.submit_upload(
+                    action.local_path,
+                    remote_parent_id,
+                    self._insert_record_callback(action.local_path,
+                                                 local_modification_date=action.local_modification_date))
+
+            elif action.kind == SyncPlan.SyncAction.OVERWRITE_REMOTE:
+                logger.debug('Overwriting %s in remote.', action.local_path)
+                self._transfer_engine.submit_overwrite(
+                    action.remote_id,
+                    action.local_path,
+                    self._insert_record_callback(action.local_path,
+                                                 action.remote_id,
+                                                 local_modification_date=action.local_modification_date))
+
+            elif action.kind == SyncPlan.SyncAction.DOWNLOAD:
+                logger.debug('Copying %s to local.', action.local_path)
+                self._transfer_engine.submit_download(
+                    action.remote_id,
+                    action.local_path,
+                    self._insert_record_callback(action.local_path,
+                                                 action.remote_id,
+                                                 remote_modification_date=action.remote_modification_date),
+                    file_size=action.size)
+
+            elif action.kind == SyncPlan.SyncAction.DELETE_REMOTE:
+                logger.debug('%s was removed from local.', action.local_path)
+                drive_batch.delete(action.remote_id, remote_deleted_callback(action.local_path))
+
+            elif action.kind == SyncPlan.SyncAction.DELETE_LOCAL:
+                logger.debug('%s was removed from remote.', action.local_path)
+                utils.delete_file_from_local(action.local_path)
+                self._db_handler.delete_record(action.local_path)
+
+        drive_batch.flush()
+        # Waits for the transfers so that their records are saved before returning
+        self._transfer_engine.join()
+
+    def _insert_record_callback(self,
+                                local_path,
+                                remote_id=None,
+                                local_modification_date=None,
+                                remote_modification_date=None):
+        """
+        Creates the TransferEngine callback that saves the record of a transferred file in the Db.
 
-    def sync_onetime(self, synced_dirs_dict):
+        Args:
+            local_path: 'A String' path of the local file
+            remote_id: 'A String' id of the remote file. If None, the result of the job is the id
+            local_modification_date: Integer. If None, the time of completion is saved
+            remote_modification_date: Integer. If None, the time of completion is saved
+        Returns:
+            A function that takes the result of the job as input argument
+        """
+        def callback(result):
+            time_now = int(time.time())
+            self._db_handler.insert_record(local_path,
+                                           result if remote_id is None else remote_id,
+                                           time_now if local_modification_date is None else local_modification_date,
+                                           time_now if remote_modification_date is None else remote_modification_date)
+        return callback
+
+    def sync_onetime(self, synced_dirs_dict, dry_run=False):
         """
         Collects the local vs remote directory mappings from user directory and
         synchronizes the local and remote directories.
 
         Args:
             synced_dirs_dict: A dict comprises of local vs remote dir pairs from settings
+            dry_run: Boolean, if True the changes are only planned and nothing is changed
+        Returns:
+            The SyncPlan.SyncPlan of the changes
         """
-        service = utils.get_service()
-        self._process_dir_pairs(service, synced_dirs_dict)
+        started = time.perf_counter()
+        service = utils.get_pooled_service()
+        self._db_handler.load_index()
+        listing_workers = configs.get_configs().getint('REMOTE', 'listing_workers')
+        if listing_workers:
+            self._remote_tree_walker = RemoteTreeWalker.RemoteTreeWalker(
+                listing_workers, configs.get_configs().getint('REMOTE', 'listing_lookahead'))
+        transfer_workers = configs.get_configs().getint('TRANSFER', 'workers')
+        self._transfer_engine = TransferEngine.TransferEngine(
+            transfer_workers,
+            service_factory=None if transfer_workers else lambda: service,
+            upload_sessions=self._db_handler)
+        try:
+            with self._db_handler.batch():
+                try:
+                    return self._process_dir_pairs(service, synced_dirs_dict, dry_run)
+                finally:
+                    # Waits for the transfers so that their records are saved within the batch
+                    self._transfer_engine.close()
+        finally:
+            self._transfer_engine = None
+            if self._remote_tree_walker:
+                self._remote_tree_walker.close()
+                self._remote_tree_walker = None
+            _SYNC_PASS_SECONDS.observe(time.perf_counter() - started, dry_run=dry_run)
 
     def _watch_local_dir(self, dir_to_watch):
         """
         It listens for the given directory and if any file/directory change event happens, it syncs
         the change with the remote. It returns the observer object after starting it.
-        It should be run after _compare_and_sync_files to populate the Db first.
+        It should be run after sync_onetime to populate the Db first.
         Args:
             dir_to_watch: 'A String' that represents the path to the directory to watch
         Returns:
             An object of watchdog.observers.Observer.
         """
-        event_handler = LocalFSEventHandler.LocalFSEventHandler(self._db_handler)
+        # The observers are only needed when watching, not by a one-shot sync
+        from watchdog import observers
+        event_handler = LocalFSEventHandler.LocalFSEventHandler(self._db_handler,
+                                                                on_overflow=lambda: self._resync_dir(dir_to_watch))
+        event_handler.start()
+        self._local_dir_event_handler_dict[dir_to_watch] = event_handler
         observer = observers.Observer()
         observer.schedule(event_handler, dir_to_watch, recursive=True)
         observer.start()
         return observer
 
+    def _resync_dir(self, local_dir):
+        """
+        Syncs a watched dir again, after its event handler had to drop events.
+        The event handlers of all the watched dirs are paused meanwhile, as their writes on
+        other Db connections would wait for the transactions of the DbHandler.batch of the sync.
+
+        Args:
+            local_dir: 'A String' path of the watched local dir
+        """
+        logger.info('Syncing %s again.', local_dir)
+        with self._sync_lock:
+            event_handlers = list(self._local_dir_event_handler_dict.values())
+            for event_handler in event_handlers:
+                event_handler.pause()
+            try:
+                self.sync_onetime({local_dir: utils.get_user_settings()['synced_dirs'][local_dir]})
+            finally:
+                for event_handler in event_handlers:
+                    event_handler.resume()
+
     def start_sync(self):  # TODO: Write test
         """
         This is the method to be invoked for starting the sync.
@@ -274,6 +432,7 @@ class GdriveSync:
         Returns:
             A dict of local_dir_path in String and the observer.Observer objects
         """
+        Metrics.start_default_exporter()
         synced_dirs_from_settings = utils.get_user_settings()['synced_dirs']
         self.sync_onetime(synced_dirs_from_settings)
         for local_dir in synced_dirs_from_settings.keys():
@@ -283,5 +442,49 @@ class GdriveSync:
         """
         This is to stop the sync and shutdown all the observers
         """
-        for observer in self._local_dir_observer_dict.keys():
+        for observer in self._local_dir_observer_dict.values():
             observer.stop()
+        for local_dir, observer in self._local_dir_observer_dict.items():
+            observer.join()
+            event_handler = self._local_dir_event_handler_dict.pop(local_dir, None)
+            if event_handler:
+                event_handler.stop()
+        ServicePool.stop_default_pool()
+        Metrics.stop_default_exporter()
+
+
+def main():
+    """
+    Entry point of the gdrive-sync command. Syncs the dirs from the user settings and
+    keeps watching them, or with --dry-run, prints the plan of a sync pass and its estimated cost.
+    """
+    parser = argparse.ArgumentParser(description=configs.get_config('DEFAULT', 'application_name'))
+    parser.add_argument('--dry-run', action='store_true',
+                        help='print the changes of a sync pass and their estimated cost, without applying them')
+    parser.add_argument('--json', action='store_true',
+                        help='with --dry-run, print the plan as JSON')
+    args = parser.parse_args()
+
+    gdrive_sync = GdriveSync()
+    if args.dry_run:
+        plan = gdrive_sync.sync_onetime(utils.get_user_settings()['synced_dirs'], dry_run=True)
+        if args.json:
+            print(plan.to_json())
+        else:
+            print(plan.summary(configs.get_configs().getfloat('PLAN', 'estimated_upload_rate'),
+                               configs.get_configs().getfloat('PLAN', 'estimated_download_rate'),
+                               configs.get_configs().getfloat('PLAN', 'estimated_request_seconds'),
+                               max(configs.get_configs().getint('TRANSFER', 'workers'), 1)))
+        return
+
+    gdrive_sync.start_sync()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        logger.info('Interrupted')
+    gdrive_sync.stop_sync()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,79 @@
 from watchdog.events import FileSystemEventHandler
-from gdrive_sync import utils
+from gdrive_sync import configs, utils, Debouncer, EventQueue, Metrics
 import os
 import time
 
 logger = utils.create_logger(__name__)
 
+_EVENTS = Metrics.get_default_registry().counter(
+    'gdrive_sync_watch_events_total', 'The file system events seen by the watchers, by type and whether they '
+    'were accepted or dropped as echoes of the sync.', ('type', 'outcome'))
+
 
 class LocalFSEventHandler(FileSystemEventHandler):
 
-    def __init__(self, db_handler):
+    def __init__(self, db_handler, on_overflow=None, echo_registry=None):
         '''
         Args:
             db_handler: An object of Db.DbHandler
+            on_overflow: A function without arguments, called after events were dropped from the full event queue
+            echo_registry: The EchoRegistry.EchoRegistry with the local changes made by the sync, whose
+                events are dropped. Defaults to utils.get_echo_registry()
         '''
         FileSystemEventHandler.__init__(self)
         self._db_handler = db_handler
+        self._echo_registry = echo_registry if echo_registry else utils.get_echo_registry()
+        self._event_queue = EventQueue.EventQueue(lambda event: FileSystemEventHandler.dispatch(self, event),
+                                                  configs.get_configs().getint('WATCH', 'event_workers'),
+                                                  configs.get_configs().getint('WATCH', 'event_queue_size'),
+                                                  configs.get_configs().getfloat('WATCH', 'event_queue_timeout'),
+                                                  on_overflow)
+        self._debouncer = Debouncer.Debouncer(self._event_queue.put,
+                                              configs.get_configs().getfloat('WATCH', 'quiet_period'),
+                                              configs.get_configs().getfloat('WATCH', 'max_delay'))
+
+    def start(self):
+        '''
+        Starts processing the file events. It should be called before the handler
+        is scheduled on an observer.
+        '''
+        self._echo_registry.activate()
+        self._event_queue.start()
+        self._debouncer.start()
+
+    def stop(self):
+        '''
+        Processes the held back and queued file events and stops. It should be called after the observer is stopped.
+        '''
+        self._debouncer.stop()
+        self._event_queue.stop()
+        self._echo_registry.deactivate()
+
+    def pause(self):
+        '''
+        Waits for the file events being processed and holds back the others until resume is called.
+        '''
+        self._event_queue.pause()
+
+    def resume(self):
+        '''
+        Resumes processing the file events after pause.
+        '''
+        self._event_queue.resume()
+
+    def dispatch(self, event):
+        '''
+        Passes the event through the debouncer to the event queue, whose workers call the on_* methods.
+        It returns right away, so the observer thread never waits for the Drive API.
+        The echoes of the local changes made by the sync are dropped.
+        '''
+        filtered_event = self._echo_registry.filter(event)
+        if filtered_event is None:
+            _EVENTS.inc(type=event.event_type, outcome='echo')
+            logger.debug('Dropping %s, it was caused by the sync.', event)
+            return
+        _EVENTS.inc(type=event.event_type, outcome='accepted')
+        self._debouncer.submit(filtered_event)
 
     def on_any_event(self, event):
         pass
@@ -27,7 +86,8 @@ class LocalFSEventHandler(FileSystemEventHandler):
                                                 parent_dir_name)
         else:
             remote_id = utils.copy_local_file_to_remote(event.src_path,
-                                                        parent_dir_name)
+                                                        parent_dir_name,
+                                                        upload_sessions=self._db_handler)
         time_now = int(time.time())
         self._db_handler.insert_record(event.src_path,
                                        remote_id,
@@ -46,7 +106,8 @@ class LocalFSEventHandler(FileSystemEventHandler):
         else:
             remote_id = self._db_handler.get_remote_file_id(event.src_path)
             utils.update_remote_file(remote_id,
-                                     event.src_path)
+                                     event.src_path,
+                                     upload_sessions=self._db_handler)
             time_now = int(time.time())
             self._db_handler.update_record(event.src_path,
                                            remote_id,
@@ -55,17 +116,35 @@ class LocalFSEventHandler(FileSystemEventHandler):
 
     def on_moved(self, event):
         logger.debug('Moved from %s to %s', event.src_path, event.dest_path)
-        utils.delete_file_on_remote(self._db_handler.get_remote_file_id(event.src_path))
-        parent_dir_name = self._db_handler.get_remote_file_id(os.path.dirname(event.src_path))
-        self._db_handler.delete_record(event.src_path)
+        # watchdog follows the move of a dir with a synthetic move of every file and dir under it.
+        # Those were moved at remote and in the Db with the dir, unless the dir was never synced.
+        if event.is_synthetic and self._db_handler.get_remote_file_id(event.dest_path):
+            logger.debug('Skipping %s, it was moved with its dir.', event.src_path)
+            return
+        remote_id = self._db_handler.get_remote_file_id(event.src_path)
+        new_parent_dir_id = self._db_handler.get_remote_file_id(os.path.dirname(event.dest_path))
+        if not remote_id:
+            # The source was never synced, it is synced as a new file or dir at the destination
+            if event.is_directory:
+                remote_id = utils.create_remote_dir(os.path.basename(event.dest_path),
+                                                    new_parent_dir_id)
+            else:
+                remote_id = utils.copy_local_file_to_remote(event.dest_path, new_parent_dir_id,
+                                                            upload_sessions=self._db_handler)
+            time_now = int(time.time())
+            self._db_handler.insert_record(event.dest_path,
+                                           remote_id,
+                                           time_now,
+                                           time_now)
+            return
 
-        if event.is_directory:
-            remote_id = utils.create_remote_dir(os.path.basename(event.src_path),
-                                                parent_dir_name)
-        else:
-            remote_id = utils.copy_local_file_to_remote(event.dest_path, parent_dir_name)
-        time_now = int(time.time())
-        self._db_handler.insert_record(event.dest_path,
+        remote_file = utils.move_remote_file(remote_id,
+                                             os.path.basename(event.dest_path),
+                                             new_parent_dir_id,
+                                             self._db_handler.get_remote_file_id(os.path.dirname(event.src_path)))
+        self._db_handler.move_records(event.src_path, event.dest_path)
+        # The move changes the remote modification date, not the content
+        self._db_handler.update_record(event.dest_path,
                                        remote_id,
-                                       time_now,
-                                       time_now)
+                                       self._db_handler.get_local_modification_date(event.dest_path),
+                                       utils.convert_rfc3339_time_to_epoch(remote_file['modifiedTime']))
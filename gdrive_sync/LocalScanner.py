@@ -0,0 +1,97 @@
+import os
+import stat
+
+from gdrive_sync import configs, utils
+
+logger = utils.create_logger(__name__)
+
+
+class LocalEntry:
+    """
+    A compact record of a local file or dir, filled from a single stat call.
+    The children of a dir are scanned lazily, when the generator is consumed.
+    """
+
+    __slots__ = ('name', 'path', 'relative_path', 'size', 'mtime', 'mtime_ns', 'inode', 'device', 'is_dir',
+                 'children')
+
+    def __init__(self, name, path, relative_path, file_stat, children=None):
+        """
+        Args:
+            name: 'A String' name of the file
+            path: 'A String' path of the file
+            relative_path: 'A String' path of the file relative to the scanned dir
+            file_stat: An os.stat_result of the file
+            children: A generator of the LocalEntry objects under a dir, None for a file
+        """
+        self.name = name
+        self.path = path
+        self.relative_path = relative_path
+        self.size = file_stat.st_size
+        # The float modification time is the one stored in the Db
+        self.mtime = file_stat.st_mtime
+        self.mtime_ns = file_stat.st_mtime_ns
+        self.inode = file_stat.st_ino
+        self.device = file_stat.st_dev
+        self.is_dir = children is not None
+        self.children = children
+
+    def __repr__(self):
+        return 'LocalEntry({!r}, is_dir={})'.format(self.path, self.is_dir)
+
+
+def scan_local_dir(dir_path, follow_symlinks=None):
+    """
+    Lists the files and dirs under a dir in local filesystem. Every entry is stat'ed exactly
+    once. Symlinks are skipped unless follow_symlinks is set, in which case a link to one of
+    its own ancestor dirs is skipped as a loop. Entries that are neither regular files nor
+    dirs, like sockets and fifos, are skipped.
+    Args:
+        dir_path: 'A String' path of the local dir
+        follow_symlinks: Boolean, whether symlinks are followed. Read from the configs if None.
+    Returns:
+        Generator of LocalEntry
+    """
+    if follow_symlinks is None:
+        follow_symlinks = configs.get_configs().getboolean('LOCAL', 'follow_symlinks')
+    ancestors = ()
+    if follow_symlinks:
+        dir_stat = os.stat(dir_path)
+        ancestors = ((dir_stat.st_dev, dir_stat.st_ino),)
+    return _scan(dir_path, '', ancestors, follow_symlinks)
+
+
+def _scan(dir_path, relative_dir_path, ancestors, follow_symlinks):
+    # The entries of a dir are read at once, so that only one dir is open at a time
+    # however deep the tree is.
+    with os.scandir(dir_path) as dir_entries:
+        entries = [_create_entry(each, relative_dir_path, ancestors, follow_symlinks) for each in dir_entries]
+    for entry in entries:
+        if entry is not None:
+            yield entry
+
+
+def _create_entry(dir_entry, relative_dir_path, ancestors, follow_symlinks):
+    try:
+        file_stat = dir_entry.stat(follow_symlinks=follow_symlinks)
+    except OSError:
+        # Deleted since the dir was listed, or a broken symlink
+        logger.debug('Skipping %s, it cannot be stat\'ed.', dir_entry.path, exc_info=True)
+        return None
+    relative_path = os.path.join(relative_dir_path, dir_entry.name)
+    if stat.S_ISREG(file_stat.st_mode):
+        return LocalEntry(dir_entry.name, dir_entry.path, relative_path, file_stat)
+    if stat.S_ISDIR(file_stat.st_mode):
+        if follow_symlinks:
+            file_id = (file_stat.st_dev, file_stat.st_ino)
+            if file_id in ancestors:
+                logger.warning('Skipping %s, it is a symlink loop.', dir_entry.path)
+                return None
+            ancestors = ancestors + (file_id,)
+        return LocalEntry(dir_entry.name, dir_entry.path, relative_path, file_stat,
+                          _scan(dir_entry.path, relative_path, ancestors, follow_symlinks))
+    if stat.S_ISLNK(file_stat.st_mode):
+        logger.debug('Skipping the symlink %s.', dir_entry.path)
+    else:
+        logger.debug('Skipping %s, it is not a regular file or dir.', dir_entry.path)
+    return None
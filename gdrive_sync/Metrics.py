@@ -0,0 +1,454 @@
+import bisect
+import contextlib
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from http import server
+
+from gdrive_sync import configs, utils
+
+logger = utils.create_logger(__name__)
+
+# In seconds, from a cached Db read to a large upload chunk
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class _Metric:
+    """
+    A named metric with a value per combination of label values.
+    """
+    type_name = None
+
+    def __init__(self, name, description, label_names):
+        """
+        Args:
+            name: 'A String' name of the metric
+            description: 'A String' description of the metric
+            label_names: A tuple of the label names, every value of the metric has a value for each
+        """
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _get_key(self, labels):
+        if len(labels) != len(self.label_names):
+            raise ValueError('{} takes the labels {}, got {}.'.format(self.name, self.label_names, tuple(labels)))
+        try:
+            return tuple(str(labels[label_name]) for label_name in self.label_names)
+        except KeyError:
+            raise ValueError('{} takes the labels {}, got {}.'.format(self.name, self.label_names, tuple(labels)))
+
+    def get(self, **labels):
+        """
+        Returns:
+            The value of the metric with the labels, 0 if it was never set
+        """
+        key = self._get_key(labels)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def get_samples(self):
+        """
+        Returns:
+            A list of tuples of the sample name, a dict of the labels and the value
+        """
+        with self._lock:
+            values = list(self._values.items())
+        return [(self.name, dict(zip(self.label_names, key)), value) for key, value in sorted(values)]
+
+
+class Counter(_Metric):
+    """
+    A value that only goes up, like the number of requests sent.
+    """
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError('A counter cannot be decreased.')
+        key = self._get_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    A value that goes up and down, like the length of a queue. A gauge without labels can be
+    computed by a function when it is collected instead.
+    """
+    type_name = 'gauge'
+
+    def __init__(self, name, description, label_names):
+        _Metric.__init__(self, name, description, label_names)
+        self._function = None
+
+    def set(self, value, **labels):
+        key = self._get_key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._get_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function):
+        """
+        Args:
+            function: A function without arguments that returns the value of the gauge
+        """
+        if self.label_names:
+            raise ValueError('Only a gauge without labels can be computed by a function.')
+        self._function = function
+
+    def get(self, **labels):
+        if self._function:
+            return self._function()
+        return _Metric.get(self, **labels)
+
+    def get_samples(self):
+        if self._function:
+            return [(self.name, {}, self._function())]
+        return _Metric.get_samples(self)
+
+
+class _HistogramValue:
+    __slots__ = ('bucket_counts', 'sum', 'count')
+
+    def __init__(self, bucket_count):
+        # The last bucket counts the values above the largest bound
+        self.bucket_counts = [0] * (bucket_count + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(_Metric):
+    """
+    Counts the observed values, like latencies, into buckets by their upper bounds.
+    """
+    type_name = 'histogram'
+
+    def __init__(self, name, description, label_names, buckets=DEFAULT_BUCKETS):
+        _Metric.__init__(self, name, description, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._get_key(labels)
+        with self._lock:
+            histogram_value = self._values.get(key)
+            if histogram_value is None:
+                histogram_value = self._values[key] = _HistogramValue(len(self.buckets))
+            histogram_value.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+            histogram_value.sum += value
+            histogram_value.count += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """
+        Observes the number of seconds the with block takes, also when it raises.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def get(self, **labels):
+        """
+        Returns:
+            A tuple of the number and the sum of the values observed with the labels
+        """
+        key = self._get_key(labels)
+        with self._lock:
+            histogram_value = self._values.get(key)
+            return (histogram_value.count, histogram_value.sum) if histogram_value else (0, 0.0)
+
+    def get_samples(self):
+        with self._lock:
+            values = [(key, list(value.bucket_counts), value.sum, value.count) for key, value in self._values.items()]
+        samples = []
+        for key, bucket_counts, value_sum, count in sorted(values):
+            labels = dict(zip(self.label_names, key))
+            cumulative_count = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), bucket_counts):
+                cumulative_count += bucket_count
+                samples.append((self.name + '_bucket', dict(labels, le=_format_value(bound)), cumulative_count))
+            samples.append((self.name + '_sum', labels, value_sum))
+            samples.append((self.name + '_count', labels, count))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    Holds the metrics of the process by name, and renders them in the Prometheus text format
+    or as a JSON snapshot. The modules register their metrics once, at import.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, description, label_names=()):
+        """
+        Returns:
+            The Counter with the name, created if not registered yet
+        """
+        return self._register(Counter, name, description, label_names)
+
+    def gauge(self, name, description, label_names=()):
+        """
+        Returns:
+            The Gauge with the name, created if not registered yet
+        """
+        return self._register(Gauge, name, description, label_names)
+
+    def histogram(self, name, description, label_names=(), buckets=DEFAULT_BUCKETS):
+        """
+        Returns:
+            The Histogram with the name, created if not registered yet
+        """
+        return self._register(Histogram, name, description, label_names, buckets)
+
+    def _register(self, metric_class, name, description, label_names, *args):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_class(name, description, label_names, *args)
+            elif type(metric) is not metric_class or metric.label_names != tuple(label_names):
+                raise ValueError('The metric {} is already registered as a {} with the labels {}.'.format(
+                    name, metric.type_name, metric.label_names))
+            return metric
+
+    def get_metrics(self):
+        """
+        Returns:
+            A list of the registered metrics sorted by name
+        """
+        with self._lock:
+            return [self._metrics[name] for name in sorted(self._metrics)]
+
+    def to_prometheus(self):
+        """
+        Returns:
+            'A String' with the values of all the metrics in the Prometheus text exposition format
+        """
+        lines = []
+        for metric in self.get_metrics():
+            lines.append('# HELP {} {}'.format(metric.name, _escape_help(metric.description)))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.type_name))
+            for sample_name, labels, value in metric.get_samples():
+                if labels:
+                    sample_name += '{' + ','.join('{}="{}"'.format(label_name, _escape_label_value(label_value))
+                                                  for label_name, label_value in labels.items()) + '}'
+                lines.append('{} {}'.format(sample_name, _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+    def to_dict(self):
+        """
+        Returns:
+            A dict of the time and of the metrics by name, each with its type, description and samples
+        """
+        return {'time': time.time(),
+                'metrics': {metric.name: {'type': metric.type_name,
+                                          'description': metric.description,
+                                          'samples': [{'name': sample_name, 'labels': labels, 'value': value}
+                                                      for sample_name, labels, value in metric.get_samples()]}
+                            for metric in self.get_metrics()}}
+
+    def write_snapshot(self, file_path):
+        """
+        Writes the metrics as JSON into the file. The file is replaced at once, so a reader never
+        sees a partly written snapshot.
+        Args:
+            file_path: 'A String' path of the snapshot file
+        """
+        snapshot = json.dumps(self.to_dict(), indent=2, sort_keys=True)
+        dir_path = os.path.dirname(os.path.abspath(file_path))
+        fd, temp_file_path = tempfile.mkstemp(dir=dir_path, prefix='.metrics.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as temp_file:
+                temp_file.write(snapshot)
+            os.replace(temp_file_path, file_path)
+        except BaseException:
+            os.unlink(temp_file_path)
+            raise
+
+
+def _format_value(value):
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if math.isnan(value):
+        return 'NaN'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _escape_help(text):
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def _escape_label_value(text):
+    return _escape_help(text).replace('"', '\\"')
+
+
+class _MetricsRequestHandler(server.BaseHTTPRequestHandler):
+    """
+    Serves /metrics in the Prometheus text format and /metrics.json as a JSON snapshot.
+    """
+
+    def do_GET(self):
+        registry = self.server.registry
+        if self.path == '/metrics':
+            body = registry.to_prometheus().encode('utf-8')
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        elif self.path == '/metrics.json':
+            body = json.dumps(registry.to_dict(), sort_keys=True).encode('utf-8')
+            content_type = 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug('Metrics endpoint: ' + format, *args)
+
+
+class MetricsExporter:
+    """
+    Exposes the metrics of a MetricsRegistry on an HTTP endpoint and writes them into a JSON
+    snapshot file every snapshot_interval seconds and when stopped.
+    """
+
+    def __init__(self, registry, host='127.0.0.1', port=None, snapshot_file_path=None, snapshot_interval=60):
+        """
+        Args:
+            registry: A MetricsRegistry object
+            host: 'A String' address the endpoint listens on
+            port: Integer, the port of the endpoint, 0 for any free port. No endpoint if None
+            snapshot_file_path: 'A String' path of the snapshot file. No snapshot file if None
+            snapshot_interval: Float, the number of seconds between two snapshots. No snapshot file if 0
+        """
+        self._registry = registry
+        self._host = host
+        self._port = port
+        self._snapshot_file_path = snapshot_file_path
+        self._snapshot_interval = snapshot_interval
+        self._server = None
+        self._threads = []
+        self._stopped = threading.Event()
+
+    @property
+    def port(self):
+        """
+        The port the endpoint listens on, None if it is not running
+        """
+        return self._server.server_address[1] if self._server else None
+
+    def start(self):
+        """
+        Starts the endpoint and the snapshot writer. If the port is taken, only the snapshots are written.
+        """
+        if self._port is not None:
+            try:
+                self._server = server.ThreadingHTTPServer((self._host, self._port), _MetricsRequestHandler)
+            except OSError:
+                logger.warning('Unable to serve the metrics on %s:%s:', self._host, self._port, exc_info=True)
+            else:
+                self._server.daemon_threads = True
+                self._server.registry = self._registry
+                self._start_thread(self._server.serve_forever, 'MetricsEndpoint')
+                logger.info('Serving the metrics on http://%s:%s/metrics', self._host, self.port)
+        if self._writes_snapshots():
+            self._start_thread(self._write_snapshots, 'MetricsSnapshot')
+
+    def stop(self):
+        """
+        Stops the endpoint and writes a last snapshot.
+        """
+        self._stopped.set()
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if self._writes_snapshots():
+            self._write_snapshot()
+
+    def _writes_snapshots(self):
+        return bool(self._snapshot_file_path) and self._snapshot_interval > 0
+
+    def _start_thread(self, target, name):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _write_snapshots(self):
+        while not self._stopped.wait(self._snapshot_interval):
+            self._write_snapshot()
+
+    def _write_snapshot(self):
+        try:
+            self._registry.write_snapshot(self._snapshot_file_path)
+        except OSError:
+            logger.error('Unable to write the metrics snapshot %s:', self._snapshot_file_path, exc_info=True)
+
+
+_default_registry = MetricsRegistry()
+
+
+def get_default_registry():
+    """
+    Returns:
+        The MetricsRegistry object shared by the whole process
+    """
+    return _default_registry
+
+
+_default_exporter = None
+_default_exporter_lock = threading.Lock()
+
+
+def start_default_exporter():
+    """
+    Exposes the shared MetricsRegistry as configured in the METRICS section of configs.ini,
+    unless it is already exposed.
+    """
+    global _default_exporter
+    with _default_exporter_lock:
+        if _default_exporter is not None:
+            return
+        port = configs.get_config('METRICS', 'port')
+        snapshot_file_path = configs.get_config('METRICS', 'snapshot_file')
+        _default_exporter = MetricsExporter(get_default_registry(),
+                                            configs.get_config('METRICS', 'host'),
+                                            int(port) if port else None,
+                                            os.path.expanduser(snapshot_file_path) if snapshot_file_path else
+                                            os.path.join(utils.get_gdrive_sync_home(), 'metrics.json'),
+                                            configs.get_configs().getfloat('METRICS', 'snapshot_interval'))
+        _default_exporter.start()
+
+
+def stop_default_exporter():
+    """
+    Stops exposing the shared MetricsRegistry, if it was exposed.
+    """
+    global _default_exporter
+    with _default_exporter_lock:
+        exporter, _default_exporter = _default_exporter, None
+    if exporter:
+        exporter.stop()
@@ -0,0 +1,107 @@
+import collections
+import fnmatch
+import mimetypes
+import os
+import threading
+
+from gdrive_sync import configs, utils
+
+logger = utils.create_logger(__name__)
+
+_DEFAULT_MIME_TYPE = 'application/octet-stream'
+
+
+class MimeDetector:
+    """
+    Detects the mime types of the local files for the uploads.
+    The type is looked up in the table of file extensions first. Only the files with an unknown
+    extension are sniffed with libmagic, which reads the header of the file. Every thread has its
+    own libmagic handle, as a shared handle serializes the sniffing of all the upload threads.
+    The files whose name matches one of sniff_patterns are always sniffed, the files whose name
+    matches one of no_sniff_patterns never are.
+    The detected types are cached by the device, inode, size and modification time of the file.
+    """
+
+    def __init__(self, sniff_patterns=(), no_sniff_patterns=(), cache_size=10000):
+        """
+        Args:
+            sniff_patterns: A list of fnmatch patterns of the file names that are always sniffed
+            no_sniff_patterns: A list of fnmatch patterns of the file names that are never sniffed
+            cache_size: Integer, the maximum number of cached mime types
+        """
+        self._sniff_patterns = list(sniff_patterns)
+        self._no_sniff_patterns = list(no_sniff_patterns)
+        self._cache_size = cache_size
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._handles = threading.local()
+        self._mime_types = mimetypes.MimeTypes()
+
+    def detect(self, local_file_path):
+        """
+        Args:
+            local_file_path: 'A String' path of the local file
+        Returns:
+            'A String' mime type of the file
+        """
+        file_stat = os.stat(local_file_path)
+        key = (file_stat.st_dev, file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns)
+        with self._lock:
+            mime_type = self._cache.get(key)
+            if mime_type is not None:
+                self._cache.move_to_end(key)
+                return mime_type
+        mime_type = self._detect(local_file_path)
+        with self._lock:
+            self._cache[key] = mime_type
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return mime_type
+
+    def _detect(self, local_file_path):
+        file_name = os.path.basename(local_file_path)
+        if self._matches(file_name, self._sniff_patterns):
+            return self._sniff(local_file_path)
+        mime_type, _ = self._mime_types.guess_type(file_name, strict=False)
+        if mime_type:
+            return mime_type
+        if self._matches(file_name, self._no_sniff_patterns):
+            return _DEFAULT_MIME_TYPE
+        return self._sniff(local_file_path)
+
+    @staticmethod
+    def _matches(file_name, patterns):
+        return any(fnmatch.fnmatch(file_name, pattern) for pattern in patterns)
+
+    def _sniff(self, local_file_path):
+        handle = getattr(self._handles, 'handle', None)
+        if handle is None:
+            import magic
+            handle = self._handles.handle = magic.Magic(mime=True)
+        try:
+            return handle.from_file(local_file_path)
+        except Exception:
+            logger.warning('Unable to detect the mime type of %s:', local_file_path, exc_info=True)
+            return _DEFAULT_MIME_TYPE
+
+
+_default_detector = None
+_default_detector_lock = threading.Lock()
+
+
+def _get_patterns(key):
+    return [pattern.strip() for pattern in configs.get_config('MIME', key).split(',') if pattern.strip()]
+
+
+def get_default_detector():
+    """
+    Returns:
+        The MimeDetector object shared by the whole process
+    """
+    global _default_detector
+    with _default_detector_lock:
+        if _default_detector is None:
+            _default_detector = MimeDetector(_get_patterns('sniff_patterns'),
+                                             _get_patterns('no_sniff_patterns'),
+                                             configs.get_configs().getint('MIME', 'cache_size'))
+        return _default_detector
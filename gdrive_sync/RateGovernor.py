@@ -0,0 +1,315 @@
+import random
+import threading
+import time
+from urllib import parse
+
+from gdrive_sync import configs, utils, Metrics
+
+logger = utils.create_logger(__name__)
+
+_API_REQUESTS = Metrics.get_default_registry().counter(
+    'gdrive_sync_api_requests_total', 'The Drive API requests sent, retries included, by API method and HTTP status.',
+    ('method', 'status'))
+_API_REQUEST_SECONDS = Metrics.get_default_registry().histogram(
+    'gdrive_sync_api_request_seconds', 'The duration of the Drive API requests, without the wait for the governor.',
+    ('method',))
+_TRANSFERRED_BYTES = Metrics.get_default_registry().counter(
+    'gdrive_sync_transferred_bytes_total', 'The bytes of the Drive API request and response bodies, by direction.',
+    ('direction',))
+
+# The 403 reasons of the Drive API that mean the request was throttled
+_RATE_LIMIT_REASONS = (b'userRateLimitExceeded', b'rateLimitExceeded')
+
+
+def is_throttled(status, content=None):
+    """
+    Args:
+        status: Integer, the HTTP status of a response
+        content: Bytes, the body of the response
+    Returns:
+        True if the response means that the request was throttled and should be retried later
+    """
+    if status in (429, 503):
+        return True
+    if status == 403 and content:
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        return any(reason in content for reason in _RATE_LIMIT_REASONS)
+    return False
+
+
+def is_retryable(status, content=None):
+    """
+    Args:
+        status: Integer, the HTTP status of a response
+        content: Bytes, the body of the response
+    Returns:
+        True if the request should be retried, i.e. it was throttled or failed on the server
+    """
+    return status >= 500 or is_throttled(status, content)
+
+
+class RateGovernor:
+    """
+    Paces the Drive API requests of all the threads, to sustain the highest throughput the quota allows.
+    A request first waits for one of concurrency_limit slots, then for a token of a bucket refilled
+    with rate tokens per second. Both limits grow additively while the requests succeed and are
+    multiplied by decrease_factor when the requests are throttled, at most once per backoff_base seconds.
+    The throttled requests are retried after an exponential backoff with full jitter.
+    """
+
+    SUCCEEDED = 'succeeded'
+    THROTTLED = 'throttled'
+    FAILED = 'failed'
+
+    def __init__(self, initial_rate, min_rate, max_rate, rate_increase,
+                 initial_concurrency, max_concurrency, decrease_factor,
+                 max_retries, backoff_base, backoff_max,
+                 clock=time.monotonic, sleep=time.sleep, rand=random.random):
+        """
+        Args:
+            initial_rate: Float, the initial number of requests per second
+            min_rate: Float, the lowest number of requests per second
+            max_rate: Float, the highest number of requests per second
+            rate_increase: Float, the requests per second added for every second without throttling
+            initial_concurrency: Integer, the initial number of concurrent requests
+            max_concurrency: Integer, the highest number of concurrent requests
+            decrease_factor: Float, the factor the limits are multiplied with on throttling
+            max_retries: Integer, the number of times a throttled request is retried
+            backoff_base: Float, the maximum number of seconds before the first retry
+            backoff_max: Float, the maximum number of seconds before any retry
+            clock: A function that returns the current time in seconds
+            sleep: A function that takes a number of seconds to wait as input argument
+            rand: A function that returns a random float in [0, 1)
+        """
+        self._rate = float(initial_rate)
+        self._min_rate = min_rate
+        self._max_rate = max_rate
+        self._rate_increase = rate_increase
+        self._concurrency_limit = float(initial_concurrency)
+        self._max_concurrency = max_concurrency
+        self._decrease_factor = decrease_factor
+        self.max_retries = max_retries
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._clock = clock
+        self._sleep = sleep
+        self._rand = rand
+        self._tokens = 1.0
+        self._last_refill = clock()
+        self._last_decrease = None
+        self._in_flight = 0
+        self._requests = 0
+        self._throttled = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """
+        Waits until a request may be sent. Every acquire must be followed by a release.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._in_flight < int(self._concurrency_limit))
+            self._in_flight += 1
+            now = self._clock()
+            # The bucket holds up to one second of requests, a negative balance is a reservation
+            self._tokens = min(self._tokens + (now - self._last_refill) * self._rate, max(self._rate, 1.0))
+            self._last_refill = now
+            self._tokens -= 1
+            wait = -self._tokens / self._rate if self._tokens < 0 else 0
+        if wait:
+            self._sleep(wait)
+
+    def release(self, outcome):
+        """
+        Frees the slot of a request and adapts the limits to its outcome.
+        Args:
+            outcome: SUCCEEDED, THROTTLED or FAILED, for a failure that says nothing about the quota
+        """
+        with self._condition:
+            self._in_flight -= 1
+            self._requests += 1
+            if outcome == self.SUCCEEDED:
+                self._concurrency_limit = min(self._max_concurrency,
+                                              self._concurrency_limit + 1 / self._concurrency_limit)
+                self._rate = min(self._max_rate, self._rate + self._rate_increase / self._rate)
+            elif outcome == self.THROTTLED:
+                self._throttled += 1
+                self._decrease()
+            self._condition.notify_all()
+
+    def throttled(self):
+        """
+        Adapts the limits to a throttled request that was not sent with acquire, like a part of a batch request.
+        """
+        with self._condition:
+            self._throttled += 1
+            self._decrease()
+
+    def _decrease(self):
+        now = self._clock()
+        if self._last_decrease is not None and now - self._last_decrease < self._backoff_base:
+            # The other requests sent at the old limits are throttled too
+            return
+        self._last_decrease = now
+        self._concurrency_limit = max(1.0, self._concurrency_limit * self._decrease_factor)
+        self._rate = max(self._min_rate, self._rate * self._decrease_factor)
+        logger.info('Throttled by the Drive API, slowing down to %.1f requests per second and %d concurrent requests.',
+                    self._rate, int(self._concurrency_limit))
+
+    def backoff(self, attempt):
+        """
+        Waits before a retry.
+        Args:
+            attempt: Integer, the number of retries before this one
+        """
+        self._sleep(self._rand() * min(self._backoff_max, self._backoff_base * 2 ** attempt))
+
+    def get_stats(self):
+        """
+        Returns:
+            A dict of the current rate, concurrency limit and number of requests in flight,
+            and of the numbers of requests sent and throttled so far
+        """
+        with self._condition:
+            return {'rate': self._rate,
+                    'concurrency_limit': int(self._concurrency_limit),
+                    'in_flight': self._in_flight,
+                    'requests': self._requests,
+                    'throttled': self._throttled}
+
+
+def get_api_method(uri, method):
+    """
+    Args:
+        uri: 'A String' uri of a Drive API request
+        method: 'A String' HTTP method of the request
+    Returns:
+        'A String' name of the API method, like files.list or files.get_media, 'batch' for the
+        batch requests and 'other' if the uri is not one of the Drive API
+    """
+    split_uri = parse.urlsplit(uri)
+    segments = [segment for segment in split_uri.path.split('/') if segment]
+    if segments[:1] == ['batch']:
+        return 'batch'
+    # The path is like /drive/v3/files/<file id> or /upload/drive/v3/files
+    resource_segments = []
+    for i, segment in enumerate(segments[:-1]):
+        if segments[i - 1:i] == ['drive'] and segment.startswith('v') and segment[1:].isdigit():
+            resource_segments = segments[i + 1:]
+            break
+    if not resource_segments:
+        return 'other'
+    query = parse.parse_qs(split_uri.query)
+    if 'upload_id' in query:
+        verb = 'upload_chunk'
+    elif method == 'GET':
+        if len(resource_segments) == 1:
+            verb = 'list'
+        else:
+            verb = 'get_media' if 'media' in query.get('alt', ()) else 'get'
+    else:
+        verb = {'POST': 'create', 'PATCH': 'update', 'PUT': 'update', 'DELETE': 'delete'}.get(method, method.lower())
+    return '{}.{}'.format(resource_segments[0], verb)
+
+
+def _get_body_size(body, headers):
+    if isinstance(body, str):
+        return len(body.encode('utf-8'))
+    if isinstance(body, bytes):
+        return len(body)
+    # The chunks of the resumable uploads are streams
+    for name, value in (headers or {}).items():
+        if name.lower() == 'content-length':
+            return int(value)
+    return 0
+
+
+class GovernedHttp:
+    """
+    Wraps an httplib2.Http object, so that its requests are paced by a RateGovernor and the
+    throttled and failed requests are retried. Requests with a stream body, like the chunks of the
+    resumable uploads, are not retried, as the stream cannot be read again.
+    Every request is counted in the metrics by API method and status, with its duration and size.
+    """
+
+    def __init__(self, http, governor):
+        """
+        Args:
+            http: An authorized httplib2.Http object
+            governor: A RateGovernor object
+        """
+        self._http = http
+        self._governor = governor
+
+    @property
+    def credentials(self):
+        # googleapiclient refreshes the credentials of the batch requests it finds here
+        return getattr(self._http.request, 'credentials', None)
+
+    def __getattr__(self, name):
+        return getattr(self._http, name)
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        retryable_body = body is None or isinstance(body, (str, bytes))
+        api_method = get_api_method(uri, method)
+        body_size = _get_body_size(body, headers)
+        attempt = 0
+        while True:
+            self._governor.acquire()
+            started = time.perf_counter()
+            try:
+                response, content = self._http.request(uri, method, body=body, headers=headers, **kwargs)
+            except BaseException:
+                self._governor.release(RateGovernor.FAILED)
+                _API_REQUESTS.inc(method=api_method, status='error')
+                raise
+            finally:
+                _API_REQUEST_SECONDS.observe(time.perf_counter() - started, method=api_method)
+                _TRANSFERRED_BYTES.inc(body_size, direction='up')
+            _API_REQUESTS.inc(method=api_method, status=response.status)
+            _TRANSFERRED_BYTES.inc(len(content) if content else 0, direction='down')
+            throttled = is_throttled(response.status, content)
+            self._governor.release(RateGovernor.THROTTLED if throttled else
+                                   RateGovernor.FAILED if response.status >= 500 else RateGovernor.SUCCEEDED)
+            if (not retryable_body or attempt >= self._governor.max_retries or
+                    not is_retryable(response.status, content)):
+                return response, content
+            logger.debug('%s %s failed with status %s, retrying.', method, uri, response.status)
+            self._governor.backoff(attempt)
+            attempt += 1
+
+
+def _register_gauges(governor):
+    registry = Metrics.get_default_registry()
+    for name, description, stat in (
+            ('gdrive_sync_rate_limit', 'The Drive API requests per second allowed by the governor.', 'rate'),
+            ('gdrive_sync_concurrency_limit', 'The concurrent Drive API requests allowed by the governor.',
+             'concurrency_limit'),
+            ('gdrive_sync_api_requests_in_flight', 'The Drive API requests being sent.', 'in_flight')):
+        registry.gauge(name, description).set_function(lambda stat=stat: governor.get_stats()[stat])
+
+
+_default_governor = None
+_default_governor_lock = threading.Lock()
+
+
+def get_default_governor():
+    """
+    Returns:
+        The RateGovernor object shared by the whole process
+    """
+    global _default_governor
+    with _default_governor_lock:
+        if _default_governor is None:
+            _default_governor = RateGovernor(configs.get_configs().getfloat('RATE', 'initial_rate'),
+                                             configs.get_configs().getfloat('RATE', 'min_rate'),
+                                             configs.get_configs().getfloat('RATE', 'max_rate'),
+                                             configs.get_configs().getfloat('RATE', 'rate_increase'),
+                                             configs.get_configs().getint('RATE', 'initial_concurrency'),
+                                             configs.get_configs().getint('RATE', 'max_concurrency'),
+                                             configs.get_configs().getfloat('RATE', 'decrease_factor'),
+                                             configs.get_configs().getint('RATE', 'max_retries'),
+                                             configs.get_configs().getfloat('RATE', 'backoff_base'),
+                                             configs.get_configs().getfloat('RATE', 'backoff_max'))
+            _register_gauges(_default_governor)
+        return _default_governor
@@ -0,0 +1,119 @@
+from concurrent import futures
+import threading
+
+from gdrive_sync import utils
+
+logger = utils.create_logger(__name__)
+
+
+class RemoteTreeWalker:
+    """
+    Lists the remote files and dirs recursively, the same way as utils.list_remote_files_from_dir,
+    but lists the dirs concurrently on a thread pool.
+    Whenever a dir is listed, its child dirs are scheduled for listing ahead of the consumer
+    of the output. At most `lookahead` dirs are listed ahead, counting the ones being listed
+    and the ones listed but not consumed yet, which bounds the memory held. A dir that was not
+    listed ahead is listed by the consumer when it reaches it.
+    """
+
+    def __init__(self, workers, lookahead, service_factory=None):
+        """
+        Args:
+            workers: Integer, the number of dirs listed concurrently
+            lookahead: Integer, the maximum number of dirs listed ahead of the consumer
+            service_factory: A function that returns a googleapiclient.discovery.Resource object for the calling thread.
+                Every thread gets its own. Defaults to utils.get_pooled_service
+        """
+        self._executor = futures.ThreadPoolExecutor(max_workers=workers)
+        self._lookahead_slots = threading.BoundedSemaphore(lookahead)
+        self._service_factory = service_factory if service_factory else utils.get_pooled_service
+        self._services = threading.local()
+
+    def list_remote_files_from_dir(self, parent_dir_id):
+        """
+        Gets the remote file and directory information from remote recursively. If a file is a dir,
+        it will have an iterator of the child files and dirs as 'children'.
+
+        :param parent_dir_id: 'A String' representing the id of the parent dir of the remote files
+        :return: An iterator of files and dir object
+        """
+        return _ListedDir(self, parent_dir_id, self._list_ahead(parent_dir_id))
+
+    def close(self):
+        """
+        Stops the thread pool. The listings that have not started are cancelled.
+        """
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _get_service(self):
+        service = getattr(self._services, 'service', None)
+        if service is None:
+            service = self._services.service = self._service_factory()
+        return service
+
+    def _list_ahead(self, dir_id):
+        """
+        Schedules the listing of a dir on the thread pool if a lookahead slot is free.
+        Returns:
+            A concurrent.futures.Future of the listing, None if no slot was free
+        """
+        if not self._lookahead_slots.acquire(blocking=False):
+            return None
+        try:
+            return self._executor.submit(self._list_dir, dir_id)
+        except RuntimeError:
+            # The pool is shut down
+            self._lookahead_slots.release()
+            return None
+
+    def _release_slot(self):
+        self._lookahead_slots.release()
+
+    def _list_dir(self, dir_id):
+        """
+        Lists a dir and schedules the listing of its child dirs.
+        Returns:
+            A list of files and dir objects, the dirs have a _ListedDir as 'children'
+        """
+        files = list(utils.get_remote_files_from_dir(self._get_service(), dir_id))
+        for each in files:
+            if each['mimeType'] == 'application/vnd.google-apps.folder':
+                each['children'] = _ListedDir(self, each['id'], self._list_ahead(each['id']))
+        return files
+
+
+class _ListedDir:
+    """
+    An iterator over the files and dirs of a remote dir, backed by a listing that may have
+    been scheduled ahead on the RemoteTreeWalker's thread pool. Its lookahead slot is released
+    when the listing is consumed, or when the iterator is discarded without being consumed.
+    """
+
+    def __init__(self, walker, dir_id, future):
+        self._walker = walker
+        self._dir_id = dir_id
+        self._future = future
+        self._files = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._files is None:
+            self._files = iter(self._take_listing())
+        return next(self._files)
+
+    def _take_listing(self):
+        future, self._future = self._future, None
+        if future is None:
+            return self._walker._list_dir(self._dir_id)
+        try:
+            return future.result()
+        finally:
+            self._walker._release_slot()
+
+    def __del__(self):
+        future, self._future = self._future, None
+        if future is not None:
+            future.cancel()
+            self._walker._release_slot()
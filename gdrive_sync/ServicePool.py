@@ -0,0 +1,137 @@
+import datetime
+import threading
+
+from gdrive_sync import configs, utils
+
+logger = utils.create_logger(__name__)
+
+
+class ServicePool:
+    """
+    Hands out one googleapiclient.discovery.Resource object per thread, as httplib2.Http is not
+    thread-safe. Every thread keeps its own authorized httplib2.Http, which reuses its connections,
+    so the credentials are read and the service is built once per thread instead of once per request.
+    All the threads share the same credentials, whose access token is refreshed by a background thread
+    refresh_margin seconds before it expires, so that the requests do not wait for it.
+    """
+
+    def __init__(self, refresh_margin, retry_interval, credentials_factory=None):
+        """
+        Args:
+            refresh_margin: Float, the number of seconds before its expiry the access token is refreshed
+            retry_interval: Float, the number of seconds between the attempts of a failed refresh
+            credentials_factory: A function that returns an oauth2client.client.Credentials object.
+                Defaults to utils.get_credentials
+        """
+        self._refresh_margin = refresh_margin
+        self._retry_interval = retry_interval
+        self._credentials_factory = credentials_factory if credentials_factory else utils.get_credentials
+        self._credentials = None
+        self._lock = threading.Lock()
+        self._services = threading.local()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Starts the thread that refreshes the access token.
+        """
+        self._thread = threading.Thread(target=self._run, name='ServicePool', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the thread that refreshes the access token.
+        """
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def get_credentials(self):
+        """
+        Returns:
+            The shared oauth2client.client.Credentials object, loaded on the first call
+        """
+        with self._lock:
+            if self._credentials is None:
+                self._credentials = self._credentials_factory()
+            return self._credentials
+
+    def get_service(self):
+        """
+        Returns:
+            The googleapiclient.discovery.Resource object of the calling thread
+        """
+        service = getattr(self._services, 'service', None)
+        if service is None:
+            import httplib2
+            http = self.get_credentials().authorize(httplib2.Http())
+            service = self._services.service = utils.build_service(http)
+        return service
+
+    def refresh(self):
+        """
+        Refreshes the access token of the shared credentials.
+        """
+        import httplib2
+        credentials = self.get_credentials()
+        with self._lock:
+            credentials.refresh(httplib2.Http())
+        logger.debug('Refreshed the access token, it expires at %s.', credentials.token_expiry)
+
+    def seconds_until_refresh(self):
+        """
+        Returns:
+            Float, the number of seconds until the access token should be refreshed,
+            None if the token has no known expiry
+        """
+        token_expiry = self.get_credentials().token_expiry
+        if token_expiry is None:
+            return None
+        remaining = (token_expiry - datetime.datetime.utcnow()).total_seconds()
+        return max(remaining - self._refresh_margin, 0)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                wait = self.seconds_until_refresh()
+                if wait == 0:
+                    self.refresh()
+                    wait = self.seconds_until_refresh()
+                    if wait == 0:
+                        # The token is valid for less than refresh_margin seconds
+                        wait = self._retry_interval
+            except Exception:
+                logger.error('Unable to refresh the access token:', exc_info=True)
+                wait = self._retry_interval
+            self._stopped.wait(wait)
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_default_pool():
+    """
+    Returns:
+        The ServicePool object shared by the whole process, started on the first call
+    """
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = ServicePool(configs.get_configs().getfloat('SERVICE', 'refresh_margin'),
+                                        configs.get_configs().getfloat('SERVICE', 'refresh_retry_interval'))
+            _default_pool.start()
+        return _default_pool
+
+
+def stop_default_pool():
+    """
+    Stops the shared ServicePool object, if it was started. The next get_default_pool call creates a new one.
+    """
+    global _default_pool
+    with _default_pool_lock:
+        pool, _default_pool = _default_pool, None
+    if pool:
+        pool.stop()
@@ -0,0 +1,154 @@
+import json
+
+
+class SyncAction:
+    """
+    A single change planned for a sync pass.
+    If remote_parent_id is None for a CREATE_REMOTE_DIR or UPLOAD action, the remote parent dir is
+    the remote dir of the local parent dir, which is only known once it has been created.
+    """
+    RECORD = 'record'
+    CREATE_LOCAL_DIR = 'create_local_dir'
+    CREATE_REMOTE_DIR = 'create_remote_dir'
+    UPLOAD = 'upload'
+    OVERWRITE_REMOTE = 'overwrite_remote'
+    DOWNLOAD = 'download'
+    DELETE_REMOTE = 'delete_remote'
+    DELETE_LOCAL = 'delete_local'
+    KINDS = (RECORD, CREATE_LOCAL_DIR, CREATE_REMOTE_DIR, UPLOAD, OVERWRITE_REMOTE, DOWNLOAD,
+             DELETE_REMOTE, DELETE_LOCAL)
+
+    __slots__ = ('kind', 'local_path', 'remote_id', 'remote_parent_id', 'size',
+                 'local_modification_date', 'remote_modification_date')
+
+    def __init__(self,
+                 kind,
+                 local_path,
+                 remote_id=None,
+                 remote_parent_id=None,
+                 size=0,
+                 local_modification_date=None,
+                 remote_modification_date=None):
+        """
+        Args:
+            kind: 'A String', one of SyncAction.KINDS
+            local_path: 'A String' path of the local file or dir
+            remote_id: 'A String' id of the remote file or dir, if it exists
+            remote_parent_id: 'A String' id of the remote parent dir
+            size: Integer, the number of bytes to transfer
+            local_modification_date: Integer or Float, the local modification date to save in the Db
+            remote_modification_date: Integer, the remote modification date to save in the Db
+        """
+        if kind not in self.KINDS:
+            raise ValueError('Unknown sync action: {}'.format(kind))
+        self.kind = kind
+        self.local_path = local_path
+        self.remote_id = remote_id
+        self.remote_parent_id = remote_parent_id
+        self.size = size
+        self.local_modification_date = local_modification_date
+        self.remote_modification_date = remote_modification_date
+
+    def to_dict(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, action_dict):
+        return cls(**action_dict)
+
+    def __eq__(self, other):
+        return isinstance(other, SyncAction) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return 'SyncAction({})'.format(', '.join('{}={!r}'.format(key, value)
+                                                 for key, value in self.to_dict().items()
+                                                 if value is not None))
+
+
+class SyncPlan:
+    """
+    The list of changes of a sync pass, built before any of them is applied.
+    """
+
+    # The order in which the executor applies the kinds of action. Dirs are created before
+    # the files are transferred into them, deletions come last.
+    EXECUTION_ORDER = (SyncAction.RECORD, SyncAction.CREATE_LOCAL_DIR, SyncAction.CREATE_REMOTE_DIR,
+                       SyncAction.UPLOAD, SyncAction.OVERWRITE_REMOTE, SyncAction.DOWNLOAD,
+                       SyncAction.DELETE_REMOTE, SyncAction.DELETE_LOCAL)
+
+    # The kinds of action that cost no Drive API request
+    _LOCAL_ONLY_KINDS = (SyncAction.RECORD, SyncAction.CREATE_LOCAL_DIR, SyncAction.DELETE_LOCAL)
+
+    def __init__(self, actions=None):
+        self.actions = list(actions) if actions else []
+
+    def add(self, action):
+        self.actions.append(action)
+
+    def __len__(self):
+        return len(self.actions)
+
+    def __iter__(self):
+        return iter(self.actions)
+
+    def ordered_actions(self):
+        """
+        Returns:
+            A list of the actions in EXECUTION_ORDER. Actions of the same kind keep their planned
+            order, which creates a parent dir before its child dirs.
+        """
+        return sorted(self.actions, key=lambda action: self.EXECUTION_ORDER.index(action.kind))
+
+    def count(self, kind):
+        return sum(1 for action in self.actions if action.kind == kind)
+
+    @property
+    def upload_bytes(self):
+        return sum(action.size for action in self.actions
+                   if action.kind in (SyncAction.UPLOAD, SyncAction.OVERWRITE_REMOTE))
+
+    @property
+    def download_bytes(self):
+        return sum(action.size for action in self.actions if action.kind == SyncAction.DOWNLOAD)
+
+    @property
+    def api_calls(self):
+        return sum(1 for action in self.actions if action.kind not in self._LOCAL_ONLY_KINDS)
+
+    def estimate_seconds(self, upload_rate, download_rate, request_seconds, workers=1):
+        """
+        Estimates the duration of the plan's execution.
+        Args:
+            upload_rate: Float, bytes per second
+            download_rate: Float, bytes per second
+            request_seconds: Float, the latency of a Drive API request
+            workers: Integer, the number of concurrent requests
+        Returns:
+            Float, the estimated number of seconds
+        """
+        return (self.api_calls * request_seconds / max(workers, 1) +
+                self.upload_bytes / upload_rate +
+                self.download_bytes / download_rate)
+
+    def summary(self, upload_rate, download_rate, request_seconds, workers=1):
+        """
+        Returns:
+            'A String' that describes the plan, action by action, and its estimated cost
+        """
+        lines = ['{:<18} {}'.format(action.kind, action.local_path) for action in self.ordered_actions()]
+        lines.append('')
+        lines.extend('{:<18} {}'.format(kind, self.count(kind)) for kind in self.EXECUTION_ORDER if self.count(kind))
+        lines.append('{:<18} {}'.format('upload bytes', self.upload_bytes))
+        lines.append('{:<18} {}'.format('download bytes', self.download_bytes))
+        lines.append('{:<18} {}'.format('api calls', self.api_calls))
+        lines.append('{:<18} {:.1f}'.format('estimated seconds',
+                                            self.estimate_seconds(upload_rate, download_rate,
+                                                                  request_seconds, workers)))
+        return '\n'.join(lines)
+
+    def to_json(self):
+        return json.dumps({'actions': [action.to_dict() for action in self.actions]})
+
+    @classmethod
+    def from_json(cls, plan_json):
+        return cls(SyncAction.from_dict(action_dict) for action_dict in json.loads(plan_json)['actions'])
@@ -0,0 +1,197 @@
+from concurrent import futures
+import functools
+import queue
+import threading
+
+from gdrive_sync import utils, Metrics
+
+logger = utils.create_logger(__name__)
+
+_PENDING = Metrics.get_default_registry().gauge(
+    'gdrive_sync_transfers_pending', 'The submitted transfers whose callback has not run yet.')
+_TRANSFERS = Metrics.get_default_registry().counter(
+    'gdrive_sync_transfers_total', 'The completed transfers, by outcome.', ('outcome',))
+
+
+class _HandedOverUploadSessions:
+    """
+    The upload sessions as seen by the worker threads. The sessions are read on the worker
+    threads, while their writes are handed over to the submitting thread. There they join the
+    DbHandler.batch it may hold open, which a write on the connection of a worker would wait for.
+    """
+
+    def __init__(self, upload_sessions, handed_over):
+        """
+        Args:
+            upload_sessions: A Db.DbHandler object that stores the sessions of the resumable uploads
+            handed_over: A queue.Queue of the tuples of None and the writes to run on the submitting thread
+        """
+        self._upload_sessions = upload_sessions
+        self._handed_over = handed_over
+
+    def get_upload_session(self, local_path):
+        return self._upload_sessions.get_upload_session(local_path)
+
+    def set_upload_session(self, local_path, session_uri, file_size, local_modification_date, committed_offset):
+        self._handed_over.put((None, functools.partial(self._upload_sessions.set_upload_session, local_path,
+                                                       session_uri, file_size, local_modification_date,
+                                                       committed_offset)))
+
+    def delete_upload_session(self, local_path):
+        self._handed_over.put((None, functools.partial(self._upload_sessions.delete_upload_session, local_path)))
+
+
+class TransferEngine:
+    """
+    Runs the file uploads, downloads and overwrites on a pool of worker threads.
+    Every job has a completion callback that is called with the result of the job. The
+    callbacks run on the thread that submits the jobs, while it submits more jobs or when
+    it calls poll or join, so they can write the Db records within its DbHandler.batch.
+    If a job fails, the error is logged and its callback is not called. The upload sessions stored
+    by the workers are written on the submitting thread too, before the callback of their job.
+    With 0 workers the jobs run on the submitting thread as they are submitted.
+    """
+
+    def __init__(self, workers, service_factory=None, max_pending=None, upload_sessions=None):
+        """
+        Args:
+            workers: Integer, the number of concurrent transfers
+            service_factory: A function that returns a googleapiclient.discovery.Resource object for the calling thread.
+                Every thread gets its own. Defaults to utils.get_pooled_service
+            max_pending: Integer, the maximum number of submitted jobs whose callback has not run yet.
+                Submitting more blocks until a job completes. Defaults to 4 times the workers
+            upload_sessions: A Db.DbHandler object that stores the sessions of the resumable uploads
+        """
+        self._workers = workers
+        self._executor = futures.ThreadPoolExecutor(max_workers=workers) if workers else None
+        self._max_pending = max_pending if max_pending else 4 * workers
+        self._service_factory = service_factory if service_factory else utils.get_pooled_service
+        self._services = threading.local()
+        self._completed = queue.Queue()
+        self._pending = 0
+        self._upload_sessions = upload_sessions
+        if upload_sessions and self._executor:
+            self._upload_sessions = _HandedOverUploadSessions(upload_sessions, self._completed)
+
+    def submit_upload(self, local_file_path, remote_parent_dir_id, callback):
+        """
+        Copies the local file under the remote dir.
+        Args:
+            local_file_path: 'A String' path of the local file
+            remote_parent_dir_id: 'A String' id of the remote parent dir
+            callback: A function that takes the id of the created remote file as input argument
+        """
+        self._submit('Upload of {}'.format(local_file_path),
+                     lambda service: utils.copy_local_file_to_remote(local_file_path,
+                                                                     remote_parent_dir_id,
+                                                                     service,
+                                                                     self._upload_sessions),
+                     callback)
+
+    def submit_download(self, remote_file_id, local_file_path, callback, file_size=None):
+        """
+        Copies the remote file to the local file path.
+        Args:
+            remote_file_id: 'A String' id of the remote file
+            local_file_path: 'A String' path of the local file
+            callback: A function that takes None as input argument
+            file_size: Integer, the size of the remote file if known
+        """
+        self._submit('Download of {}'.format(local_file_path),
+                     lambda service: utils.copy_remote_file_to_local(service,
+                                                                     local_file_path,
+                                                                     remote_file_id,
+                                                                     file_size),
+                     callback)
+
+    def submit_overwrite(self, remote_file_id, local_file_path, callback):
+        """
+        Overwrites the remote file with the local file.
+        Args:
+            remote_file_id: 'A String' id of the remote file
+            local_file_path: 'A String' path of the local file
+            callback: A function that takes the updated remote file object as input argument
+        """
+        self._submit('Overwrite of {}'.format(local_file_path),
+                     lambda service: utils.overwrite_remote_file_with_local(service,
+                                                                            remote_file_id,
+                                                                            local_file_path,
+                                                                            self._upload_sessions),
+                     callback)
+
+    def poll(self):
+        """
+        Runs the callbacks of the completed jobs without waiting.
+        """
+        while self._run_completed_callback(block=False):
+            pass
+
+    def join(self):
+        """
+        Waits for all the submitted jobs and runs their callbacks.
+        """
+        while self._pending:
+            self._run_completed_callback(block=True)
+
+    def close(self):
+        """
+        Waits for the submitted jobs, runs their callbacks and stops the workers.
+        """
+        self.join()
+        if self._executor:
+            self._executor.shutdown(wait=True)
+
+    def _submit(self, description, job, callback):
+        if not self._executor:
+            self._completed.put((self._run_job(description, job), callback))
+            self._pending += 1
+            _PENDING.inc()
+            self.poll()
+            return
+        self.poll()
+        while self._pending >= self._max_pending:
+            self._run_completed_callback(block=True)
+        self._pending += 1
+        _PENDING.inc()
+        future = self._executor.submit(self._run_job, description, job)
+        future.add_done_callback(lambda completed_future: self._completed.put((completed_future.result(),
+                                                                               callback)))
+
+    def _run_job(self, description, job):
+        """
+        Returns:
+            A tuple of True and the result of the job if it succeeds, else a tuple of False and None
+        """
+        try:
+            return True, job(self._get_service())
+        except Exception:
+            logger.error('%s failed:', description, exc_info=True)
+            return False, None
+
+    def _run_completed_callback(self, block):
+        """
+        Runs the callback of one completed job, or one write handed over by a worker.
+        Returns:
+            False if no job has completed and nothing was handed over, else True
+        """
+        try:
+            outcome, callback = self._completed.get(block=block)
+        except queue.Empty:
+            return False
+        if outcome is None:
+            # A write of an upload session handed over by a worker
+            callback()
+            return True
+        succeeded, result = outcome
+        self._pending -= 1
+        _PENDING.dec()
+        _TRANSFERS.inc(outcome='succeeded' if succeeded else 'failed')
+        if succeeded:
+            callback(result)
+        return True
+
+    def _get_service(self):
+        service = getattr(self._services, 'service', None)
+        if service is None:
+            service = self._services.service = self._service_factory()
+        return service
@@ -0,0 +1,209 @@
+import os
+
+from gdrive_sync import utils
+
+logger = utils.create_logger(__name__)
+
+_FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+
+class Change:
+    """
+    A decision of the TreeDiff about a local and remote file or dir with the same path.
+    At least one of local_entry and remote_entry is set.
+    """
+    CREATE_LOCAL = 'create_local'
+    CREATE_REMOTE = 'create_remote'
+    UPDATE_LOCAL = 'update_local'
+    UPDATE_REMOTE = 'update_remote'
+    DELETE_LOCAL = 'delete_local'
+    DELETE_REMOTE = 'delete_remote'
+    # The contents are the same, but the modification dates in the Db are outdated
+    RECORD = 'record'
+    UNCHANGED = 'unchanged'
+
+    __slots__ = ('kind', 'local_path', 'local_entry', 'remote_entry', 'remote_parent_id', 'remote_modification_date')
+
+    def __init__(self, kind, local_path, local_entry=None, remote_entry=None, remote_parent_id=None,
+                 remote_modification_date=None):
+        """
+        Args:
+            kind: 'A String', one of the kinds above
+            local_path: 'A String' path of the local file or dir
+            local_entry: The LocalScanner.LocalEntry of the local file or dir, if it exists
+            remote_entry: The dict of the remote file or dir from the remote listing, if it exists
+            remote_parent_id: 'A String' id of the remote parent dir, None if it does not exist yet
+            remote_modification_date: Integer, the remote modification date as epoch
+        """
+        self.kind = kind
+        self.local_path = local_path
+        self.local_entry = local_entry
+        self.remote_entry = remote_entry
+        self.remote_parent_id = remote_parent_id
+        self.remote_modification_date = remote_modification_date
+
+    @property
+    def is_dir(self):
+        if self.local_entry is not None:
+            return self.local_entry.is_dir
+        return self.remote_entry['mimeType'] == _FOLDER_MIME_TYPE
+
+    def __repr__(self):
+        return 'Change({!r}, {!r})'.format(self.kind, self.local_path)
+
+
+def merge_by_name(local_entries, remote_entries):
+    """
+    Joins the local and remote entries of a dir by name, in a single pass.
+    Both inputs must be sorted by name. A name that appears more than once at remote, which
+    Google Drive allows, is joined with the local entry only the first time.
+    Args:
+        local_entries: An iterable of LocalScanner.LocalEntry sorted by name
+        remote_entries: An iterable of remote file and dir dicts sorted by name
+    Returns:
+        Generator of tuples of the name, the local entry or None and the remote entry or None
+    """
+    local_entries = iter(local_entries)
+    remote_entries = iter(remote_entries)
+    local_entry = next(local_entries, None)
+    remote_entry = next(remote_entries, None)
+    while local_entry is not None or remote_entry is not None:
+        if remote_entry is None or (local_entry is not None and local_entry.name < remote_entry['name']):
+            yield local_entry.name, local_entry, None
+            local_entry = next(local_entries, None)
+        elif local_entry is None or remote_entry['name'] < local_entry.name:
+            yield remote_entry['name'], None, remote_entry
+            remote_entry = next(remote_entries, None)
+        else:
+            yield local_entry.name, local_entry, remote_entry
+            local_entry = next(local_entries, None)
+            remote_entry = next(remote_entries, None)
+
+
+class TreeDiff:
+    """
+    Compares a local dir with a remote dir, recursively, and decides for every file and dir
+    whether it is created, updated or deleted on either side, or left unchanged.
+    The entries of one dir are sorted by name and merge joined, so besides the dir being
+    compared, only the sorted listings of its ancestor dirs are held. The dirs are walked
+    with an explicit stack, so the depth of the tree is not bounded by the recursion limit.
+    Whether a file missing on one side was created on the other side or deleted from this
+    side is decided by the records of the synced files in the Db.
+    """
+
+    def __init__(self, db_handler):
+        """
+        Args:
+            db_handler: A Db.DbHandler object with the records of the synced files
+        """
+        self._db_handler = db_handler
+
+    def diff(self, local_entries, remote_entries, local_dir_path, remote_dir_id):
+        """
+        Args:
+            local_entries: An iterable of LocalScanner.LocalEntry of the local dir
+            remote_entries: An iterable of remote file and dir dicts of the remote dir, the dirs
+                have an iterable of their files and dirs as 'children'
+            local_dir_path: 'A String' path of the local dir
+            remote_dir_id: 'A String' id of the remote dir
+        Returns:
+            Generator of Change, a dir comes before the files and dirs under it
+        """
+        dirs = [self._diff_dir(local_entries, remote_entries, local_dir_path, remote_dir_id)]
+        while dirs:
+            item = next(dirs[-1], None)
+            if item is None:
+                dirs.pop()
+            elif isinstance(item, Change):
+                yield item
+            else:
+                # The diff of a child dir
+                dirs.append(item)
+
+    def _diff_dir(self, local_entries, remote_entries, local_dir_path, remote_dir_id):
+        local_entries = sorted(local_entries, key=lambda local_entry: local_entry.name)
+        remote_entries = sorted(remote_entries, key=lambda remote_entry: remote_entry['name'])
+        for name, local_entry, remote_entry in merge_by_name(local_entries, remote_entries):
+            local_path = local_entry.path if local_entry is not None else os.path.join(local_dir_path, name)
+            if remote_entry is None:
+                yield from self._diff_local_only(local_entry, remote_dir_id)
+            elif local_entry is None:
+                yield from self._diff_remote_only(remote_entry, local_path, remote_dir_id)
+            elif local_entry.is_dir != (remote_entry['mimeType'] == _FOLDER_MIME_TYPE):
+                logger.warning('Skipping %s, it is a dir on one side and a file on the other.', local_path)
+            elif local_entry.is_dir:
+                yield self._diff_dir(local_entry.children, remote_entry['children'], local_path, remote_entry['id'])
+            else:
+                yield self._diff_files(local_entry, remote_entry)
+
+    def _diff_local_only(self, local_entry, remote_dir_id):
+        # A local file that was synced before has been deleted from remote
+        if self._db_handler.get_remote_file_id(local_entry.path):
+            yield Change(Change.DELETE_LOCAL, local_entry.path, local_entry=local_entry)
+            return
+        yield Change(Change.CREATE_REMOTE, local_entry.path, local_entry=local_entry, remote_parent_id=remote_dir_id)
+        if local_entry.is_dir:
+            yield self._diff_dir(local_entry.children, (), local_entry.path, None)
+
+    def _diff_remote_only(self, remote_entry, local_path, remote_dir_id):
+        # A remote file that was synced before has been deleted from local
+        if self._db_handler.get_local_file_path(remote_entry['id']):
+            yield Change(Change.DELETE_REMOTE, local_path, remote_entry=remote_entry, remote_parent_id=remote_dir_id)
+            return
+        yield Change(Change.CREATE_LOCAL, local_path, remote_entry=remote_entry, remote_parent_id=remote_dir_id,
+                     remote_modification_date=utils.convert_rfc3339_time_to_epoch(remote_entry['modifiedTime']))
+        if remote_entry['mimeType'] == _FOLDER_MIME_TYPE:
+            yield self._diff_dir((), remote_entry['children'], local_path, remote_entry['id'])
+
+    def _diff_files(self, local_entry, remote_entry):
+        remote_modification_date = utils.convert_rfc3339_time_to_epoch(remote_entry['modifiedTime'])
+
+        def change(kind):
+            return Change(kind, local_entry.path, local_entry=local_entry, remote_entry=remote_entry,
+                          remote_modification_date=remote_modification_date)
+
+        # If the contents are the same, only the modification dates in the Db are refreshed
+        if self._is_content_in_sync(local_entry, remote_entry):
+            if (self._db_handler.get_local_modification_date(local_entry.path) != local_entry.mtime or
+                    self._db_handler.get_remote_modification_date(remote_entry['id']) != remote_modification_date):
+                return change(Change.RECORD)
+            return change(Change.UNCHANGED)
+
+        if local_entry.mtime > remote_modification_date:
+            local_modification_date_in_db = self._db_handler.get_local_modification_date(local_entry.path)
+            # If the local file is not newer than saved in the Db, the remote file was copied to local
+            if not local_modification_date_in_db or local_entry.mtime > local_modification_date_in_db:
+                logger.debug('local_entry.mtime %s, local_modification_date_in_db %s.',
+                             local_entry.mtime, local_modification_date_in_db)
+                return change(Change.UPDATE_REMOTE)
+
+        elif remote_modification_date > local_entry.mtime:
+            remote_modification_date_in_db = self._db_handler.get_remote_modification_date(remote_entry['id'])
+            # If the remote file is not newer than saved in the Db, the local file was copied to remote
+            if not remote_modification_date_in_db or remote_modification_date > remote_modification_date_in_db:
+                logger.debug('remote_modification_date %s, remote_modification_date_in_db %s.',
+                             remote_modification_date, remote_modification_date_in_db)
+                return change(Change.UPDATE_LOCAL)
+        return change(Change.UNCHANGED)
+
+    def _is_content_in_sync(self, local_entry, remote_entry):
+        """
+        Compares the size and the md5 checksum of the local file with the remote file. The remote
+        files without md5Checksum, like the Google Docs, are never considered in sync.
+        """
+        md5_checksum = remote_entry.get('md5Checksum')
+        if not md5_checksum or int(remote_entry.get('size', -1)) != local_entry.size:
+            return False
+        return self._get_local_md5(local_entry) == md5_checksum
+
+    def _get_local_md5(self, local_entry):
+        """
+        Returns the md5 checksum of the local file. It is read from the hash cache in the Db if
+        the file has not changed since it was last hashed, else it is computed and cached.
+        """
+        cache_key = (local_entry.device, local_entry.inode, local_entry.size, local_entry.mtime_ns)
+        md5_checksum = self._db_handler.get_local_hash(*cache_key)
+        if md5_checksum is None:
+            md5_checksum = utils.compute_md5(local_entry.path)
+            self._db_handler.set_local_hash(*cache_key, md5_checksum)
+        return md5_checksum
@@ -2,6 +2,7 @@ import os
 from unittest import TestCase
 import traceback
 import sqlite3
+import threading
 
 from gdrive_sync import Db
 
@@ -17,10 +18,58 @@ class TestDbHandler(TestCase):
     
     def tearDown(self):
         TestCase.tearDown(self)
+        self._db_handler.close()
         os.remove(self._test_db_path)
     
     def test_init(self):
         self.assertTrue(os.path.exists(self._test_db_path), msg='Db file not created')
+
+    def test_schema_version(self):
+        self.assertEqual(len(Db._MIGRATIONS), self._db_handler.get_schema_version())
+        self.assertEqual('wal', self._execute_db_function(
+            lambda cursor: cursor.execute('pragma journal_mode').fetchone()[0]))
+        # The snapshot of the local dirs of schema version 6 was dropped
+        self.assertEqual([], self._execute_db_function(
+            lambda cursor: cursor.execute("select name from sqlite_master where name = 'local_dir'").fetchall()))
+
+    def test_migrate_unversioned_db(self):
+        self._db_handler.close()
+        os.remove(self._test_db_path)
+
+        def create_unversioned_db(cursor):
+            cursor.execute('create table {} (local_path TEXT, remote_id TEXT, '
+                           'local_modification_date INTEGER, remote_modification_date INTEGER)'
+                           .format('file_mapping_info'))
+            cursor.execute('insert into {} values(?, ?, ?, ?)'.format('file_mapping_info'),
+                           ('local_path', 'remote_id', 101, 1001))
+        self._execute_db_function(create_unversioned_db)
+
+        self._db_handler = Db.DbHandler(self._test_db_path)
+
+        self.assertEqual(len(Db._MIGRATIONS), self._db_handler.get_schema_version())
+        self.assertEqual('remote_id', self._db_handler.get_remote_file_id('local_path'))
+        self._db_handler.insert_record('local_path', 'remote_id_modified', 102, 1002)
+        self.assertEqual('remote_id_modified', self._db_handler.get_remote_file_id('local_path'))
+
+    def test_connection_reused_per_thread(self):
+        connection_manager = self._db_handler._connection_manager
+        connection = connection_manager.get_connection()
+        self._db_handler.insert_record('local_path', 'remote_id', 101, 1001)
+        self.assertEqual('remote_id', self._db_handler.get_remote_file_id('local_path'))
+        self.assertIs(connection, connection_manager.get_connection())
+
+        other_thread_connections = []
+        thread = threading.Thread(target=lambda: other_thread_connections.append(
+            connection_manager.get_connection()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(connection, other_thread_connections[0])
+        # The connection of a thread is closed once the thread exits
+        self.assertEqual({connection}, connection_manager._connections)
+        self.assertRaises(sqlite3.ProgrammingError, other_thread_connections[0].execute, 'SELECT 1')
+
+        self._db_handler.close()
+        self.assertIsNot(connection, connection_manager.get_connection())
         
     def test_get_remote_file_id(self):
         def insert_records(cursor):
@@ -123,4 +172,265 @@ class TestDbHandler(TestCase):
                            ('local_path',))
             return cursor.fetchall()
         records = self._execute_db_function(fetch_records)
-        self.assertEqual(0, len(records))
\ No newline at end of file
+        self.assertEqual(0, len(records))
+
+    def test_batch(self):
+        def fetch_records(cursor):
+            cursor.execute('select * from {} order by {}'.format('file_mapping_info', 'local_path'))
+            return cursor.fetchall()
+
+        with self._db_handler.batch(max_size=100, max_delay=60):
+            self._db_handler.insert_record('local_path_1', 'remote_id_1', 101, 1001)
+            self._db_handler.insert_record('local_path_2', 'remote_id_2', 102, 1002)
+            self._db_handler.insert_record('local_path_2', 'remote_id_3', 103, 1003)
+            self._db_handler.update_record('local_path_1', 'remote_id_1', 104, 1004)
+            self._db_handler.insert_record('local_path_4', 'remote_id_4', 105, 1005)
+            self._db_handler.delete_record('local_path_4')
+
+            # Reads on the same thread see the buffered changes, other connections do not
+            self.assertEqual('remote_id_3', self._db_handler.get_remote_file_id('local_path_2'))
+            self.assertEqual([], self._execute_db_function(fetch_records))
+
+        self.assertEqual([('local_path_1', 'remote_id_1', 104, 1004),
+                          ('local_path_2', 'remote_id_3', 103, 1003)],
+                         self._execute_db_function(fetch_records))
+
+    def test_batch_commits_when_full(self):
+        def count_records(cursor):
+            cursor.execute('select count(*) from {}'.format('file_mapping_info'))
+            return cursor.fetchone()[0]
+
+        with self._db_handler.batch(max_size=2, max_delay=60):
+            self._db_handler.insert_record('local_path_1', 'remote_id_1', 101, 1001)
+            self.assertEqual(0, self._execute_db_function(count_records))
+            self._db_handler.insert_record('local_path_2', 'remote_id_2', 102, 1002)
+            self.assertEqual(2, self._execute_db_function(count_records))
+            self._db_handler.insert_record('local_path_3', 'remote_id_3', 103, 1003)
+            self.assertEqual(2, self._execute_db_function(count_records))
+        self.assertEqual(3, self._execute_db_function(count_records))
+
+    def test_load_index(self):
+        def insert_records(cursor):
+            cursor.execute('insert into {} values(?, ?, ?, ?)'.format('file_mapping_info'),
+                           ('local_path_1', 'remote_id_1', 101, 1001))
+            cursor.execute('insert into {} values(?, ?, ?, ?)'.format('file_mapping_info'),
+                           ('local_path_2', 'remote_id_2', 102.5, 1002))
+        self._execute_db_function(insert_records)
+
+        self._db_handler.load_index()
+
+        # Changes made outside of the handler are not seen once the index is loaded
+        self._execute_db_function(lambda cursor: cursor.execute('delete from {}'.format('file_mapping_info')))
+        self.assertEqual('remote_id_1', self._db_handler.get_remote_file_id('local_path_1'))
+        self.assertEqual('local_path_2', self._db_handler.get_local_file_path('remote_id_2'))
+        self.assertEqual(102.5, self._db_handler.get_local_modification_date('local_path_2'))
+        self.assertEqual(1001, self._db_handler.get_remote_modification_date('remote_id_1'))
+        self.assertIsNone(self._db_handler.get_remote_file_id('local_path_3'))
+
+    def test_index_write_through(self):
+        def fetch_records(cursor):
+            cursor.execute('select * from {} order by {}'.format('file_mapping_info', 'local_path'))
+            return cursor.fetchall()
+
+        self._db_handler.load_index()
+        self._db_handler.insert_record('local_path_1', 'remote_id_1', 101, 1001)
+        self._db_handler.insert_record('local_path_2', 'remote_id_2', 102, 1002)
+        self._db_handler.insert_record('local_path_1', 'remote_id_3', 103, 1003)
+        self._db_handler.update_record('local_path_2', 'remote_id_2', 104, 1004)
+        self._db_handler.delete_record('local_path_2')
+
+        self.assertEqual('remote_id_3', self._db_handler.get_remote_file_id('local_path_1'))
+        self.assertIsNone(self._db_handler.get_local_file_path('remote_id_1'))
+        self.assertIsNone(self._db_handler.get_remote_file_id('local_path_2'))
+        self.assertEqual([('local_path_1', 'remote_id_3', 103, 1003)], self._execute_db_function(fetch_records))
+
+        # A failed write drops the index so that the reads fall back to the Db
+        self._db_handler.insert_record('local_path_4', 'remote_id_3', 105, 1005)
+        self.assertIsNone(self._db_handler._index)
+        self.assertEqual('local_path_1', self._db_handler.get_local_file_path('remote_id_3'))
+
+    def test_count_records_under(self):
+        for local_path in ['/dir', '/dir/file1', '/dir/sub/file2', '/dir0/file3', '/dir-1/file4', '/other']:
+            self._db_handler.insert_record(local_path, 'id' + local_path, 101, 1001)
+
+        self.assertEqual(2, self._db_handler.count_records_under('/dir'))
+        self.assertEqual(2, self._db_handler.count_records_under('/dir/'))
+        self.assertEqual(0, self._db_handler.count_records_under('/other'))
+
+    def test_operation_metrics(self):
+        def get_count(operation):
+            return Db._OPERATION_SECONDS.get(operation=operation)[0]
+        counts = {operation: get_count(operation) for operation in ('set_state', 'get_remote_file_id')}
+
+        self._db_handler.set_state('key', 'value')
+        self._db_handler.get_remote_file_id('path')
+        # Also timed when answered by the in-memory index
+        self._db_handler.load_index()
+        self._db_handler.get_remote_file_id('path')
+
+        self.assertEqual(counts['set_state'] + 1, get_count('set_state'))
+        self.assertEqual(counts['get_remote_file_id'] + 2, get_count('get_remote_file_id'))
+        self.assertEqual(0, get_count('_fetch_single_value'))
+
+    def test_state(self):
+        self.assertIsNone(self._db_handler.get_state('key'))
+        self._db_handler.set_state('key', 'value')
+        self._db_handler.set_state('key', 'value_modified')
+        self.assertEqual('value_modified', self._db_handler.get_state('key'))
+
+    def test_upload_session(self):
+        self.assertIsNone(self._db_handler.get_upload_session('local_path'))
+        self._db_handler.set_upload_session('local_path', 'session_uri', 1000, 101.5, 0)
+        self._db_handler.set_upload_session('local_path', 'session_uri', 1000, 101.5, 512)
+        self.assertEqual(('session_uri', 1000, 101.5, 512), self._db_handler.get_upload_session('local_path'))
+
+        # The session is committed right away, even within a batch
+        with self._db_handler.batch(max_size=100, max_delay=60):
+            self._db_handler.delete_upload_session('local_path')
+            self.assertEqual([], self._execute_db_function(
+                lambda cursor: cursor.execute('select * from upload_session').fetchall()))
+            # Along with the batched changes, in the transaction of the batch
+            self._db_handler.insert_record('local_path', 'remote_id', 101, 1001)
+            self._db_handler.set_upload_session('local_path', 'session_uri', 1000, 101.5, 256)
+            self.assertEqual([('local_path', 'session_uri', 1000, 101.5, 256)], self._execute_db_function(
+                lambda cursor: cursor.execute('select * from upload_session').fetchall()))
+            self.assertEqual(1, self._execute_db_function(
+                lambda cursor: cursor.execute('select count(*) from file_mapping_info').fetchone()[0]))
+
+    def test_local_hash(self):
+        self.assertIsNone(self._db_handler.get_local_hash(1, 2, 1000, 101000000000))
+        self._db_handler.set_local_hash(1, 2, 1000, 101000000000, 'md5_1')
+        self.assertEqual('md5_1', self._db_handler.get_local_hash(1, 2, 1000, 101000000000))
+
+        # A changed file misses the cache, and its new hash replaces the old one
+        self.assertIsNone(self._db_handler.get_local_hash(1, 2, 1000, 102000000000))
+        self._db_handler.set_local_hash(1, 2, 1001, 102000000000, 'md5_2')
+        self.assertIsNone(self._db_handler.get_local_hash(1, 2, 1000, 101000000000))
+        self.assertEqual('md5_2', self._db_handler.get_local_hash(1, 2, 1001, 102000000000))
+
+        # Within a batch, the hashes are written with the records
+        def count_hashes(cursor):
+            return cursor.execute('select count(*) from local_hash').fetchone()[0]
+        with self._db_handler.batch(max_size=100, max_delay=60):
+            self._db_handler.set_local_hash(1, 3, 1000, 101000000000, 'md5_3')
+            self.assertEqual('md5_3', self._db_handler.get_local_hash(1, 3, 1000, 101000000000))
+            self.assertEqual(1, self._execute_db_function(count_hashes))
+        self.assertEqual(2, self._execute_db_function(count_hashes))
+
+    def test_move_records(self):
+        def fetch_records(cursor):
+            cursor.execute('select local_path, remote_id from {} order by {}'.format('file_mapping_info',
+                                                                                     'local_path'))
+            return cursor.fetchall()
+        for local_path in ['/dir', '/dir/file1', '/dir/sub/file2', '/dir0', '/new/dir', '/new/dir/old_file']:
+            self._db_handler.insert_record(local_path, 'id' + local_path, 101, 1001)
+        self._db_handler.load_index()
+
+        self._db_handler.move_records('/dir/', '/new/dir')
+
+        self.assertEqual([('/dir0', 'id/dir0'),
+                          ('/new/dir', 'id/dir'),
+                          ('/new/dir/file1', 'id/dir/file1'),
+                          ('/new/dir/sub/file2', 'id/dir/sub/file2')],
+                         self._execute_db_function(fetch_records))
+        self.assertEqual('id/dir/sub/file2', self._db_handler.get_remote_file_id('/new/dir/sub/file2'))
+        self.assertEqual('/new/dir/file1', self._db_handler.get_local_file_path('id/dir/file1'))
+        self.assertIsNone(self._db_handler.get_remote_file_id('/dir/file1'))
+        self.assertIsNone(self._db_handler.get_remote_file_id('/new/dir/old_file'))
+
+    def test_index_move(self):
+        index = Db._MappingIndex()
+        for local_path in ['/dir', '/dir/file1', '/dir-1/file2', '/dir/sub/file3', '/dir0', '/other/file4']:
+            index.put(local_path, 'id' + local_path, 101, 1001)
+        index.move('/dir', '/moved')
+        # A path removed and added again, and paths added after the sorting
+        index.remove('/dir0')
+        index.put('/dir0', 'id/dir0', 101, 1001)
+        index.put('/moved/file5', 'id/moved/file5', 101, 1001)
+
+        index.move('/moved', '/other')
+
+        self.assertEqual({'/dir-1/file2': 'id/dir-1/file2', '/dir0': 'id/dir0', '/other': 'id/dir',
+                          '/other/file1': 'id/dir/file1', '/other/sub/file3': 'id/dir/sub/file3',
+                          '/other/file5': 'id/moved/file5'},
+                         {local_path: index.get_remote_id(local_path) for local_path in index._slot_by_local_path})
+        self.assertIsNone(index.get_local_path('id/other/file4'))
+        self.assertEqual(['/other', '/other/file1', '/other/file5', '/other/sub/file3'],
+                         index._get_local_paths_under('/other'))
+        self.assertEqual(['/dir0'], index._get_local_paths_under('/dir0'))
+
+    def test_index_loaded_once(self):
+        self._db_handler.insert_record('local_path_1', 'remote_id_1', 101, 1001)
+        self._db_handler.load_index()
+        self._execute_db_function(lambda cursor: cursor.execute('delete from {}'.format('file_mapping_info')))
+
+        # The index is not rebuilt, so it keeps the changes written through the handler
+        self._db_handler.insert_record('local_path_2', 'remote_id_2', 102, 1002)
+        self._db_handler.load_index()
+
+        self.assertEqual('remote_id_1', self._db_handler.get_remote_file_id('local_path_1'))
+        self.assertEqual('remote_id_2', self._db_handler.get_remote_file_id('local_path_2'))
+
+    def test_index_loaded_after_failed_write(self):
+        self._db_handler.insert_record('local_path_1', 'remote_id_1', 101, 1001)
+        self._db_handler.load_index()
+        # The other connection holds the write lock
+        connection = sqlite3.connect(self._test_db_path)
+        connection.execute('BEGIN IMMEDIATE')
+        self._db_handler._connection_manager.get_connection().execute('PRAGMA busy_timeout=0')
+        try:
+            self._db_handler.insert_record('local_path_2', 'remote_id_2', 102, 1002)
+        finally:
+            connection.rollback()
+            connection.close()
+        self.assertIsNone(self._db_handler._index)
+
+        self._db_handler.load_index()
+
+        self.assertIsNotNone(self._db_handler._index)
+        self.assertEqual('remote_id_1', self._db_handler.get_remote_file_id('local_path_1'))
+        self.assertIsNone(self._db_handler.get_remote_file_id('local_path_2'))
+
+    def test_remote_dir(self):
+        self.assertIsNone(self._db_handler.get_remote_dir('/dir1'))
+        self._db_handler.set_remote_dir('/dir1', 'id_1', 'modifiedTime_1')
+        self._db_handler.set_remote_dir('/dir1/dir2', 'id_2', 'modifiedTime_2')
+        self._db_handler.set_remote_dir('/dir10', 'id_10', 'modifiedTime_10')
+        self.assertEqual(('id_2', 'modifiedTime_2'), self._db_handler.get_remote_dir('/dir1/dir2'))
+
+        # The remote dirs are kept across runs
+        other_db_handler = Db.DbHandler(self._test_db_path)
+        self.assertEqual(('id_1', 'modifiedTime_1'), other_db_handler.get_remote_dir('/dir1'))
+        other_db_handler.close()
+
+        self._db_handler.delete_remote_dirs_under('/dir1')
+        self.assertIsNone(self._db_handler.get_remote_dir('/dir1'))
+        self.assertIsNone(self._db_handler.get_remote_dir('/dir1/dir2'))
+        self.assertEqual(('id_10', 'modifiedTime_10'), self._db_handler.get_remote_dir('/dir10'))
+        other_db_handler = Db.DbHandler(self._test_db_path)
+        self.assertIsNone(other_db_handler.get_remote_dir('/dir1/dir2'))
+        other_db_handler.close()
+
+    def test_remote_dir_forgotten(self):
+        self._db_handler.set_remote_dir('/dir1', 'id_1', 'modifiedTime_1')
+        self._db_handler.set_remote_dir('/dir1/dir2', 'id_2', 'modifiedTime_2')
+        self._db_handler.set_remote_dir('/dir3', 'id_3', 'modifiedTime_3')
+        self._db_handler.set_remote_dir('/dir10', 'id_10', 'modifiedTime_10')
+        self._db_handler.insert_record('/local/dir1', 'id_1', 101, 1001)
+        self._db_handler.insert_record('/local/dir3', 'id_3', 101, 1001)
+
+        # A deleted dir is forgotten with the dirs under it
+        self._db_handler.delete_record('/local/dir1')
+        self.assertIsNone(self._db_handler.get_remote_dir('/dir1'))
+        self.assertIsNone(self._db_handler.get_remote_dir('/dir1/dir2'))
+        self.assertEqual(('id_10', 'modifiedTime_10'), self._db_handler.get_remote_dir('/dir10'))
+
+        # So is a moved dir
+        self._db_handler.load_index()
+        self._db_handler.move_records('/local/dir3', '/local/dir4')
+        self.assertIsNone(self._db_handler.get_remote_dir('/dir3'))
+
+        other_db_handler = Db.DbHandler(self._test_db_path)
+        self.assertIsNone(other_db_handler.get_remote_dir('/dir1/dir2'))
+        self.assertEqual(('id_10', 'modifiedTime_10'), other_db_handler.get_remote_dir('/dir10'))
+        other_db_handler.close()
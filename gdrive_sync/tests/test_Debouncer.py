@@ -0,0 +1,125 @@
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import Mock
+
+from watchdog import events
+
+from gdrive_sync.Debouncer import Debouncer
+
+
+class TestDebouncer(TestCase):
+
+    def setUp(self):
+        TestCase.setUp(self)
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.now = 0
+        self.forward = Mock()
+        self.debouncer = Debouncer(self.forward, 2, 10, clock=lambda: self.now)
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+        TestCase.tearDown(self)
+
+    def _write(self, file_name, content):
+        file_path = os.path.join(self._temp_dir.name, file_name)
+        with open(file_path, 'w') as _file:
+            _file.write(content)
+        return file_path
+
+    def _forwarded(self):
+        return [(event.event_type, os.path.basename(event.src_path)) for (event,), _ in self.forward.call_args_list]
+
+    def test_created_and_modified(self):
+        file_path = self._write('file1', 'a')
+        self.debouncer.submit(events.FileCreatedEvent(file_path))
+        self.now = 1
+        self._write('file1', 'ab')
+        self.debouncer.submit(events.FileModifiedEvent(file_path))
+        self.debouncer.submit(events.FileModifiedEvent(file_path))
+
+        self.now = 2.5
+        self.assertEqual(0.5, self.debouncer.forward_due())
+        self.forward.assert_not_called()
+        self.now = 3
+        self.assertIsNone(self.debouncer.forward_due())
+        self.assertEqual([('created', 'file1')], self._forwarded())
+
+    def test_modified_without_events(self):
+        file_path = self._write('file1', 'a')
+        self.debouncer.submit(events.FileModifiedEvent(file_path))
+        self.now = 2
+        self._write('file1', 'a longer content')
+        self.assertEqual(2, self.debouncer.forward_due())
+        self.forward.assert_not_called()
+        self.now = 4
+        self.debouncer.forward_due()
+        self.assertEqual([('modified', 'file1')], self._forwarded())
+
+    def test_max_delay(self):
+        file_path = self._write('file1', 'a')
+        self.debouncer.submit(events.FileModifiedEvent(file_path))
+        for self.now in range(1, 10):
+            self.debouncer.submit(events.FileModifiedEvent(file_path))
+            self.debouncer.forward_due()
+        self.forward.assert_not_called()
+        self.now = 10
+        self.debouncer.forward_due()
+        self.assertEqual([('modified', 'file1')], self._forwarded())
+
+    def test_deleted(self):
+        file_path_1 = self._write('file1', 'a')
+        file_path_2 = self._write('file2', 'b')
+        self.debouncer.submit(events.FileCreatedEvent(file_path_1))
+        self.debouncer.submit(events.FileModifiedEvent(file_path_1))
+        self.debouncer.submit(events.FileDeletedEvent(file_path_1))
+        self.debouncer.submit(events.FileModifiedEvent(file_path_2))
+        self.debouncer.submit(events.FileDeletedEvent(file_path_2))
+        self.now = 3
+        self.debouncer.forward_due()
+        self.assertEqual([('deleted', 'file2')], self._forwarded())
+
+    def test_moved(self):
+        file_path_1 = self._write('file1', 'a')
+        file_path_2 = self._write('file2', 'b')
+        self.debouncer.submit(events.FileCreatedEvent(file_path_1))
+        self.debouncer.submit(events.FileModifiedEvent(file_path_2))
+        os.rename(file_path_1, file_path_1 + '_moved')
+        self.debouncer.submit(events.FileMovedEvent(file_path_1, file_path_1 + '_moved'))
+        os.rename(file_path_2, file_path_2 + '_moved')
+        self.debouncer.submit(events.FileMovedEvent(file_path_2, file_path_2 + '_moved'))
+        self.assertEqual([('moved', 'file2')], self._forwarded())
+
+        self.now = 3
+        self.debouncer.forward_due()
+        self.assertEqual([('moved', 'file2'), ('created', 'file1_moved'), ('modified', 'file2_moved')],
+                         self._forwarded())
+
+    def test_moved_dir(self):
+        os.mkdir(os.path.join(self._temp_dir.name, 'dir1'))
+        file_path = self._write(os.path.join('dir1', 'file1'), 'a')
+        self.debouncer.submit(events.FileCreatedEvent(file_path))
+        dir_path = os.path.join(self._temp_dir.name, 'dir1')
+        os.rename(dir_path, dir_path + '_moved')
+        self.debouncer.submit(events.DirMovedEvent(dir_path, dir_path + '_moved'))
+        # watchdog follows with a synthetic move of every file under the dir
+        self.debouncer.submit(events.FileMovedEvent(file_path, os.path.join(dir_path + '_moved', 'file1'),
+                                                    is_synthetic=True))
+        self.assertEqual([('moved', 'dir1')], self._forwarded())
+
+        self.now = 3
+        self.debouncer.forward_due()
+        self.assertEqual([('moved', 'dir1'), ('created', 'file1')], self._forwarded())
+        self.assertEqual(os.path.join(dir_path + '_moved', 'file1'), self.forward.call_args[0][0].src_path)
+
+    def test_dirs_are_forwarded(self):
+        self.debouncer.submit(events.DirCreatedEvent(self._temp_dir.name))
+        self.debouncer.submit(events.DirModifiedEvent(self._temp_dir.name))
+        self.assertEqual([('created', os.path.basename(self._temp_dir.name))], self._forwarded())
+
+    def test_stop_flushes(self):
+        file_path = self._write('file1', 'a')
+        self.debouncer.start()
+        self.debouncer.submit(events.FileCreatedEvent(file_path))
+        self.debouncer.stop()
+        self.assertEqual([('created', 'file1')], self._forwarded())
@@ -0,0 +1,109 @@
+from unittest import TestCase
+from unittest.mock import Mock, call
+
+from googleapiclient.errors import HttpError
+
+from gdrive_sync.DriveBatch import DriveBatch
+
+
+class TestDriveBatch(TestCase):
+
+    def setUp(self):
+        TestCase.setUp(self)
+        self.mocked_service = Mock()
+        self.mocked_governor = Mock(max_retries=2)
+        self.batch_requests = []
+
+        def new_batch_http_request(callback):
+            batch_request = Mock()
+            requests = []
+            batch_request.add.side_effect = lambda request, request_id: requests.append((request, request_id))
+
+            def execute():
+                self.batch_requests.append(requests)
+                # The responses of a batch request may come in any order
+                for request, request_id in reversed(requests):
+                    if request == 'failing_request':
+                        callback(request_id, None, Exception('failed'))
+                    elif request == 'throttled_request':
+                        callback(request_id, None, HttpError(Mock(status=429), b''))
+                    else:
+                        callback(request_id, 'response to ' + request, None)
+            batch_request.execute.side_effect = execute
+            return batch_request
+        self.mocked_service.new_batch_http_request.side_effect = new_batch_http_request
+
+    def test_flush(self):
+        callback = Mock()
+        drive_batch = DriveBatch(self.mocked_service, governor=self.mocked_governor)
+        drive_batch.add('request1', callback.request1)
+        drive_batch.add('failing_request', callback.failing_request)
+        drive_batch.add('request3', callback.request3)
+        self.assertEqual(3, len(drive_batch))
+
+        drive_batch.flush()
+        drive_batch.flush()
+
+        self.assertEqual(0, len(drive_batch))
+        self.assertEqual(1, len(self.batch_requests))
+        callback.request1.assert_called_once_with('response to request1', None)
+        self.assertIsNone(callback.failing_request.call_args[0][0])
+        self.assertEqual('failed', str(callback.failing_request.call_args[0][1]))
+        callback.request3.assert_called_once_with('response to request3', None)
+
+    def test_max_size(self):
+        callback = Mock()
+        drive_batch = DriveBatch(self.mocked_service, max_size=1000, governor=self.mocked_governor)
+
+        for i in range(250):
+            drive_batch.add('request{}'.format(i), callback)
+        self.assertEqual([100, 100], [len(requests) for requests in self.batch_requests])
+        drive_batch.flush()
+
+        self.assertEqual([100, 100, 50], [len(requests) for requests in self.batch_requests])
+        self.assertEqual(250, callback.call_count)
+
+    def test_failed_batch_request(self):
+        callback = Mock()
+        self.mocked_service.new_batch_http_request.side_effect = None
+        self.mocked_service.new_batch_http_request.return_value.execute.side_effect = Exception('connection lost')
+        drive_batch = DriveBatch(self.mocked_service, governor=self.mocked_governor)
+        drive_batch.add('request1', callback)
+        drive_batch.add('request2', callback)
+
+        drive_batch.flush()
+
+        self.assertEqual(2, callback.call_count)
+        self.assertEqual('connection lost', str(callback.call_args[0][1]))
+
+    def test_requests(self):
+        drive_batch = DriveBatch(self.mocked_service, governor=self.mocked_governor)
+        self.mocked_service.files.return_value.delete.return_value = 'delete'
+        self.mocked_service.files.return_value.create.return_value = 'create'
+        callback = Mock()
+
+        drive_batch.delete('remote_file_id', callback)
+        drive_batch.create_remote_dir('dir_name', 'parent_dir_id', callback)
+        drive_batch.flush()
+
+        self.mocked_service.files.return_value.delete.assert_called_once_with(fileId='remote_file_id')
+        self.mocked_service.files.return_value.create.assert_called_once_with(
+            body={'parents': ['parent_dir_id'], 'name': 'dir_name', 'mimeType': 'application/vnd.google-apps.folder'},
+            fields='id')
+        callback.assert_has_calls([call('response to create', None), call('response to delete', None)])
+
+    def test_throttled_requests(self):
+        callback = Mock()
+        drive_batch = DriveBatch(self.mocked_service, governor=self.mocked_governor)
+        drive_batch.add('request1', callback.request1)
+        drive_batch.add('throttled_request', callback.throttled_request)
+
+        drive_batch.flush()
+
+        # The throttled request is sent again until it runs out of retries
+        self.assertEqual([['request1', 'throttled_request'], ['throttled_request'], ['throttled_request']],
+                         [[request for request, _ in requests] for requests in self.batch_requests])
+        self.assertEqual([call(0), call(1)], self.mocked_governor.backoff.call_args_list)
+        self.assertEqual(3, self.mocked_governor.throttled.call_count)
+        callback.request1.assert_called_once_with('response to request1', None)
+        self.assertEqual(429, callback.throttled_request.call_args[0][1].resp.status)
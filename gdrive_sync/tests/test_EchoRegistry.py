@@ -0,0 +1,107 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from watchdog.events import (DirCreatedEvent, FileCreatedEvent, FileDeletedEvent, FileModifiedEvent,
+                             FileMovedEvent, DirDeletedEvent)
+
+from gdrive_sync.EchoRegistry import EchoRegistry
+
+
+class _FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestEchoRegistry(TestCase):
+
+    def setUp(self):
+        TestCase.setUp(self)
+        self.local_dir = tempfile.TemporaryDirectory()
+        self.clock = _FakeClock()
+        self.echo_registry = EchoRegistry(60, clock=self.clock)
+        self.echo_registry.activate()
+
+    def tearDown(self):
+        TestCase.tearDown(self)
+        self.local_dir.cleanup()
+
+    def _path(self, *names):
+        return os.path.join(self.local_dir.name, *names)
+
+    def _write(self, path, content):
+        with open(path, 'wb') as _file:
+            _file.write(content)
+
+    def _download(self, path, content):
+        # Writes the file the way utils.copy_remote_file_to_local does
+        self.echo_registry.expect_download(path)
+        temp_path = os.path.join(os.path.dirname(path), '.{}.abc_1234.part'.format(os.path.basename(path)))
+        self._write(temp_path, content)
+        self.echo_registry.expect_file(path, os.stat(temp_path))
+        os.replace(temp_path, path)
+        return temp_path
+
+    def test_download(self):
+        file_path = self._path('file')
+        temp_path = self._download(file_path, b'content')
+
+        self.assertIsNone(self.echo_registry.filter(FileCreatedEvent(temp_path)))
+        self.assertIsNone(self.echo_registry.filter(FileModifiedEvent(temp_path)))
+        self.assertIsNone(self.echo_registry.filter(FileMovedEvent(temp_path, file_path)))
+        self.assertIsNone(self.echo_registry.filter(FileModifiedEvent(file_path)))
+
+        # A later change of the file is synced
+        self._write(file_path, b'changed content')
+        self.assertEqual(FileModifiedEvent(file_path), self.echo_registry.filter(FileModifiedEvent(file_path)))
+        self.assertEqual(FileModifiedEvent(file_path), self.echo_registry.filter(FileModifiedEvent(file_path)))
+
+    def test_download_changed_before_the_event(self):
+        file_path = self._path('file')
+        temp_path = self._download(file_path, b'content')
+        self._write(file_path, b'changed content')
+
+        self.assertEqual(FileModifiedEvent(file_path),
+                         self.echo_registry.filter(FileMovedEvent(temp_path, file_path)))
+
+    def test_dir_created_and_deleted(self):
+        dir_path = self._path('dir')
+        self.echo_registry.expect_dir(dir_path)
+        os.mkdir(dir_path)
+        self.assertIsNone(self.echo_registry.filter(DirCreatedEvent(dir_path)))
+        self._write(self._path('dir', 'file'), b'content')
+        self.assertEqual(FileCreatedEvent(self._path('dir', 'file')),
+                         self.echo_registry.filter(FileCreatedEvent(self._path('dir', 'file'))))
+
+        self.echo_registry.expect_deleted(dir_path)
+        shutil.rmtree(dir_path)
+        self.assertIsNone(self.echo_registry.filter(FileDeletedEvent(self._path('dir', 'file'))))
+        self.assertIsNone(self.echo_registry.filter(DirDeletedEvent(dir_path)))
+
+        # A dir created again by the user is synced
+        os.mkdir(dir_path)
+        self.assertEqual(DirCreatedEvent(dir_path), self.echo_registry.filter(DirCreatedEvent(dir_path)))
+
+    def test_other_events(self):
+        file_path = self._path('file')
+        self._write(file_path, b'content')
+
+        self.assertEqual(FileCreatedEvent(file_path), self.echo_registry.filter(FileCreatedEvent(file_path)))
+        self.assertEqual(FileDeletedEvent(self._path('missing')),
+                         self.echo_registry.filter(FileDeletedEvent(self._path('missing'))))
+
+    def test_expiry_and_inactive(self):
+        file_path = self._path('file')
+        self._download(file_path, b'content')
+        self.clock.now = 61
+        self.assertEqual(FileModifiedEvent(file_path), self.echo_registry.filter(FileModifiedEvent(file_path)))
+
+        # Nothing is registered without an active watcher
+        self.echo_registry.deactivate()
+        self._download(file_path, b'content')
+        self.assertEqual(FileModifiedEvent(file_path), self.echo_registry.filter(FileModifiedEvent(file_path)))
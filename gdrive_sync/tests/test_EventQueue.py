@@ -0,0 +1,137 @@
+import threading
+from unittest import TestCase
+from unittest.mock import Mock
+
+from watchdog import events
+
+from gdrive_sync.EventQueue import EventQueue
+
+
+class TestEventQueue(TestCase):
+
+    def test_per_path_order(self):
+        processed = []
+        lock = threading.Lock()
+        path1_started = threading.Event()
+        path2_processed = threading.Event()
+
+        def process(event):
+            if event.src_path == 'path1' and not path1_started.is_set():
+                path1_started.set()
+                # The events of other paths are processed while this one runs
+                self.assertTrue(path2_processed.wait(5))
+            with lock:
+                processed.append((event.event_type, event.src_path))
+            if event.src_path == 'path2':
+                path2_processed.set()
+        event_queue = EventQueue(process, 2, 10, 5)
+        event_queue.start()
+
+        event_queue.put(events.FileCreatedEvent('path1'))
+        self.assertTrue(path1_started.wait(5))
+        event_queue.put(events.FileModifiedEvent('path1'))
+        event_queue.put(events.FileMovedEvent('path3', 'path1_moved'))
+        event_queue.put(events.FileMovedEvent('path1', 'path1_moved'))
+        event_queue.put(events.FileModifiedEvent('path2'))
+        event_queue.stop()
+
+        self.assertEqual(0, len(event_queue))
+        self.assertEqual([('created', 'path1'), ('modified', 'path1'), ('moved', 'path1')],
+                         [each for each in processed if each[1] == 'path1'])
+        # Both moves have the same destination
+        self.assertLess(processed.index(('moved', 'path3')), processed.index(('moved', 'path1')))
+        self.assertLess(processed.index(('modified', 'path2')), processed.index(('created', 'path1')))
+
+    def test_parent_and_child_order(self):
+        processed = []
+        lock = threading.Lock()
+        release = threading.Event()
+        unrelated_processed = threading.Event()
+
+        def process(event):
+            if event.src_path == '/w/a' and event.event_type == events.EVENT_TYPE_CREATED:
+                # The events of unrelated paths are processed while this one runs
+                self.assertTrue(unrelated_processed.wait(5))
+                self.assertTrue(release.wait(5))
+            with lock:
+                processed.append((event.event_type, event.src_path))
+            if event.src_path == '/w/c':
+                unrelated_processed.set()
+        event_queue = EventQueue(process, 4, 10, 5)
+        event_queue.start()
+
+        event_queue.put(events.DirCreatedEvent('/w/a'))
+        event_queue.put(events.DirCreatedEvent('/w/a/b'))
+        event_queue.put(events.FileCreatedEvent('/w/a/b/f'))
+        event_queue.put(events.FileCreatedEvent('/w/c'))
+        event_queue.put(events.FileDeletedEvent('/w/a/b/f'))
+        event_queue.put(events.DirDeletedEvent('/w/a/b'))
+        event_queue.put(events.DirMovedEvent('/w/a', '/w/d'))
+        self.assertTrue(unrelated_processed.wait(5))
+        release.set()
+        event_queue.stop()
+
+        self.assertEqual([('created', '/w/c'), ('created', '/w/a'), ('created', '/w/a/b'), ('created', '/w/a/b/f'),
+                          ('deleted', '/w/a/b/f'), ('deleted', '/w/a/b'), ('moved', '/w/a')], processed)
+        self.assertEqual({}, event_queue._jobs_by_path)
+        self.assertEqual({}, event_queue._paths_under)
+
+    def test_overflow(self):
+        release = threading.Event()
+        processed = []
+        on_overflow = Mock()
+
+        def process(event):
+            self.assertTrue(release.wait(5))
+            processed.append(event.src_path)
+        event_queue = EventQueue(process, 1, 2, 0.01, on_overflow)
+        event_queue.start()
+
+        self.assertTrue(event_queue.put(events.FileModifiedEvent('path1')))
+        self.assertTrue(event_queue.put(events.FileModifiedEvent('path2')))
+        self.assertFalse(event_queue.put(events.FileModifiedEvent('path3')))
+        on_overflow.assert_not_called()
+        release.set()
+        event_queue.stop()
+
+        self.assertEqual(['path1', 'path2'], processed)
+        on_overflow.assert_called_once_with()
+
+    def test_pause(self):
+        release = threading.Event()
+        path2_processed = threading.Event()
+        processed = []
+
+        def process(event):
+            if event.src_path == 'path1':
+                self.assertTrue(release.wait(5))
+            processed.append(event.src_path)
+            if event.src_path == 'path2':
+                path2_processed.set()
+        event_queue = EventQueue(process, 2, 10, 5)
+        event_queue.start()
+        event_queue.put(events.FileModifiedEvent('path1'))
+        threading.Timer(0.1, release.set).start()
+
+        # Waits for the running event
+        event_queue.pause()
+        self.assertEqual(['path1'], processed)
+        event_queue.put(events.FileModifiedEvent('path2'))
+        event_queue.pause()
+        event_queue.resume()
+        self.assertFalse(path2_processed.wait(0.1))
+        event_queue.resume()
+        self.assertTrue(path2_processed.wait(5))
+        event_queue.stop()
+
+        self.assertEqual(['path1', 'path2'], processed)
+
+    def test_failed_event_does_not_block_the_path(self):
+        process = Mock(side_effect=[Exception('failed'), None])
+        event_queue = EventQueue(process, 0, 10, 5)
+
+        event_queue.put(events.FileModifiedEvent('path1'))
+        event_queue.put(events.FileDeletedEvent('path1'))
+        event_queue.stop()
+
+        self.assertEqual(['modified', 'deleted'], [event.event_type for (event,), _ in process.call_args_list])
@@ -1,14 +1,37 @@
 from unittest import TestCase
-from unittest.mock import Mock, patch, call
+from unittest.mock import Mock, patch, call, ANY
 from unittest.case import skip
+import os
+import sqlite3
+import tempfile
 import time
 
+from watchdog.events import FileDeletedEvent
+
 from gdrive_sync.GdriveSync import GdriveSync
 from gdrive_sync import utils, Db
+from gdrive_sync.LocalFSEventHandler import LocalFSEventHandler
+from gdrive_sync.LocalScanner import LocalEntry
+from gdrive_sync.SyncPlan import SyncAction, SyncPlan
+from gdrive_sync.TransferEngine import TransferEngine
 
 logger = utils.create_logger(__name__)
 
 
+def _create_local_entry(name, path, mtime=None, size=None, children=None, device=None, inode=None, mtime_ns=None):
+    local_entry = Mock(spec_set=LocalEntry)
+    local_entry.name = name
+    local_entry.path = path
+    local_entry.mtime = mtime
+    local_entry.size = size
+    local_entry.is_dir = children is not None
+    local_entry.children = children
+    local_entry.device = device
+    local_entry.inode = inode
+    local_entry.mtime_ns = mtime_ns
+    return local_entry
+
+
 class TestGdriveSync(TestCase):
 
     def setUp(self):
@@ -27,64 +50,193 @@ class TestGdriveSync(TestCase):
     @patch('gdrive_sync.utils.convert_rfc3339_time_to_epoch', autospec=True)
     @patch('gdrive_sync.utils.list_files_under_local_dir', autospec=True)
     @patch('gdrive_sync.utils.list_remote_files_from_dir', autospec=True)
-    @patch('gdrive_sync.utils.get_remote_dir', autospec=True)
+    @patch('gdrive_sync.utils.resolve_remote_dir', autospec=True)
     def test_process_dir_pairs(self,
-                               mock_get_remote_dir,
+                               mock_resolve_remote_dir,
                                mock_list_remote_files_from_dir,
                                mock_list_files_under_local_dir,
                                mock_convert_rfc3339_time_to_epoch,
                                mock_os_stat):
         mocked_service = Mock()
         dir_pairs = {'/home/test1/child': '/test1/child'}
-        mock_get_remote_dir.return_value = {'id': 'remote_dir_id', 'modifiedTime': 'test_modifiedTime'}
+        mock_resolve_remote_dir.return_value = {'id': 'remote_dir_id', 'modifiedTime': 'test_modifiedTime'}
         mock_list_remote_files_from_dir.return_value = 'remote_files_under_dir'
         mock_list_files_under_local_dir.return_value = 'local_files_under_dir'
-        self.gdriveSync._compare_and_sync_files = Mock()
+        self.gdriveSync._compare_files = Mock()
+        self.gdriveSync._transfer_engine = Mock(TransferEngine)
         mock_convert_rfc3339_time_to_epoch.return_value = 101
         self.gdriveSync._db_handler = Mock(Db.DbHandler)
+        self.gdriveSync._db_handler.count_records_under.return_value = 10
+        self.gdriveSync._db_handler.get_state.return_value = None
         mock_os_stat.return_value.st_mtime = 1001
 
-        self.gdriveSync._process_dir_pairs(mocked_service, dir_pairs)
+        plan = self.gdriveSync._process_dir_pairs(mocked_service, dir_pairs)
 
-        mock_get_remote_dir.assert_called_once_with(mocked_service, 'root', ['test1', 'child'])
+        self.assertEqual([SyncAction(SyncAction.RECORD, '/home/test1/child', remote_id='remote_dir_id',
+                                     local_modification_date=1001, remote_modification_date=101)],
+                         plan.actions)
+        mock_resolve_remote_dir.assert_called_once_with(mocked_service, '/test1/child', self.gdriveSync._db_handler)
         mock_list_remote_files_from_dir.assert_called_once_with(mocked_service, 'remote_dir_id')
         mock_list_files_under_local_dir.assert_called_once_with('/home/test1/child')
-        self.gdriveSync._compare_and_sync_files.assert_called_once_with(mocked_service,
-                                                                        'remote_files_under_dir',
-                                                                        'remote_dir_id',
-                                                                        'local_files_under_dir',
-                                                                        '/home/test1/child')
+        self.gdriveSync._compare_files.assert_called_once_with(ANY,
+                                                               'remote_files_under_dir',
+                                                               'remote_dir_id',
+                                                               'local_files_under_dir',
+                                                               '/home/test1/child',
+                                                               self.gdriveSync._db_handler)
         mock_convert_rfc3339_time_to_epoch.assert_called_once_with('test_modifiedTime')
         self.gdriveSync._db_handler.insert_record.assert_called_once_with('/home/test1/child',
                                                                           'remote_dir_id',
                                                                           1001,
                                                                           101)
 
-    @patch('gdrive_sync.utils.delete_file_on_remote', autospec=True)
-    @patch('gdrive_sync.utils.create_local_dir', autospec=True)
-    @patch('time.time', autospec=True)
-    @patch('gdrive_sync.utils.copy_local_file_to_remote', autospec=True)
-    @patch('gdrive_sync.utils.overwrite_remote_file_with_local', autospec=True)
-    @patch('gdrive_sync.utils.copy_remote_file_to_local', autospec=True)
+        self.gdriveSync._db_handler.reset_mock()
+        self.gdriveSync._process_dir_pairs(mocked_service, dir_pairs, dry_run=True)
+        self.gdriveSync._db_handler.insert_record.assert_not_called()
+
+    @patch('os.stat', autospec=True)
     @patch('gdrive_sync.utils.convert_rfc3339_time_to_epoch', autospec=True)
-    def test_compare_and_sync_files(self,
-                                    mock_convert_rfc3339_time_to_epoch,
-                                    mock_copy_remote_file_to_local,
-                                    mock_overwrite_remote_file_with_local,
-                                    mock_copy_local_file_to_remote,
-                                    mock_time,
-                                    mock_create_local_dir,
-                                    mock_delete_file_on_remote):
+    @patch('gdrive_sync.utils.list_files_under_local_dir', autospec=True)
+    @patch('gdrive_sync.utils.list_remote_files_from_tree', autospec=True)
+    @patch('gdrive_sync.utils.list_all_remote_files', autospec=True)
+    @patch('gdrive_sync.utils.resolve_remote_dir', autospec=True)
+    def test_process_dir_pairs_whole_drive(self,
+                                           mock_resolve_remote_dir,
+                                           mock_list_all_remote_files,
+                                           mock_list_remote_files_from_tree,
+                                           mock_list_files_under_local_dir,
+                                           mock_convert_rfc3339_time_to_epoch,
+                                           mock_os_stat):
         mocked_service = Mock()
+        dir_pairs = {'/home/test1/child': '/test1/child'}
+        mock_resolve_remote_dir.return_value = {'id': 'remote_dir_id', 'modifiedTime': 'test_modifiedTime'}
+        mock_list_all_remote_files.return_value = {'remote_dir_id': ['file1', 'file2'], 'other_id': ['file3']}
+        mock_list_remote_files_from_tree.return_value = 'remote_files_under_dir'
+        mock_list_files_under_local_dir.return_value = 'local_files_under_dir'
+        self.gdriveSync._compare_files = Mock()
+        self.gdriveSync._transfer_engine = Mock(TransferEngine)
+        self.gdriveSync._db_handler = Mock(Db.DbHandler)
+        self.gdriveSync._db_handler.count_records_under.return_value = 400
+        self.gdriveSync._db_handler.get_state.return_value = '1000'
+
+        self.gdriveSync._process_dir_pairs(mocked_service, dir_pairs)
+
+        self.gdriveSync._db_handler.count_records_under.assert_called_once_with('/home/test1/child')
+        self.gdriveSync._db_handler.get_state.assert_called_once_with('drive_item_count')
+        mock_list_all_remote_files.assert_called_once_with(mocked_service, 1000)
+        self.gdriveSync._db_handler.set_state.assert_called_once_with('drive_item_count', '3')
+        mock_list_remote_files_from_tree.assert_called_once_with(mock_list_all_remote_files.return_value,
+                                                                 'remote_dir_id')
+        self.gdriveSync._compare_files.assert_called_once_with(ANY,
+                                                               'remote_files_under_dir',
+                                                               'remote_dir_id',
+                                                               'local_files_under_dir',
+                                                               '/home/test1/child',
+                                                               self.gdriveSync._db_handler)
+
+    @patch('os.stat', autospec=True)
+    @patch('gdrive_sync.utils.convert_rfc3339_time_to_epoch', autospec=True)
+    @patch('gdrive_sync.utils.list_files_under_local_dir', autospec=True)
+    @patch('gdrive_sync.utils.list_remote_files_from_dir', autospec=True)
+    @patch('gdrive_sync.utils.resolve_remote_dir', autospec=True)
+    def test_process_dir_pairs_remote_tree_walker(self,
+                                                  mock_resolve_remote_dir,
+                                                  mock_list_remote_files_from_dir,
+                                                  mock_list_files_under_local_dir,
+                                                  mock_convert_rfc3339_time_to_epoch,
+                                                  mock_os_stat):
+        mocked_service = Mock()
+        mock_resolve_remote_dir.return_value = {'id': 'remote_dir_id', 'modifiedTime': 'test_modifiedTime'}
+        mock_list_files_under_local_dir.return_value = 'local_files_under_dir'
+        self.gdriveSync._compare_files = Mock()
+        self.gdriveSync._transfer_engine = Mock(TransferEngine)
+        self.gdriveSync._db_handler = Mock(Db.DbHandler)
+        self.gdriveSync._db_handler.count_records_under.return_value = 10
+        self.gdriveSync._db_handler.get_state.return_value = None
+        self.gdriveSync._remote_tree_walker = Mock()
+        self.gdriveSync._remote_tree_walker.list_remote_files_from_dir.return_value = 'remote_files_under_dir'
+
+        self.gdriveSync._process_dir_pairs(mocked_service, {'/home/test1/child': '/test1/child'})
+
+        mock_list_remote_files_from_dir.assert_not_called()
+        self.gdriveSync._remote_tree_walker.list_remote_files_from_dir.assert_called_once_with('remote_dir_id')
+        self.gdriveSync._compare_files.assert_called_once_with(ANY,
+                                                               'remote_files_under_dir',
+                                                               'remote_dir_id',
+                                                               'local_files_under_dir',
+                                                               '/home/test1/child',
+                                                               self.gdriveSync._db_handler)
+
+    @patch('gdrive_sync.utils.list_drive_files', autospec=True)
+    @patch('gdrive_sync.utils.get_pooled_service', autospec=True)
+    def test_dry_run_leaves_db_unchanged(self, mock_get_pooled_service, mock_list_drive_files):
+        remote_dir = {'id': 'remote_dir_id', 'modifiedTime': '2020-01-01T00:00:00.000Z'}
+        remote_file = {'id': 'remote_file_id', 'name': 'file1', 'modifiedTime': '2020-01-01T00:00:00.000Z',
+                       'mimeType': 'text/plain', 'size': '7', 'md5Checksum': '9a0364b9e99bb480dd25e1f0284c8555',
+                       'parents': ['remote_dir_id']}
+        mock_list_drive_files.side_effect = lambda service, fields, query=None, **kwargs: \
+            {'files': [dict(remote_file)]} if query == 'trashed = false' else {'files': [remote_dir]}
+        # The stored remote dir was trashed
+        mock_get_pooled_service.return_value.files.return_value.get.return_value.execute.return_value = \
+            {'id': 'stale_remote_dir_id', 'modifiedTime': '2019-01-01T00:00:00.000Z', 'trashed': True}
+        with tempfile.TemporaryDirectory() as temp_dir:
+            local_dir = os.path.join(temp_dir, 'local')
+            os.mkdir(local_dir)
+            with open(os.path.join(local_dir, 'file1'), 'w') as local_file:
+                local_file.write('content')
+            db_file_path = os.path.join(temp_dir, 'test_db')
+            db_handler = self.gdriveSync._db_handler = Db.DbHandler(db_file_path)
+            try:
+                db_handler.insert_record(local_dir, 'stale_remote_dir_id', 101, 1001)
+                db_handler.set_remote_dir('/remote', 'stale_remote_dir_id', '2019-01-01T00:00:00.000Z')
+                # The whole drive is listed
+                db_handler.set_state('drive_item_count', '0')
+
+                def dump_db():
+                    connection = sqlite3.connect(db_file_path)
+                    try:
+                        return list(connection.iterdump())
+                    finally:
+                        connection.close()
+                db_before = dump_db()
+
+                plan = self.gdriveSync.sync_onetime({local_dir: '/remote'}, dry_run=True)
+
+                self.assertEqual(db_before, dump_db())
+            finally:
+                db_handler.close()
+
+        self.assertEqual([(SyncAction.RECORD, local_dir, 'remote_dir_id'),
+                          (SyncAction.RECORD, os.path.join(local_dir, 'file1'), 'remote_file_id')],
+                         [(action.kind, action.local_path, action.remote_id) for action in plan.actions])
+
+    def test_should_list_whole_drive(self):
+        self.gdriveSync._db_handler = Mock(Db.DbHandler)
+        self.gdriveSync._db_handler.count_records_under.return_value = 3000
+        dir_pairs = {'/local1': '/remote1', '/local2': '/remote2'}
+
+        self.gdriveSync._db_handler.get_state.return_value = None
+        self.assertTrue(self.gdriveSync._should_list_whole_drive(dir_pairs))
+        self.gdriveSync._db_handler.get_state.return_value = '40000'
+        self.assertFalse(self.gdriveSync._should_list_whole_drive(dir_pairs))
+        self.gdriveSync._db_handler.get_state.return_value = '20000'
+        self.assertTrue(self.gdriveSync._should_list_whole_drive(dir_pairs))
+        self.gdriveSync._db_handler.count_records_under.return_value = 1000
+        self.gdriveSync._db_handler.get_state.return_value = None
+        self.assertFalse(self.gdriveSync._should_list_whole_drive(dir_pairs))
 
+    @patch('gdrive_sync.utils.convert_rfc3339_time_to_epoch', autospec=True)
+    def test_compare_files(self, mock_convert_rfc3339_time_to_epoch):
         # remote files mock
         remote_files = iter([{'id': '1', 'name': 'file1', 'modifiedTime': 'modifiedTime1', 'mimeType': 'file'},
-                             {'id': '2', 'name': 'file2', 'modifiedTime': 'modifiedTime2', 'mimeType': 'file'},
+                             {'id': '2', 'name': 'file2', 'modifiedTime': 'modifiedTime2', 'mimeType': 'file',
+                              'size': '20'},
                              {'id': '5', 'name': 'dir5', 'modifiedTime': 'modifiedTime5',
                               'mimeType': 'application/vnd.google-apps.folder',
                               'children': iter([{'id': '6', 'name': 'file6', 'modifiedTime': 'modifiedTime6',
-                                                 'mimeType': 'file'}])},  # Dir
-                             {'id': '3', 'name': 'file3', 'modifiedTime': 'modifiedTime3', 'mimeType': 'file'},
+                                                 'mimeType': 'file', 'size': '60'}])},  # Dir
+                             {'id': '3', 'name': 'file3', 'modifiedTime': 'modifiedTime3', 'mimeType': 'file',
+                              'size': '30'},
                              # remote file will be copied to local
                              {'id': '7', 'name': 'dir7', 'modifiedTime': 'modifiedTime7',
                               'mimeType': 'application/vnd.google-apps.folder',
@@ -100,43 +252,27 @@ class TestGdriveSync(TestCase):
                              ])
 
         # local files mock
-        local_file_mock_1 = Mock()
-        local_file_mock_1.name = 'file1'
-        local_file_mock_1.path = 'path1'
-        local_file_mock_1.stat.return_value.st_mtime = 101.11
-        local_file_mock_2 = Mock()
-        local_file_mock_2.name = 'file2'
-        local_file_mock_2.path = 'path2'
-        local_file_mock_2.stat.return_value.st_mtime = 99
-        local_file_mock_4 = Mock(name='file4', path='path4')
-        local_file_mock_4.name = 'file4'
-        local_file_mock_4.path = 'path4'
-        local_file_mock_4.stat.return_value.st_mtime = 98
-        local_dir_mock_5 = Mock(name='dir5', path='path4')
-        local_dir_mock_5.name = 'dir5'
-        local_dir_mock_5.path = 'path5'
-        local_dir_mock_5.stat.return_value.st_mtime = 97
-        local_file_mock_6 = Mock(name='file6', path='path6')
-        local_file_mock_6.name = 'file4'
-        local_file_mock_6.path = 'path4'
-        local_file_mock_6.stat.return_value.st_mtime = 96
+        local_file_mock_1 = _create_local_entry('file1', 'local_parent_dir1/file1', mtime=101.11, size=10)
+        local_file_mock_2 = _create_local_entry('file2', 'local_parent_dir1/file2', mtime=99)
+        local_file_mock_4 = _create_local_entry('file4', 'local_parent_dir1/file4', mtime=98, size=40)
+        local_file_mock_6 = _create_local_entry('file4', 'local_parent_dir1/dir5/file4', mtime=96, size=40)
+        local_dir_mock_5 = _create_local_entry('dir5', 'local_parent_dir1/dir5', mtime=97,
+                                               children=iter([local_file_mock_6]))
         local_files = [local_file_mock_1,  # local file will replace remote
                        local_file_mock_2,  # remote file will replace local
                        local_file_mock_4,  # local file will be copied to remote
-                       {local_dir_mock_5: [local_file_mock_6]}  # local dir
+                       local_dir_mock_5  # local dir
                        ]
         # utils mocks
         mock_convert_rfc3339_time_to_epoch.return_value = 100
-        mock_copy_local_file_to_remote.return_value = '4'
 
-        # other mocks
-        mock_time.return_value = 99999999.99
-        self.gdriveSync._copy_local_to_remote = Mock()
+        plan = SyncPlan()
 
         # db_handler mocks
         self.gdriveSync._db_handler = Mock(Db.DbHandler)
         self.gdriveSync._db_handler.get_local_modification_date.return_value = 80
         self.gdriveSync._db_handler.get_remote_modification_date.return_value = 80
+        self.gdriveSync._db_handler.get_remote_file_id.return_value = None
 
         def get_local_file_path_effect(arg):
             if arg in ['9', '11']:
@@ -146,93 +282,85 @@ class TestGdriveSync(TestCase):
         self.gdriveSync._db_handler.get_local_file_path.side_effect = get_local_file_path_effect
 
         # actual method call
-        self.gdriveSync._compare_and_sync_files(mocked_service,
-                                                remote_files,
-                                                'remote_parent_dir_id1',
-                                                local_files,
-                                                'local_parent_dir1')
-
-        # assertions
-        mock_convert_rfc3339_time_to_epoch.assert_has_calls([call('modifiedTime1'),
-                                                             call('modifiedTime2'),
-                                                             call('modifiedTime6'),
-                                                             call('modifiedTime3'),
+        self.gdriveSync._compare_files(plan,
+                                       remote_files,
+                                       'remote_parent_dir_id1',
+                                       local_files,
+                                       'local_parent_dir1')
+
+        # assertions, the files of every dir are compared in the order of their names
+        mock_convert_rfc3339_time_to_epoch.assert_has_calls([call('modifiedTime6'),
                                                              call('modifiedTime7'),
-                                                             call('modifiedTime8'), ])
-        mock_overwrite_remote_file_with_local.assert_called_once_with(mocked_service,
-                                                                      '1',
-                                                                      'path1')
-        mock_copy_remote_file_to_local.assert_has_calls([call(mocked_service,
-                                                              'path2',
-                                                              '2'),
-                                                         call(mocked_service,
-                                                              'local_parent_dir1/dir5/file6',
-                                                              '6'),
-                                                         call(mocked_service,
-                                                              'local_parent_dir1/file3',
-                                                              '3'),
-                                                         call(mocked_service,
-                                                              'local_parent_dir1/dir7/file8',
-                                                              '8')])
-        mock_create_local_dir.assert_called_once_with('local_parent_dir1/dir7')
-        mock_delete_file_on_remote.assert_has_calls([call('9'), call('11')])
-
-        self.gdriveSync._db_handler.insert_record.assert_has_calls([call('path1', '1', 101, 99999999),
-                                                                    call('path2', '2', 99999999, 100),
-                                                                    call('local_parent_dir1/dir5/file6', '6', 99999999,
-                                                                         100),
-                                                                    call('local_parent_dir1/file3', '3', 99999999, 100),
-                                                                    call('local_parent_dir1/dir7', '7', 99999999, 100),
-                                                                    call('local_parent_dir1/dir7/file8', '8', 99999999,
-                                                                         100)])
-        self.gdriveSync._db_handler.get_local_modification_date.assert_called_once_with('path1')
+                                                             call('modifiedTime8'),
+                                                             call('modifiedTime1'),
+                                                             call('modifiedTime2'),
+                                                             call('modifiedTime3')])
+        self.assertEqual([SyncAction(SyncAction.UPLOAD, 'local_parent_dir1/dir5/file4', remote_parent_id='5', size=40,
+                                     local_modification_date=96),
+                          SyncAction(SyncAction.DOWNLOAD, 'local_parent_dir1/dir5/file6', remote_id='6', size=60,
+                                     remote_modification_date=100),
+                          SyncAction(SyncAction.CREATE_LOCAL_DIR, 'local_parent_dir1/dir7', remote_id='7',
+                                     remote_modification_date=100),
+                          SyncAction(SyncAction.DOWNLOAD, 'local_parent_dir1/dir7/file8', remote_id='8',
+                                     remote_modification_date=100),
+                          SyncAction(SyncAction.DELETE_REMOTE, 'local_parent_dir1/dir9', remote_id='9'),
+                          SyncAction(SyncAction.OVERWRITE_REMOTE, 'local_parent_dir1/file1', remote_id='1', size=10,
+                                     local_modification_date=101.11),
+                          SyncAction(SyncAction.DELETE_REMOTE, 'local_parent_dir1/file11', remote_id='11'),
+                          SyncAction(SyncAction.DOWNLOAD, 'local_parent_dir1/file2', remote_id='2', size=20,
+                                     remote_modification_date=100),
+                          SyncAction(SyncAction.DOWNLOAD, 'local_parent_dir1/file3', remote_id='3', size=30,
+                                     remote_modification_date=100),
+                          SyncAction(SyncAction.UPLOAD, 'local_parent_dir1/file4',
+                                     remote_parent_id='remote_parent_dir_id1', size=40, local_modification_date=98)],
+                         plan.actions)
+        self.gdriveSync._db_handler.get_local_modification_date.assert_called_once_with('local_parent_dir1/file1')
         self.gdriveSync._db_handler.get_remote_modification_date.assert_called_once_with('2')
-        self.gdriveSync._db_handler.delete_record.assert_has_calls([call('local_parent_dir1/dir9'),
-                                                                    call('local_parent_dir1/file11')])
-        self.gdriveSync._copy_local_to_remote.assert_has_calls([call({'file4': local_file_mock_4},
-                                                                     'remote_parent_dir_id1',
-                                                                     mocked_service)])
 
-    @patch('gdrive_sync.utils.delete_file_from_local', autospec=True)
-    @patch('time.time', autospec=True)
-    @patch('gdrive_sync.utils.copy_local_file_to_remote', autospec=True)
-    @patch('gdrive_sync.utils.create_remote_dir', autospec=True)
-    def test_copy_local_to_remote(self,
-                                  mock_create_remote_dir,
-                                  mock_copy_local_file_to_remote,
-                                  mock_time,
-                                  mock_delete_file_from_local):
-        mocked_service = Mock()
+    @patch('gdrive_sync.utils.compute_md5', autospec=True)
+    @patch('gdrive_sync.utils.convert_rfc3339_time_to_epoch', autospec=True)
+    def test_compare_files_in_sync(self, mock_convert_rfc3339_time_to_epoch, mock_compute_md5):
+        remote_files = iter([{'id': '1', 'name': 'file1', 'modifiedTime': 'modifiedTime1', 'mimeType': 'file',
+                              'size': '10', 'md5Checksum': 'md5_1'},
+                             {'id': '2', 'name': 'file2', 'modifiedTime': 'modifiedTime2', 'mimeType': 'file',
+                              'size': '20', 'md5Checksum': 'md5_2'},
+                             {'id': '3', 'name': 'file3', 'modifiedTime': 'modifiedTime3', 'mimeType': 'file',
+                              'size': '30', 'md5Checksum': 'md5_3'}])
+        local_files = []
+        for i in range(1, 4):
+            local_files.append(_create_local_entry('file{}'.format(i), 'path{}'.format(i), mtime=100.5 + i,
+                                                   size=10 * i, device=1, inode=i, mtime_ns=100500000000 + i))
+        mock_convert_rfc3339_time_to_epoch.return_value = 100
+        mock_compute_md5.side_effect = ['md5_1', 'md5_3_modified']
+        plan = SyncPlan()
 
-        local_file_mock_1 = Mock()
-        local_file_mock_1.name = 'file1'
-        local_file_mock_1.path = 'path1'
-        local_file_mock_1.stat.return_value.st_mtime = 98
-        local_dir_mock_2 = Mock()
-        local_dir_mock_2.name = 'dir2'
-        local_dir_mock_2.path = 'path2'
-        local_dir_mock_2.stat.return_value.st_mtime = 97
-        local_file_mock_3 = Mock()
-        local_file_mock_3.name = 'file3'
-        local_file_mock_3.path = 'path3'
-        local_file_mock_3.stat.return_value.st_mtime = 96
-        local_file_mock_4 = Mock()
-        local_file_mock_4.name = 'file4'
-        local_file_mock_4.path = 'path4'
-        local_dir_mock_5 = Mock()
-        local_dir_mock_5.name = 'dir5'
-        local_dir_mock_5.path = 'path5'
-        local_file_mock_6 = Mock()
-        local_file_mock_6.name = 'file6'
-        local_file_mock_6.path = 'path6'
-        local_files = {'dir2': {local_dir_mock_2: [local_file_mock_3]},
-                       'file1': local_file_mock_1,
-                       'dir5': {local_dir_mock_5: [local_file_mock_6]},
-                       'file4': local_file_mock_4}
-
-        mock_copy_local_file_to_remote.return_value = '1'
-        mock_create_remote_dir.return_value = '2'
-        mock_time.return_value = 99999999.99
+        self.gdriveSync._plan_local_files = Mock()
+        self.gdriveSync._db_handler = Mock(Db.DbHandler)
+        # The hash of file2 is cached, its record is up to date
+        self.gdriveSync._db_handler.get_local_hash.side_effect = lambda *key: 'md5_2' if key[1] == 2 else None
+        self.gdriveSync._db_handler.get_local_modification_date.side_effect = lambda path: 102.5
+        self.gdriveSync._db_handler.get_remote_modification_date.side_effect = lambda remote_id: 100
+
+        self.gdriveSync._compare_files(plan, remote_files, 'remote_parent_dir_id1', local_files, 'local_parent_dir1')
+
+        self.assertEqual([SyncAction(SyncAction.RECORD, 'path1', remote_id='1', local_modification_date=101.5,
+                                     remote_modification_date=100),
+                          SyncAction(SyncAction.OVERWRITE_REMOTE, 'path3', remote_id='3', size=30,
+                                     local_modification_date=103.5)],
+                         plan.actions)
+        mock_compute_md5.assert_has_calls([call('path1'), call('path3')])
+        self.gdriveSync._db_handler.set_local_hash.assert_has_calls([call(1, 1, 10, 100500000001, 'md5_1'),
+                                                                     call(1, 3, 30, 100500000003, 'md5_3_modified')])
+
+    def test_compare_local_only_files(self):
+        local_file_mock_1 = _create_local_entry('file1', 'path1', mtime=98, size=10)
+        local_file_mock_3 = _create_local_entry('file3', 'path3', mtime=96, size=30)
+        local_dir_mock_2 = _create_local_entry('dir2', 'path2', mtime=97, children=iter([local_file_mock_3]))
+        local_file_mock_4 = _create_local_entry('file4', 'path4')
+        local_file_mock_6 = _create_local_entry('file6', 'path6')
+        local_dir_mock_5 = _create_local_entry('dir5', 'path5', children=iter([local_file_mock_6]))
+        local_files = [local_file_mock_1, local_dir_mock_2, local_file_mock_4, local_dir_mock_5]
+        plan = SyncPlan()
 
         self.gdriveSync._db_handler = Mock(Db.DbHandler)
 
@@ -244,28 +372,121 @@ class TestGdriveSync(TestCase):
 
         self.gdriveSync._db_handler.get_remote_file_id.side_effect = get_remote_file_id_side_effect
 
-        self.gdriveSync._copy_local_to_remote(local_files, 'remote_parent_dir_id', mocked_service)
-
-        mock_create_remote_dir.assert_called_once_with('dir2', 'remote_parent_dir_id')
-        mock_copy_local_file_to_remote.assert_has_calls([call('path3',
-                                                              '2',
-                                                              mocked_service),
-                                                         call('path1',
-                                                              'remote_parent_dir_id',
-                                                              mocked_service)],
-                                                        any_order=True)
-        self.gdriveSync._db_handler.insert_record.assert_has_calls([call('path1', '1', 98, 99999999),
-                                                                    call('path2', '2', 97, 99999999),
-                                                                    call('path3', '1', 96, 99999999)],
-                                                                   any_order=True)
-        mock_delete_file_from_local.assert_has_calls([call('path5'),
-                                                      call('path4')],
-                                                     any_order=True)
-        self.gdriveSync._db_handler.delete_record.assert_has_calls([call('path5'),
-                                                                    call('path4')],
-                                                                   any_order=True)
-
-    @patch('gdrive_sync.utils.get_service', autospec=True)
+        self.gdriveSync._compare_files(plan, iter([]), 'remote_parent_dir_id', local_files, 'local_parent_dir')
+
+        self.assertEqual([SyncAction(SyncAction.CREATE_REMOTE_DIR, 'path2', remote_parent_id='remote_parent_dir_id',
+                                     local_modification_date=97),
+                          SyncAction(SyncAction.UPLOAD, 'path3', size=30, local_modification_date=96),
+                          SyncAction(SyncAction.DELETE_LOCAL, 'path5'),
+                          SyncAction(SyncAction.UPLOAD, 'path1', remote_parent_id='remote_parent_dir_id', size=10,
+                                     local_modification_date=98),
+                          SyncAction(SyncAction.DELETE_LOCAL, 'path4')],
+                         plan.actions)
+
+    def _mock_batch_requests(self, mocked_service):
+        """
+        Makes the batch requests of the mocked service execute their requests one by one.
+        Returns:
+            A list of the lists of the requests of each executed batch request
+        """
+        batch_requests = []
+
+        def new_batch_http_request(callback):
+            batch_request = Mock()
+            requests = []
+            batch_request.add.side_effect = lambda request, request_id: requests.append((request, request_id))
+
+            def execute():
+                batch_requests.append([request for request, _ in requests])
+                for request, request_id in requests:
+                    try:
+                        callback(request_id, request.execute(), None)
+                    except Exception as exception:
+                        callback(request_id, None, exception)
+            batch_request.execute.side_effect = execute
+            return batch_request
+        mocked_service.new_batch_http_request.side_effect = new_batch_http_request
+        return batch_requests
+
+    @patch('gdrive_sync.utils.delete_file_from_local', autospec=True)
+    @patch('gdrive_sync.utils.create_local_dir', autospec=True)
+    @patch('time.time', autospec=True)
+    @patch('gdrive_sync.utils.copy_local_file_to_remote', autospec=True)
+    @patch('gdrive_sync.utils.overwrite_remote_file_with_local', autospec=True)
+    @patch('gdrive_sync.utils.copy_remote_file_to_local', autospec=True)
+    def test_execute_plan(self,
+                          mock_copy_remote_file_to_local,
+                          mock_overwrite_remote_file_with_local,
+                          mock_copy_local_file_to_remote,
+                          mock_time,
+                          mock_create_local_dir,
+                          mock_delete_file_from_local):
+        mocked_service = Mock()
+        batch_requests = self._mock_batch_requests(mocked_service)
+        created_dirs = {'dir12': {'id': '12'}, 'dir13': {'id': '13'}}
+
+        def create(body, fields):
+            request = Mock()
+            if body['name'] in created_dirs:
+                request.execute.return_value = created_dirs[body['name']]
+            else:
+                request.execute.side_effect = Exception('create failed')
+            return request
+        mocked_service.files.return_value.create.side_effect = create
+        mock_copy_local_file_to_remote.return_value = '4'
+        mock_time.return_value = 99999999.99
+        self.gdriveSync._db_handler = Mock(Db.DbHandler)
+        self.gdriveSync._db_handler.get_remote_file_id.return_value = None
+        self.gdriveSync._transfer_engine = TransferEngine(0, lambda: mocked_service,
+                                                          upload_sessions=self.gdriveSync._db_handler)
+        plan = SyncPlan([SyncAction(SyncAction.OVERWRITE_REMOTE, 'path1', remote_id='1', local_modification_date=101),
+                         SyncAction(SyncAction.DOWNLOAD, 'dir/dir7/file8', remote_id='8',
+                                    remote_modification_date=100),
+                         SyncAction(SyncAction.CREATE_LOCAL_DIR, 'dir/dir7', remote_id='7',
+                                    remote_modification_date=100),
+                         SyncAction(SyncAction.DELETE_REMOTE, 'dir/dir9', remote_id='9'),
+                         SyncAction(SyncAction.UPLOAD, 'dir/dir12/file4', local_modification_date=98),
+                         SyncAction(SyncAction.CREATE_REMOTE_DIR, 'dir/dir12', remote_parent_id='remote_dir_id',
+                                    local_modification_date=97),
+                         SyncAction(SyncAction.CREATE_REMOTE_DIR, 'dir/dir14', remote_parent_id='remote_dir_id',
+                                    local_modification_date=96),
+                         SyncAction(SyncAction.CREATE_REMOTE_DIR, 'dir/dir12/dir13', local_modification_date=95),
+                         SyncAction(SyncAction.UPLOAD, 'dir/dir14/file15', local_modification_date=94),
+                         SyncAction(SyncAction.DELETE_LOCAL, 'path5'),
+                         SyncAction(SyncAction.RECORD, 'dir', remote_id='remote_dir_id',
+                                    local_modification_date=1001, remote_modification_date=101)])
+
+        self.gdriveSync._execute_plan(mocked_service, plan)
+
+        mock_create_local_dir.assert_called_once_with('dir/dir7')
+        mocked_service.files.return_value.create.assert_has_calls([
+            call(body={'parents': ['remote_dir_id'], 'name': 'dir12', 'mimeType': 'application/vnd.google-apps.folder'},
+                 fields='id'),
+            call(body={'parents': ['remote_dir_id'], 'name': 'dir14', 'mimeType': 'application/vnd.google-apps.folder'},
+                 fields='id'),
+            call(body={'parents': ['12'], 'name': 'dir13', 'mimeType': 'application/vnd.google-apps.folder'},
+                 fields='id')])
+        mocked_service.files.return_value.delete.assert_called_once_with(fileId='9')
+        # dir13 waits for the batch that creates its parent dir, and is sent along with the delete
+        self.assertEqual([2, 2], [len(requests) for requests in batch_requests])
+        # The upload into dir14 is skipped, as dir14 could not be created
+        mock_copy_local_file_to_remote.assert_called_once_with('dir/dir12/file4', '12', mocked_service,
+                                                               self.gdriveSync._db_handler)
+        mock_overwrite_remote_file_with_local.assert_called_once_with(mocked_service, '1', 'path1',
+                                                                      self.gdriveSync._db_handler)
+        mock_copy_remote_file_to_local.assert_called_once_with(mocked_service, 'dir/dir7/file8', '8', 0)
+        mock_delete_file_from_local.assert_called_once_with('path5')
+        self.gdriveSync._db_handler.insert_record.assert_has_calls([call('dir', 'remote_dir_id', 1001, 101),
+                                                                    call('dir/dir7', '7', 99999999, 100),
+                                                                    call('dir/dir12', '12', 97, 99999999),
+                                                                    call('dir/dir12/file4', '4', 98, 99999999),
+                                                                    call('path1', '1', 101, 99999999),
+                                                                    call('dir/dir7/file8', '8', 99999999, 100),
+                                                                    call('dir/dir12/dir13', '13', 95, 99999999)])
+        self.assertEqual(7, self.gdriveSync._db_handler.insert_record.call_count)
+        self.gdriveSync._db_handler.delete_record.assert_has_calls([call('path5'), call('dir/dir9')])
+
+    @patch('gdrive_sync.utils.get_pooled_service', autospec=True)
     def test_sync_onetime(self, mocked_get_service):
         mocked_get_service.return_value = 'service'
         self.gdriveSync._process_dir_pairs = Mock()
@@ -273,17 +494,18 @@ class TestGdriveSync(TestCase):
         self.gdriveSync.sync_onetime('synced_dirs_dict')
 
         mocked_get_service.assert_called_once_with()
-        self.gdriveSync._process_dir_pairs.assert_called_once_with('service', 'synced_dirs_dict')
+        self.gdriveSync._process_dir_pairs.assert_called_once_with('service', 'synced_dirs_dict', False)
+        self.assertIsNone(self.gdriveSync._remote_tree_walker)
+        self.assertIsNone(self.gdriveSync._transfer_engine)
 
     @patch('watchdog.observers.Observer', autospec=True)
     @patch('gdrive_sync.LocalFSEventHandler.LocalFSEventHandler', autospec=True)
     def test_watch_local_dir(self, mock_LocalFSEventHandler, mock_observer):
-        mock_LocalFSEventHandler.return_value = 'event_hanlder'
-
         self.assertEqual(mock_observer.return_value,
                          self.gdriveSync._watch_local_dir('dir_to_watch'))
 
-        mock_LocalFSEventHandler.assert_called_once_with(self.gdriveSync._db_handler)
+        mock_LocalFSEventHandler.assert_called_once_with(self.gdriveSync._db_handler, on_overflow=ANY)
+        mock_LocalFSEventHandler.return_value.start.assert_called_once_with()
         mock_observer.assert_called_once_with()
         mock_observer.return_value.schedule('event_handler',
                                             'dir_to_watch',
@@ -291,6 +513,36 @@ class TestGdriveSync(TestCase):
 
         mock_observer.return_value.start.assert_called_once_with()
 
+    @patch('gdrive_sync.utils.delete_file_on_remote', autospec=True)
+    @patch('gdrive_sync.utils.get_user_settings', autospec=True)
+    def test_resync_dir_pauses_event_handlers(self, mock_get_user_settings, mock_delete_file_on_remote):
+        mock_get_user_settings.return_value = {'synced_dirs': {'/w': '/remote'}}
+        with tempfile.TemporaryDirectory() as db_dir:
+            db_handler = self.gdriveSync._db_handler = Db.DbHandler(os.path.join(db_dir, 'test_db'))
+            db_handler.insert_record('/w/f', 'remote_id', 101, 1001)
+            event_handler = LocalFSEventHandler(db_handler)
+            event_handler.start()
+            self.gdriveSync._local_dir_event_handler_dict['/w'] = event_handler
+
+            def sync_onetime(synced_dirs_dict):
+                with db_handler.batch():
+                    # The read writes the batched record into the open transaction
+                    db_handler.insert_record('/w/g', 'remote_id_g', 102, 1002)
+                    db_handler.get_local_hash(1, 2, 3, 4)
+                    event_handler.dispatch(FileDeletedEvent('/w/f'))
+                    time.sleep(0.2)
+                    mock_delete_file_on_remote.assert_not_called()
+            self.gdriveSync.sync_onetime = sync_onetime
+            try:
+                self.gdriveSync._resync_dir('/w')
+                event_handler.stop()
+
+                mock_delete_file_on_remote.assert_called_once_with('remote_id')
+                self.assertIsNone(db_handler.get_remote_file_id('/w/f'))
+                self.assertEqual('remote_id_g', db_handler.get_remote_file_id('/w/g'))
+            finally:
+                db_handler.close()
+
     @skip("This needs to run manually")
     def test_watch_local_dir_manual(self):
         logger.info('Starting _process_dir_pairs')
@@ -1,7 +1,11 @@
 import unittest
 import os
+import tempfile
 from unittest.mock import Mock, patch, call
 
+from watchdog.events import DirCreatedEvent, DirMovedEvent, FileCreatedEvent, FileModifiedEvent, FileMovedEvent
+
+from gdrive_sync.EchoRegistry import EchoRegistry
 from gdrive_sync.LocalFSEventHandler import LocalFSEventHandler
 
 
@@ -49,7 +53,8 @@ class TestLocalFSEventHandler(unittest.TestCase):
                                             call('path_to_dir')])
         self.mock_db_handler.get_remote_file_id.assert_has_calls([call('path_to_parent_dir'),
                                                                   call('path_to_parent_dir')])
-        mock_copy_local_file_to_remote.assert_called_once_with('path_to_file', 'remote_parent_dir_id')
+        mock_copy_local_file_to_remote.assert_called_once_with('path_to_file', 'remote_parent_dir_id',
+                                                               upload_sessions=self.mock_db_handler)
         mock_create_remote_dir.assert_called_once_with('dir_name', 'remote_parent_dir_id')
         self.mock_db_handler.insert_record.assert_has_calls([call('path_to_file',
                                                                   'remote_file_id',
@@ -76,7 +81,8 @@ class TestLocalFSEventHandler(unittest.TestCase):
 
         self.mock_db_handler.get_remote_file_id.assert_called_once_with('path_to_file')
         mock_update_remote_file.assert_called_once_with('remote_file_id',
-                                                        'path_to_file')
+                                                        'path_to_file',
+                                                        upload_sessions=self.mock_db_handler)
         self.mock_db_handler.update_record.assert_called_once_with('path_to_file',
                                                                    'remote_file_id',
                                                                    1001,
@@ -94,54 +100,158 @@ class TestLocalFSEventHandler(unittest.TestCase):
         mock_delete_file_on_remote.assert_called_once_with('remote_file_id')
         self.mock_db_handler.delete_record.assert_called_once_with('path_to_file')
 
-    @patch('gdrive_sync.utils.create_remote_dir', autospec=True)
-    @patch('os.path.basename', autospec=True)
-    @patch('time.time', autospec=True)
-    @patch('os.path.dirname', autospec=True)
-    @patch('gdrive_sync.utils.copy_local_file_to_remote', autospec=True)
-    @patch('gdrive_sync.utils.delete_file_on_remote', autospec=True)
+    @patch('gdrive_sync.utils.convert_rfc3339_time_to_epoch', autospec=True)
+    @patch('gdrive_sync.utils.move_remote_file', autospec=True)
     def test_on_moved(self,
-                      mock_delete_file_on_remote,
-                      mock_copy_local_file_to_remote,
-                      mock_path_dirname,
-                      mock_time,
-                      mock_path_basename,
-                      mock_create_remote_dir):
+                      mock_move_remote_file,
+                      mock_convert_rfc3339_time_to_epoch):
+        mock_event = Mock()
+        mock_event.src_path = '/dir/path_to_dir'
+        mock_event.dest_path = '/new_dir/new_path_to_dir'
+        mock_event.is_directory = True
+        remote_ids = {'/dir/path_to_dir': 'remote_dir_id',
+                      '/dir': 'remote_parent_dir_id_old',
+                      '/new_dir': 'remote_parent_dir_id_new'}
+        self.mock_db_handler.get_remote_file_id.side_effect = remote_ids.get
+        self.mock_db_handler.get_local_modification_date.return_value = 1001
+        mock_move_remote_file.return_value = {'id': 'remote_dir_id', 'modifiedTime': 'modifiedTime'}
+        mock_convert_rfc3339_time_to_epoch.return_value = 1002
+
+        self.localFSEventHandler.on_moved(mock_event)
 
+        mock_move_remote_file.assert_called_once_with('remote_dir_id',
+                                                      'new_path_to_dir',
+                                                      'remote_parent_dir_id_new',
+                                                      'remote_parent_dir_id_old')
+        self.mock_db_handler.move_records.assert_called_once_with('/dir/path_to_dir', '/new_dir/new_path_to_dir')
+        self.mock_db_handler.update_record.assert_called_once_with('/new_dir/new_path_to_dir',
+                                                                   'remote_dir_id',
+                                                                   1001,
+                                                                   1002)
+
+    @patch('time.time', autospec=True)
+    @patch('gdrive_sync.utils.move_remote_file', autospec=True)
+    @patch('gdrive_sync.utils.copy_local_file_to_remote', autospec=True)
+    def test_on_moved_not_synced(self,
+                                 mock_copy_local_file_to_remote,
+                                 mock_move_remote_file,
+                                 mock_time):
         mock_event = Mock()
-        mock_event.src_path = 'path_to_file'
-        mock_event.dest_path = 'new_path_to_file'
+        mock_event.src_path = '/dir/path_to_file'
+        mock_event.dest_path = '/dir/new_path_to_file'
         mock_event.is_directory = False
-        self.mock_db_handler.get_remote_file_id.side_effect = ['remote_file_id_old', 
-                                                               'remote_parent_dir_id',
-                                                               'remote_file_id_old', 
-                                                               'remote_parent_dir_id']
-        mock_path_dirname.return_value = 'path_to_parent_dir'
-        mock_time.return_value = 1001
+        self.mock_db_handler.get_remote_file_id.side_effect = {'/dir': 'remote_parent_dir_id'}.get
         mock_copy_local_file_to_remote.return_value = 'remote_file_id_new'
+        mock_time.return_value = 1001
 
-        self.localFSEventHandler.on_moved(mock_event)
-        
-        mock_event.is_directory = True
-        mock_event.src_path = 'path_to_dir'
-        mock_event.dest_path = 'new_path_to_dir'
-        mock_path_basename.return_value = 'new_dir_name'
-        mock_create_remote_dir.return_value = 'remote_dir_id_new'
-        
         self.localFSEventHandler.on_moved(mock_event)
 
-        mock_delete_file_on_remote.assert_has_calls([call('remote_file_id_old'), 
-                                                     call('remote_file_id_old')])
-        self.mock_db_handler.get_remote_file_id.assert_has_calls([call('path_to_file'),
-                                                                  call('path_to_parent_dir'),
-                                                                  call('path_to_dir'),
-                                                                  call('path_to_parent_dir')])
-        mock_copy_local_file_to_remote.assert_called_once_with('new_path_to_file', 'remote_parent_dir_id')
-        self.mock_db_handler.insert_record.assert_has_calls([call('new_path_to_file', 
-                                                                  'remote_file_id_new', 
-                                                                  1001, 
-                                                                  1001),
-                                                             call('new_path_to_dir', 
-                                                                  'remote_dir_id_new', 
-                                                                  1001, 
-                                                                  1001)])
+        mock_move_remote_file.assert_not_called()
+        mock_copy_local_file_to_remote.assert_called_once_with('/dir/new_path_to_file', 'remote_parent_dir_id',
+                                                               upload_sessions=self.mock_db_handler)
+        self.mock_db_handler.insert_record.assert_called_once_with('/dir/new_path_to_file',
+                                                                   'remote_file_id_new',
+                                                                   1001,
+                                                                   1001)
+
+    @patch('gdrive_sync.utils.convert_rfc3339_time_to_epoch', autospec=True)
+    @patch('gdrive_sync.utils.move_remote_file', autospec=True)
+    @patch('gdrive_sync.utils.copy_local_file_to_remote', autospec=True)
+    def test_on_moved_dir_with_synthetic_events(self,
+                                                mock_copy_local_file_to_remote,
+                                                mock_move_remote_file,
+                                                mock_convert_rfc3339_time_to_epoch):
+        remote_ids = {'/w': 'remote_parent_dir_id', '/w/a': 'remote_dir_id', '/w/a/f': 'remote_file_id'}
+
+        def move_records(src_path, dest_path):
+            for local_path in [each for each in remote_ids if each == src_path or each.startswith(src_path + '/')]:
+                remote_ids[dest_path + local_path[len(src_path):]] = remote_ids.pop(local_path)
+        self.mock_db_handler.get_remote_file_id.side_effect = lambda local_path: remote_ids.get(local_path)
+        self.mock_db_handler.move_records.side_effect = move_records
+        mock_move_remote_file.return_value = {'id': 'remote_dir_id', 'modifiedTime': 'modifiedTime'}
+        mock_convert_rfc3339_time_to_epoch.return_value = 1002
+
+        self.localFSEventHandler.on_moved(DirMovedEvent('/w/a', '/w/b'))
+        self.localFSEventHandler.on_moved(FileMovedEvent('/w/a/f', '/w/b/f', is_synthetic=True))
+
+        mock_move_remote_file.assert_called_once_with('remote_dir_id', 'b', 'remote_parent_dir_id',
+                                                      'remote_parent_dir_id')
+        mock_copy_local_file_to_remote.assert_not_called()
+        self.mock_db_handler.move_records.assert_called_once_with('/w/a', '/w/b')
+        self.assertEqual('remote_file_id', remote_ids['/w/b/f'])
+
+    @patch('gdrive_sync.utils.convert_rfc3339_time_to_epoch', autospec=True)
+    @patch('gdrive_sync.utils.move_remote_file', autospec=True)
+    @patch('gdrive_sync.utils.create_remote_dir', autospec=True)
+    @patch('gdrive_sync.utils.copy_local_file_to_remote', autospec=True)
+    def test_dispatch_created_file_in_moved_dir(self,
+                                                mock_copy_local_file_to_remote,
+                                                mock_create_remote_dir,
+                                                mock_move_remote_file,
+                                                mock_convert_rfc3339_time_to_epoch):
+        with tempfile.TemporaryDirectory() as local_dir:
+            remote_ids = {local_dir: 'remote_parent_dir_id'}
+
+            def move_records(src_path, dest_path):
+                for local_path in [each for each in remote_ids
+                                   if each == src_path or each.startswith(src_path + '/')]:
+                    remote_ids[dest_path + local_path[len(src_path):]] = remote_ids.pop(local_path)
+            self.mock_db_handler.get_remote_file_id.side_effect = lambda local_path: remote_ids.get(local_path)
+            self.mock_db_handler.insert_record.side_effect = \
+                lambda local_path, remote_id, *dates: remote_ids.__setitem__(local_path, remote_id)
+            self.mock_db_handler.move_records.side_effect = move_records
+            mock_create_remote_dir.return_value = 'remote_dir_id'
+            mock_copy_local_file_to_remote.return_value = 'remote_file_id'
+            mock_move_remote_file.return_value = {'id': 'remote_dir_id', 'modifiedTime': 'modifiedTime'}
+            mock_convert_rfc3339_time_to_epoch.return_value = 1002
+            dir_path = os.path.join(local_dir, 'a')
+            os.mkdir(dir_path)
+            open(os.path.join(dir_path, 'f'), 'wb').close()
+
+            self.localFSEventHandler.dispatch(DirCreatedEvent(dir_path))
+            self.localFSEventHandler.dispatch(FileCreatedEvent(os.path.join(dir_path, 'f')))
+            os.rename(dir_path, dir_path + '_moved')
+            self.localFSEventHandler.dispatch(DirMovedEvent(dir_path, dir_path + '_moved'))
+            self.localFSEventHandler.dispatch(FileMovedEvent(os.path.join(dir_path, 'f'),
+                                                             os.path.join(dir_path + '_moved', 'f'),
+                                                             is_synthetic=True))
+            self.localFSEventHandler.stop()
+
+            # The file is uploaded once, at its destination
+            mock_copy_local_file_to_remote.assert_called_once_with(os.path.join(dir_path + '_moved', 'f'),
+                                                                   'remote_dir_id',
+                                                                   upload_sessions=self.mock_db_handler)
+            self.assertEqual('remote_file_id', remote_ids[os.path.join(dir_path + '_moved', 'f')])
+
+    def test_dispatch_is_debounced(self):
+        self.localFSEventHandler.on_created = Mock()
+        self.localFSEventHandler.on_modified = Mock()
+        with tempfile.NamedTemporaryFile() as local_file:
+            self.localFSEventHandler.dispatch(FileCreatedEvent(local_file.name))
+            self.localFSEventHandler.dispatch(FileModifiedEvent(local_file.name))
+            self.localFSEventHandler.on_created.assert_not_called()
+
+            # Stopping processes the held back events
+            self.localFSEventHandler.stop()
+
+        self.localFSEventHandler.on_created.assert_called_once_with(FileCreatedEvent(local_file.name))
+        self.localFSEventHandler.on_modified.assert_not_called()
+
+    def test_dispatch_drops_echoes(self):
+        echo_registry = EchoRegistry(60)
+        local_fs_event_handler = LocalFSEventHandler(self.mock_db_handler, echo_registry=echo_registry)
+        local_fs_event_handler.on_created = Mock()
+        local_fs_event_handler.start()
+        with tempfile.TemporaryDirectory() as local_dir:
+            downloaded_file_path = os.path.join(local_dir, 'downloaded')
+            with open(downloaded_file_path, 'wb') as downloaded_file:
+                downloaded_file.write(b'content')
+            echo_registry.expect_file(downloaded_file_path, os.stat(downloaded_file_path))
+            created_file_path = os.path.join(local_dir, 'created')
+            open(created_file_path, 'wb').close()
+
+            local_fs_event_handler.dispatch(FileCreatedEvent(downloaded_file_path))
+            local_fs_event_handler.dispatch(FileCreatedEvent(created_file_path))
+            local_fs_event_handler.stop()
+
+        local_fs_event_handler.on_created.assert_called_once_with(FileCreatedEvent(created_file_path))
@@ -0,0 +1,109 @@
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from gdrive_sync import LocalScanner
+
+
+class TestLocalScanner(TestCase):
+
+    def setUp(self):
+        TestCase.setUp(self)
+        self.local_dir = tempfile.TemporaryDirectory()
+        os.makedirs(os.path.join(self.local_dir.name, 'dir1', 'dir2'))
+        self._create_file('file1', b'content')
+        self._create_file(os.path.join('dir1', 'file2'), b'more content')
+        self._create_file(os.path.join('dir1', 'dir2', 'file3'), b'')
+
+    def tearDown(self):
+        TestCase.tearDown(self)
+        self.local_dir.cleanup()
+
+    def _create_file(self, relative_path, content):
+        with open(os.path.join(self.local_dir.name, relative_path), 'wb') as _file:
+            _file.write(content)
+
+    def _flatten(self, local_entries):
+        result = {}
+        for local_entry in local_entries:
+            result[local_entry.relative_path] = local_entry
+            if local_entry.is_dir:
+                result.update(self._flatten(local_entry.children))
+        return result
+
+    def test_scan_local_dir(self):
+        local_entries = self._flatten(LocalScanner.scan_local_dir(self.local_dir.name, follow_symlinks=False))
+
+        self.assertEqual({'file1', 'dir1', os.path.join('dir1', 'file2'), os.path.join('dir1', 'dir2'),
+                          os.path.join('dir1', 'dir2', 'file3')},
+                         set(local_entries))
+        file2 = local_entries[os.path.join('dir1', 'file2')]
+        file2_stat = os.stat(os.path.join(self.local_dir.name, 'dir1', 'file2'))
+        self.assertEqual('file2', file2.name)
+        self.assertEqual(os.path.join(self.local_dir.name, 'dir1', 'file2'), file2.path)
+        self.assertEqual(12, file2.size)
+        self.assertEqual(file2_stat.st_mtime, file2.mtime)
+        self.assertEqual(file2_stat.st_mtime_ns, file2.mtime_ns)
+        self.assertEqual((file2_stat.st_dev, file2_stat.st_ino), (file2.device, file2.inode))
+        self.assertFalse(file2.is_dir)
+        self.assertIsNone(file2.children)
+        self.assertTrue(local_entries['dir1'].is_dir)
+
+    def test_single_stat(self):
+        stat_count = [0]
+        original_scandir = os.scandir
+
+        class _CountingDirEntry:
+
+            def __init__(self, dir_entry):
+                self._dir_entry = dir_entry
+
+            def __getattr__(self, name):
+                return getattr(self._dir_entry, name)
+
+            def stat(self, **kwargs):
+                stat_count[0] += 1
+                return self._dir_entry.stat(**kwargs)
+
+        class _CountingScandir:
+
+            def __init__(self, dir_path):
+                self._dir_entries = original_scandir(dir_path)
+
+            def __enter__(self):
+                return (_CountingDirEntry(each) for each in self._dir_entries)
+
+            def __exit__(self, *exc_info):
+                self._dir_entries.close()
+
+        with patch('os.scandir', _CountingScandir):
+            local_entries = self._flatten(LocalScanner.scan_local_dir(self.local_dir.name, follow_symlinks=False))
+
+        self.assertEqual(5, len(local_entries))
+        self.assertEqual(5, stat_count[0])
+
+    def test_symlinks_are_skipped(self):
+        os.symlink(os.path.join(self.local_dir.name, 'file1'), os.path.join(self.local_dir.name, 'link1'))
+        os.symlink(os.path.join(self.local_dir.name, 'dir1'), os.path.join(self.local_dir.name, 'link2'))
+
+        local_entries = self._flatten(LocalScanner.scan_local_dir(self.local_dir.name, follow_symlinks=False))
+
+        self.assertNotIn('link1', local_entries)
+        self.assertNotIn('link2', local_entries)
+
+    def test_symlinks_are_followed(self):
+        os.symlink(os.path.join(self.local_dir.name, 'file1'), os.path.join(self.local_dir.name, 'link1'))
+        os.symlink(os.path.join(self.local_dir.name, 'dir1', 'dir2'), os.path.join(self.local_dir.name, 'link2'))
+        # A link to an ancestor dir and a broken link
+        os.symlink(self.local_dir.name, os.path.join(self.local_dir.name, 'dir1', 'dir2', 'loop'))
+        os.symlink(os.path.join(self.local_dir.name, 'missing'), os.path.join(self.local_dir.name, 'broken'))
+
+        local_entries = self._flatten(LocalScanner.scan_local_dir(self.local_dir.name, follow_symlinks=True))
+
+        self.assertEqual(7, local_entries['link1'].size)
+        self.assertIn(os.path.join('link2', 'file3'), local_entries)
+        self.assertNotIn(os.path.join('dir1', 'dir2', 'loop'), local_entries)
+        self.assertNotIn('broken', local_entries)
+        # The loop is skipped under the link to its dir too
+        self.assertNotIn(os.path.join('link2', 'loop'), local_entries)
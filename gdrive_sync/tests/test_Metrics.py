@@ -0,0 +1,113 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+from urllib import error, request
+
+from gdrive_sync.Metrics import MetricsExporter, MetricsRegistry
+
+
+class TestMetricsRegistry(TestCase):
+
+    def setUp(self):
+        TestCase.setUp(self)
+        self.registry = MetricsRegistry()
+
+    def test_counter(self):
+        counter = self.registry.counter('requests_total', 'Requests.', ('method', 'status'))
+
+        counter.inc(method='files.list', status=200)
+        counter.inc(2, method='files.list', status=200)
+        counter.inc(method='files.get', status=404)
+
+        self.assertEqual(3, counter.get(method='files.list', status=200))
+        self.assertEqual(0, counter.get(method='files.list', status=500))
+        self.assertIs(counter, self.registry.counter('requests_total', 'Requests.', ('method', 'status')))
+        with self.assertRaises(ValueError):
+            counter.inc(-1, method='files.list', status=200)
+        with self.assertRaises(ValueError):
+            counter.inc(method='files.list')
+        with self.assertRaises(ValueError):
+            self.registry.gauge('requests_total', 'Requests.')
+
+    def test_gauge(self):
+        gauge = self.registry.gauge('depth', 'Depth.')
+        gauge.inc(3)
+        gauge.dec()
+        self.assertEqual(2, gauge.get())
+
+        gauge.set_function(lambda: 7)
+
+        self.assertEqual([('depth', {}, 7)], gauge.get_samples())
+
+    def test_histogram(self):
+        histogram = self.registry.histogram('latency_seconds', 'Latency.', ('operation',), buckets=(0.1, 1))
+
+        for value in (0.05, 0.1, 0.5, 2):
+            histogram.observe(value, operation='read')
+
+        self.assertEqual((4, 2.65), histogram.get(operation='read'))
+        self.assertEqual([('latency_seconds_bucket', {'operation': 'read', 'le': '0.1'}, 2),
+                          ('latency_seconds_bucket', {'operation': 'read', 'le': '1'}, 3),
+                          ('latency_seconds_bucket', {'operation': 'read', 'le': '+Inf'}, 4),
+                          ('latency_seconds_sum', {'operation': 'read'}, 2.65),
+                          ('latency_seconds_count', {'operation': 'read'}, 4)],
+                         histogram.get_samples())
+
+    def test_to_prometheus(self):
+        self.registry.counter('requests_total', 'Requests,\nby status.', ('status',)).inc(status='a"b')
+        self.registry.histogram('latency_seconds', 'Latency.', buckets=(1,)).observe(0.5)
+
+        self.assertEqual('# HELP latency_seconds Latency.\n'
+                         '# TYPE latency_seconds histogram\n'
+                         'latency_seconds_bucket{le="1"} 1\n'
+                         'latency_seconds_bucket{le="+Inf"} 1\n'
+                         'latency_seconds_sum 0.5\n'
+                         'latency_seconds_count 1\n'
+                         '# HELP requests_total Requests,\\nby status.\n'
+                         '# TYPE requests_total counter\n'
+                         'requests_total{status="a\\"b"} 1\n',
+                         self.registry.to_prometheus())
+
+    def test_write_snapshot(self):
+        self.registry.counter('requests_total', 'Requests.', ('status',)).inc(status=200)
+
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            snapshot_file_path = os.path.join(snapshot_dir, 'metrics.json')
+            self.registry.write_snapshot(snapshot_file_path)
+            with open(snapshot_file_path) as snapshot_file:
+                snapshot = json.load(snapshot_file)
+            # No temporary file is left behind
+            self.assertEqual(['metrics.json'], os.listdir(snapshot_dir))
+
+        self.assertEqual({'type': 'counter', 'description': 'Requests.',
+                          'samples': [{'name': 'requests_total', 'labels': {'status': '200'}, 'value': 1}]},
+                         snapshot['metrics']['requests_total'])
+
+
+class TestMetricsExporter(TestCase):
+
+    def test_exporter(self):
+        registry = MetricsRegistry()
+        registry.counter('requests_total', 'Requests.').inc()
+
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            snapshot_file_path = os.path.join(snapshot_dir, 'metrics.json')
+            exporter = MetricsExporter(registry, port=0, snapshot_file_path=snapshot_file_path, snapshot_interval=60)
+            exporter.start()
+            try:
+                url = 'http://127.0.0.1:{}'.format(exporter.port)
+                with request.urlopen(url + '/metrics') as response:
+                    self.assertIn('requests_total 1\n', response.read().decode('utf-8'))
+                with request.urlopen(url + '/metrics.json') as response:
+                    self.assertIn('requests_total', json.loads(response.read().decode('utf-8'))['metrics'])
+                with self.assertRaises(error.HTTPError) as context:
+                    request.urlopen(url + '/other')
+                context.exception.close()
+                self.assertEqual(404, context.exception.code)
+            finally:
+                exporter.stop()
+
+            # The last snapshot is written when stopped
+            self.assertTrue(os.path.exists(snapshot_file_path))
+            self.assertIsNone(exporter.port)
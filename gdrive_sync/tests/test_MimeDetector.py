@@ -0,0 +1,69 @@
+import os
+import tempfile
+import threading
+from unittest import TestCase
+from unittest.mock import patch
+
+from gdrive_sync.MimeDetector import MimeDetector
+
+
+class TestMimeDetector(TestCase):
+
+    def setUp(self):
+        TestCase.setUp(self)
+        self.local_dir = tempfile.TemporaryDirectory()
+        self.mime_detector = MimeDetector(sniff_patterns=['*.dat'], no_sniff_patterns=['*.part'], cache_size=2)
+
+    def tearDown(self):
+        TestCase.tearDown(self)
+        self.local_dir.cleanup()
+
+    def _create_file(self, name, content=b'%PDF-1.4\n'):
+        local_file_path = os.path.join(self.local_dir.name, name)
+        with open(local_file_path, 'wb') as _file:
+            _file.write(content)
+        return local_file_path
+
+    @patch('magic.Magic', autospec=True)
+    def test_detect_by_extension(self, mocked_magic):
+        self.assertEqual('text/plain', self.mime_detector.detect(self._create_file('file.txt')))
+        self.assertEqual('image/jpeg', self.mime_detector.detect(self._create_file('file.JPG')))
+
+        mocked_magic.assert_not_called()
+
+    def test_detect_by_content(self):
+        # The file has no extension or an extension that is configured to be sniffed
+        self.assertEqual('application/pdf', self.mime_detector.detect(self._create_file('file')))
+        self.assertEqual('application/pdf', self.mime_detector.detect(self._create_file('file.dat')))
+        self.assertEqual('application/octet-stream', self.mime_detector.detect(self._create_file('file.part')))
+
+    @patch('magic.Magic', autospec=True)
+    def test_cache(self, mocked_magic):
+        mocked_magic.return_value.from_file.return_value = 'application/pdf'
+        local_file_path = self._create_file('file')
+
+        self.assertEqual('application/pdf', self.mime_detector.detect(local_file_path))
+        self.assertEqual('application/pdf', self.mime_detector.detect(local_file_path))
+        self.assertEqual(1, mocked_magic.return_value.from_file.call_count)
+
+        # A changed file is sniffed again
+        mocked_magic.return_value.from_file.return_value = 'text/plain'
+        self._create_file('file', b'text content')
+        self.assertEqual('text/plain', self.mime_detector.detect(local_file_path))
+
+        # The least recently used type is evicted
+        self.mime_detector.detect(self._create_file('other1'))
+        self.mime_detector.detect(self._create_file('other2'))
+        self.mime_detector.detect(local_file_path)
+        self.assertEqual(5, mocked_magic.return_value.from_file.call_count)
+
+    @patch('magic.Magic', autospec=True)
+    def test_handle_per_thread(self, mocked_magic):
+        self.mime_detector.detect(self._create_file('file1'))
+        self.mime_detector.detect(self._create_file('file2'))
+        thread = threading.Thread(target=lambda: self.mime_detector.detect(self._create_file('file3')))
+        thread.start()
+        thread.join()
+
+        self.assertEqual(2, mocked_magic.call_count)
+        mocked_magic.assert_called_with(mime=True)
@@ -0,0 +1,175 @@
+import io
+import threading
+from unittest import TestCase
+from unittest.mock import Mock
+
+from googleapiclient.http import HttpMockSequence
+
+from gdrive_sync import RateGovernor as RateGovernorModule
+from gdrive_sync.RateGovernor import RateGovernor, GovernedHttp, get_api_method, is_throttled
+
+
+class _FakeClock:
+    """
+    A clock that only advances when sleep is called.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestRateGovernor(TestCase):
+
+    def setUp(self):
+        TestCase.setUp(self)
+        self.clock = _FakeClock()
+
+    def _create_governor(self, initial_rate=10, initial_concurrency=2, max_concurrency=4):
+        return RateGovernor(initial_rate, 1, 20, 1, initial_concurrency, max_concurrency, 0.5, 3, 1, 8,
+                            clock=self.clock, sleep=self.clock.sleep, rand=lambda: 0.5)
+
+    def test_is_throttled(self):
+        self.assertTrue(is_throttled(429))
+        self.assertTrue(is_throttled(503))
+        self.assertTrue(is_throttled(403, b'{"error": {"errors": [{"reason": "userRateLimitExceeded"}]}}'))
+        self.assertFalse(is_throttled(403, b'{"error": {"errors": [{"reason": "insufficientPermissions"}]}}'))
+        self.assertFalse(is_throttled(500))
+        self.assertFalse(is_throttled(200))
+
+    def test_token_bucket(self):
+        governor = self._create_governor(initial_rate=10)
+
+        for _ in range(5):
+            governor.acquire()
+            governor.release(RateGovernor.FAILED)
+
+        # The first request uses the initial token, the others wait for a tenth of a second each
+        self.assertEqual(4, len(self.clock.sleeps))
+        self.assertAlmostEqual(0.4, self.clock.now)
+
+    def test_increase_and_decrease(self):
+        governor = self._create_governor(initial_rate=10, initial_concurrency=2)
+
+        for _ in range(10):
+            governor.acquire()
+            governor.release(RateGovernor.SUCCEEDED)
+        stats = governor.get_stats()
+        self.assertEqual(4, stats['concurrency_limit'])
+        self.assertGreater(stats['rate'], 10)
+        self.assertEqual(10, stats['requests'])
+
+        governor.acquire()
+        governor.release(RateGovernor.THROTTLED)
+        # A second throttled request right after does not slow down again
+        governor.throttled()
+        throttled_stats = governor.get_stats()
+        self.assertEqual(2, throttled_stats['concurrency_limit'])
+        self.assertAlmostEqual(stats['rate'] / 2, throttled_stats['rate'])
+        self.assertEqual(2, throttled_stats['throttled'])
+
+    def test_concurrency_limit(self):
+        governor = RateGovernor(1000, 1, 1000, 1, 1, 1, 0.5, 3, 1, 8)
+        governor.acquire()
+        acquired = threading.Event()
+        thread = threading.Thread(target=lambda: (governor.acquire(), acquired.set()))
+        thread.start()
+
+        self.assertFalse(acquired.wait(0.1))
+        governor.release(RateGovernor.SUCCEEDED)
+        self.assertTrue(acquired.wait(5))
+        thread.join()
+        self.assertEqual(1, governor.get_stats()['in_flight'])
+
+    def test_backoff(self):
+        governor = self._create_governor()
+
+        for attempt in range(6):
+            governor.backoff(attempt)
+
+        self.assertEqual([0.5, 1, 2, 4, 4, 4], self.clock.sleeps)
+
+
+class TestGovernedHttp(TestCase):
+
+    def setUp(self):
+        TestCase.setUp(self)
+        self.governor = Mock(max_retries=2)
+
+    def test_request(self):
+        http = GovernedHttp(HttpMockSequence([({'status': '200'}, 'content')]), self.governor)
+
+        response, content = http.request('http://uri', 'POST', body='body')
+
+        self.assertEqual(b'content', content)
+        self.governor.acquire.assert_called_once_with()
+        self.governor.release.assert_called_once_with(RateGovernor.SUCCEEDED)
+
+    def test_retry(self):
+        http = GovernedHttp(HttpMockSequence([({'status': '429'}, ''),
+                                              ({'status': '500'}, ''),
+                                              ({'status': '403'}, '{"error": {"errors": [{"reason": "rateLimitExceeded"}]}}'),
+                                              ({'status': '200'}, 'content')]),
+                            self.governor)
+
+        response, content = http.request('http://uri')
+
+        # Gives up after max_retries
+        self.assertEqual(403, response.status)
+        self.assertEqual([((RateGovernor.THROTTLED,),), ((RateGovernor.FAILED,),), ((RateGovernor.THROTTLED,),)],
+                         self.governor.release.call_args_list)
+        self.assertEqual([((0,),), ((1,),)], self.governor.backoff.call_args_list)
+
+    def test_stream_body_is_not_retried(self):
+        http = GovernedHttp(HttpMockSequence([({'status': '503'}, ''), ({'status': '200'}, '')]), self.governor)
+
+        response, _ = http.request('http://uri', 'PUT', body=io.BytesIO(b'chunk'))
+
+        self.assertEqual(503, response.status)
+        self.governor.release.assert_called_once_with(RateGovernor.THROTTLED)
+        self.governor.backoff.assert_not_called()
+
+    def test_request_metrics(self):
+        uri = 'https://www.googleapis.com/drive/v3/files/file_id?alt=media'
+        requests = RateGovernorModule._API_REQUESTS.get(method='files.get_media', status=200)
+        request_count, _ = RateGovernorModule._API_REQUEST_SECONDS.get(method='files.get_media')
+        bytes_up = RateGovernorModule._TRANSFERRED_BYTES.get(direction='up')
+        bytes_down = RateGovernorModule._TRANSFERRED_BYTES.get(direction='down')
+        http = GovernedHttp(HttpMockSequence([({'status': '200'}, 'content')]), self.governor)
+
+        http.request(uri, body='body')
+
+        self.assertEqual(requests + 1, RateGovernorModule._API_REQUESTS.get(method='files.get_media', status=200))
+        self.assertEqual((request_count + 1), RateGovernorModule._API_REQUEST_SECONDS.get(method='files.get_media')[0])
+        self.assertEqual(bytes_up + 4, RateGovernorModule._TRANSFERRED_BYTES.get(direction='up'))
+        self.assertEqual(bytes_down + 7, RateGovernorModule._TRANSFERRED_BYTES.get(direction='down'))
+
+    def test_get_api_method(self):
+        base_uri = 'https://www.googleapis.com'
+        self.assertEqual('files.list', get_api_method(base_uri + '/drive/v3/files?q=x', 'GET'))
+        self.assertEqual('files.get', get_api_method(base_uri + '/drive/v3/files/file_id?fields=id', 'GET'))
+        self.assertEqual('files.get_media', get_api_method(base_uri + '/drive/v3/files/file_id?alt=media', 'GET'))
+        self.assertEqual('files.create', get_api_method(base_uri + '/upload/drive/v3/files?uploadType=multipart',
+                                                        'POST'))
+        self.assertEqual('files.update', get_api_method(base_uri + '/drive/v3/files/file_id', 'PATCH'))
+        self.assertEqual('files.delete', get_api_method(base_uri + '/drive/v3/files/file_id', 'DELETE'))
+        self.assertEqual('files.upload_chunk',
+                         get_api_method(base_uri + '/upload/drive/v3/files?uploadType=resumable&upload_id=x', 'PUT'))
+        self.assertEqual('batch', get_api_method(base_uri + '/batch/drive/v3', 'POST'))
+        self.assertEqual('other', get_api_method('http://uri', 'GET'))
+
+    def test_failed_request(self):
+        inner_http = Mock()
+        inner_http.request.side_effect = OSError('connection lost')
+        http = GovernedHttp(inner_http, self.governor)
+
+        self.assertRaises(OSError, http.request, 'http://uri')
+
+        self.governor.release.assert_called_once_with(RateGovernor.FAILED)
@@ -0,0 +1,80 @@
+import threading
+from unittest import TestCase
+from unittest.mock import Mock, patch, call
+
+from gdrive_sync.RemoteTreeWalker import RemoteTreeWalker
+
+
+class TestRemoteTreeWalker(TestCase):
+
+    def setUp(self):
+        TestCase.setUp(self)
+        self.mocked_service_factory = Mock(side_effect=lambda: Mock(name='service'))
+
+    def _mock_remote_tree(self, mock_get_remote_files_from_dir, remote_tree):
+        listed_dirs = []
+
+        def get_remote_files_from_dir(service, parent_dir_id):
+            listed_dirs.append(parent_dir_id)
+            return iter([dict(each) for each in remote_tree[parent_dir_id]])
+        mock_get_remote_files_from_dir.side_effect = get_remote_files_from_dir
+        return listed_dirs
+
+    @patch('gdrive_sync.utils.get_remote_files_from_dir', autospec=True)
+    def test_list_remote_files_from_dir(self, mock_get_remote_files_from_dir):
+        folder = 'application/vnd.google-apps.folder'
+        listed_dirs = self._mock_remote_tree(mock_get_remote_files_from_dir,
+                                             {'root_id': [{'id': 'dir1', 'mimeType': folder},
+                                                          {'id': 'file1', 'mimeType': 'not_dir'}],
+                                              'dir1': [{'id': 'dir2', 'mimeType': folder},
+                                                       {'id': 'file2', 'mimeType': 'not_dir'}],
+                                              'dir2': []})
+        walker = RemoteTreeWalker(4, 8, self.mocked_service_factory)
+
+        result_iter = walker.list_remote_files_from_dir('root_id')
+
+        remote_dir = next(result_iter)
+        self.assertEqual('dir1', remote_dir['id'])
+        remote_child_dir = next(remote_dir['children'])
+        self.assertEqual('dir2', remote_child_dir['id'])
+        self.assertEqual([], list(remote_child_dir['children']))
+        self.assertEqual([{'id': 'file2', 'mimeType': 'not_dir'}], list(remote_dir['children']))
+        self.assertEqual([{'id': 'file1', 'mimeType': 'not_dir'}], list(result_iter))
+        self.assertEqual(['root_id', 'dir1', 'dir2'], listed_dirs)
+        walker.close()
+
+    @patch('gdrive_sync.utils.get_remote_files_from_dir', autospec=True)
+    def test_lookahead_is_bounded(self, mock_get_remote_files_from_dir):
+        folder = 'application/vnd.google-apps.folder'
+        remote_tree = {'root_id': [{'id': 'dir{}'.format(i), 'mimeType': folder} for i in range(5)]}
+        remote_tree.update({'dir{}'.format(i): [] for i in range(5)})
+        listed_dirs = self._mock_remote_tree(mock_get_remote_files_from_dir, remote_tree)
+        walker = RemoteTreeWalker(2, 3, self.mocked_service_factory)
+
+        remote_dirs = list(walker.list_remote_files_from_dir('root_id'))
+        walker._executor.shutdown(wait=True)
+
+        # The root and two child dirs were listed ahead, the rest is listed on consumption
+        self.assertEqual(3, len(listed_dirs))
+        self.assertEqual([], [each for remote_dir in remote_dirs for each in remote_dir['children']])
+        self.assertEqual(6, len(listed_dirs))
+
+        # Consumed and discarded listings give their slots back
+        del remote_dirs
+        for _ in range(3):
+            self.assertTrue(walker._lookahead_slots.acquire(blocking=False))
+
+    @patch('gdrive_sync.utils.get_remote_files_from_dir', autospec=True)
+    def test_service_per_thread(self, mock_get_remote_files_from_dir):
+        self._mock_remote_tree(mock_get_remote_files_from_dir, {'root_id': []})
+        walker = RemoteTreeWalker(1, 1, self.mocked_service_factory)
+
+        self.assertEqual([], list(walker.list_remote_files_from_dir('root_id')))
+        self.assertEqual([], list(walker.list_remote_files_from_dir('root_id')))
+        walker.close()
+
+        self.mocked_service_factory.assert_called_once_with()
+        thread = threading.Thread(target=walker._get_service)
+        thread.start()
+        thread.join()
+        self.mocked_service_factory.assert_has_calls([call(), call()])
@@ -0,0 +1,63 @@
+import datetime
+import threading
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from gdrive_sync import ServicePool
+
+
+class TestServicePool(TestCase):
+
+    def setUp(self):
+        TestCase.setUp(self)
+        self.mocked_credentials = Mock()
+        self.mocked_credentials.token_expiry = None
+        self.mocked_credentials_factory = Mock(return_value=self.mocked_credentials)
+        self.pool = ServicePool.ServicePool(300, 0.01, self.mocked_credentials_factory)
+
+    @patch('httplib2.Http', autospec=True)
+    @patch('gdrive_sync.utils.build_service', autospec=True)
+    def test_get_service(self, mocked_build, http_mock):
+        mocked_build.side_effect = lambda *args, **kwargs: Mock(name='service')
+        self.mocked_credentials.authorize.side_effect = lambda http: 'authorized'
+
+        service = self.pool.get_service()
+        self.assertIs(service, self.pool.get_service())
+        other_services = []
+        thread = threading.Thread(target=lambda: other_services.append(self.pool.get_service()))
+        thread.start()
+        thread.join()
+
+        self.assertIsNot(service, other_services[0])
+        self.mocked_credentials_factory.assert_called_once_with()
+        self.assertEqual(2, http_mock.call_count)
+        self.assertEqual(2, self.mocked_credentials.authorize.call_count)
+        mocked_build.assert_called_with('authorized')
+
+    def test_seconds_until_refresh(self):
+        self.assertIsNone(self.pool.seconds_until_refresh())
+
+        self.mocked_credentials.token_expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=3600)
+        self.assertAlmostEqual(3300, self.pool.seconds_until_refresh(), delta=5)
+
+        self.mocked_credentials.token_expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=100)
+        self.assertEqual(0, self.pool.seconds_until_refresh())
+
+    @patch('httplib2.Http', autospec=True)
+    def test_refresh_in_background(self, http_mock):
+        refreshed = threading.Event()
+
+        def refresh(http):
+            if not self.mocked_credentials.refresh.call_count > 1:
+                raise Exception('failed')
+            self.mocked_credentials.token_expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=3600)
+            refreshed.set()
+        self.mocked_credentials.refresh.side_effect = refresh
+        self.mocked_credentials.token_expiry = datetime.datetime.utcnow()
+
+        self.pool.start()
+        self.assertTrue(refreshed.wait(5))
+        self.pool.stop()
+
+        # The failed refresh is retried
+        self.assertEqual(2, self.mocked_credentials.refresh.call_count)
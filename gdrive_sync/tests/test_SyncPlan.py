@@ -0,0 +1,36 @@
+from unittest import TestCase
+
+from gdrive_sync.SyncPlan import SyncAction, SyncPlan
+
+
+class TestSyncPlan(TestCase):
+
+    def setUp(self):
+        TestCase.setUp(self)
+        self.plan = SyncPlan([SyncAction(SyncAction.DELETE_LOCAL, 'path1'),
+                              SyncAction(SyncAction.UPLOAD, 'dir2/file2', size=200),
+                              SyncAction(SyncAction.DOWNLOAD, 'path3', remote_id='3', size=3000),
+                              SyncAction(SyncAction.CREATE_REMOTE_DIR, 'dir2', remote_parent_id='root_id'),
+                              SyncAction(SyncAction.OVERWRITE_REMOTE, 'path4', remote_id='4', size=40),
+                              SyncAction(SyncAction.CREATE_REMOTE_DIR, 'dir2/dir5'),
+                              SyncAction(SyncAction.RECORD, 'root', remote_id='root_id')])
+
+    def test_unknown_kind(self):
+        self.assertRaises(ValueError, SyncAction, 'rename', 'path1')
+
+    def test_ordered_actions(self):
+        self.assertEqual(['root', 'dir2', 'dir2/dir5', 'dir2/file2', 'path4', 'path3', 'path1'],
+                         [action.local_path for action in self.plan.ordered_actions()])
+
+    def test_costs(self):
+        self.assertEqual(7, len(self.plan))
+        self.assertEqual(2, self.plan.count(SyncAction.CREATE_REMOTE_DIR))
+        self.assertEqual(240, self.plan.upload_bytes)
+        self.assertEqual(3000, self.plan.download_bytes)
+        self.assertEqual(5, self.plan.api_calls)
+        self.assertEqual(5 * 0.5 / 2 + 240 / 10 + 3000 / 100,
+                         self.plan.estimate_seconds(10, 100, 0.5, workers=2))
+        self.assertTrue(self.plan.summary(10, 100, 0.5).endswith('estimated seconds  56.5'))
+
+    def test_json(self):
+        self.assertEqual(self.plan.actions, SyncPlan.from_json(self.plan.to_json()).actions)
@@ -0,0 +1,122 @@
+import os
+import tempfile
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from gdrive_sync import Db
+from gdrive_sync.TransferEngine import TransferEngine
+
+
+class TestTransferEngine(TestCase):
+
+    @patch('gdrive_sync.utils.overwrite_remote_file_with_local', autospec=True)
+    @patch('gdrive_sync.utils.copy_remote_file_to_local', autospec=True)
+    @patch('gdrive_sync.utils.copy_local_file_to_remote', autospec=True)
+    def test_inline(self,
+                    mock_copy_local_file_to_remote,
+                    mock_copy_remote_file_to_local,
+                    mock_overwrite_remote_file_with_local):
+        mocked_service = Mock()
+        mock_copy_local_file_to_remote.return_value = 'remote_file_id'
+        mock_copy_remote_file_to_local.return_value = None
+        mock_overwrite_remote_file_with_local.return_value = 'remote_file'
+        callback = Mock()
+        engine = TransferEngine(0, lambda: mocked_service, upload_sessions='db_handler')
+
+        engine.submit_upload('local_path_1', 'remote_parent_dir_id', callback.upload)
+        callback.upload.assert_called_once_with('remote_file_id')
+        engine.submit_download('remote_id_2', 'local_path_2', callback.download, file_size=200)
+        callback.download.assert_called_once_with(None)
+        engine.submit_overwrite('remote_id_3', 'local_path_3', callback.overwrite)
+        callback.overwrite.assert_called_once_with('remote_file')
+        engine.close()
+
+        mock_copy_local_file_to_remote.assert_called_once_with('local_path_1', 'remote_parent_dir_id',
+                                                               mocked_service, 'db_handler')
+        mock_copy_remote_file_to_local.assert_called_once_with(mocked_service, 'local_path_2', 'remote_id_2', 200)
+        mock_overwrite_remote_file_with_local.assert_called_once_with(mocked_service, 'remote_id_3',
+                                                                      'local_path_3', 'db_handler')
+
+    @patch('gdrive_sync.utils.copy_local_file_to_remote', autospec=True)
+    def test_failed_job_skips_callback(self, mock_copy_local_file_to_remote):
+        mock_copy_local_file_to_remote.side_effect = [Exception('upload failed'), 'remote_file_id']
+        callback = Mock()
+        engine = TransferEngine(2, Mock)
+
+        engine.submit_upload('local_path_1', 'remote_parent_dir_id', callback)
+        engine.join()
+        engine.submit_upload('local_path_2', 'remote_parent_dir_id', callback)
+        engine.close()
+
+        callback.assert_called_once_with('remote_file_id')
+
+    @patch('gdrive_sync.utils.copy_remote_file_to_local', autospec=True)
+    def test_workers(self, mock_copy_remote_file_to_local):
+        running = []
+        both_running = threading.Event()
+        lock = threading.Lock()
+
+        def copy_remote_file_to_local(service, local_file_path, remote_file_id, file_size):
+            with lock:
+                running.append(local_file_path)
+                if len(running) == 2:
+                    both_running.set()
+            self.assertTrue(both_running.wait(5), 'Transfers should run concurrently')
+        mock_copy_remote_file_to_local.side_effect = copy_remote_file_to_local
+        submitting_thread = threading.current_thread()
+        callback_threads = []
+        callback = Mock(side_effect=lambda result: callback_threads.append(threading.current_thread()))
+        service_factory = Mock(side_effect=lambda: Mock(name='service'))
+        engine = TransferEngine(2, service_factory, max_pending=2)
+
+        engine.submit_download('remote_id_1', 'local_path_1', callback)
+        engine.submit_download('remote_id_2', 'local_path_2', callback)
+        # The third job waits for one of the first two to complete
+        engine.submit_download('remote_id_3', 'local_path_3', callback)
+        self.assertTrue(callback.called)
+        engine.close()
+
+        self.assertEqual(3, callback.call_count)
+        self.assertEqual([submitting_thread] * 3, callback_threads)
+        self.assertEqual(2, service_factory.call_count)
+        self.assertEqual({'local_path_1', 'local_path_2', 'local_path_3'}, set(running))
+
+    @patch('gdrive_sync.utils.copy_local_file_to_remote', autospec=True)
+    def test_upload_sessions_within_batch(self, mock_copy_local_file_to_remote):
+        def copy_local_file_to_remote(local_file_path, remote_parent_dir_id, service, upload_sessions):
+            self.assertIsNone(upload_sessions.get_upload_session(local_file_path))
+            for committed_offset in (262144, 524288):
+                upload_sessions.set_upload_session(local_file_path, 'session_uri', 1048576, 101, committed_offset)
+            if local_file_path == 'local_path_2':
+                upload_sessions.delete_upload_session(local_file_path)
+            return 'remote_id'
+        mock_copy_local_file_to_remote.side_effect = copy_local_file_to_remote
+        callback = Mock()
+
+        with tempfile.TemporaryDirectory() as db_dir:
+            db_handler = Db.DbHandler(os.path.join(db_dir, 'test_db'))
+            try:
+                with db_handler.batch():
+                    # The read writes the batched record into the open transaction
+                    db_handler.insert_record('local_path_0', 'remote_id_0', 101, 1001)
+                    db_handler.get_local_hash(1, 2, 3, 4)
+                    started = time.monotonic()
+                    engine = TransferEngine(2, Mock, upload_sessions=db_handler)
+                    engine.submit_upload('local_path_1', 'remote_parent_dir_id', callback)
+                    engine.submit_upload('local_path_2', 'remote_parent_dir_id', callback)
+                    engine.close()
+                    # The workers did not wait for the transaction of the batch
+                    self.assertLess(time.monotonic() - started, 2)
+
+                sessions = []
+                thread = threading.Thread(target=lambda: sessions.extend(
+                    db_handler.get_upload_session(local_path) for local_path in ('local_path_1', 'local_path_2')))
+                thread.start()
+                thread.join()
+            finally:
+                db_handler.close()
+
+        self.assertEqual(2, callback.call_count)
+        self.assertEqual([('session_uri', 1048576, 101, 524288), None], sessions)
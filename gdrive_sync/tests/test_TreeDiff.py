@@ -0,0 +1,92 @@
+import sys
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from gdrive_sync import Db
+from gdrive_sync.LocalScanner import LocalEntry
+from gdrive_sync.TreeDiff import Change, TreeDiff, merge_by_name
+
+_FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+
+def _create_local_entry(name, path, mtime=100, size=10, children=None):
+    local_entry = Mock(spec_set=LocalEntry)
+    local_entry.name = name
+    local_entry.path = path
+    local_entry.mtime = mtime
+    local_entry.size = size
+    local_entry.is_dir = children is not None
+    local_entry.children = children
+    return local_entry
+
+
+def _create_remote_entry(name, remote_id, children=None):
+    remote_entry = {'id': remote_id, 'name': name, 'modifiedTime': 'modifiedTime', 'mimeType': 'file'}
+    if children is not None:
+        remote_entry['mimeType'] = _FOLDER_MIME_TYPE
+        remote_entry['children'] = children
+    return remote_entry
+
+
+class TestTreeDiff(TestCase):
+
+    def setUp(self):
+        TestCase.setUp(self)
+        self.db_handler = Mock(Db.DbHandler)
+        self.db_handler.get_remote_file_id.return_value = None
+        self.db_handler.get_local_file_path.return_value = None
+        self.db_handler.get_local_modification_date.return_value = None
+        self.db_handler.get_remote_modification_date.return_value = None
+        self.tree_diff = TreeDiff(self.db_handler)
+
+    def test_merge_by_name(self):
+        local_entries = [_create_local_entry(name, name) for name in ['a', 'c', 'd']]
+        # Google Drive allows two files with the same name in a dir
+        remote_entries = [_create_remote_entry(name, name) for name in ['b', 'c', 'c', 'e']]
+
+        self.assertEqual([('a', 'a', None), ('b', None, 'b'), ('c', 'c', 'c'), ('c', None, 'c'),
+                          ('d', 'd', None), ('e', None, 'e')],
+                         [(name, local_entry.path if local_entry else None, remote_entry['id'] if remote_entry else None)
+                          for name, local_entry, remote_entry in merge_by_name(local_entries, remote_entries)])
+
+    @patch('gdrive_sync.utils.convert_rfc3339_time_to_epoch', autospec=True)
+    def test_diff(self, mock_convert_rfc3339_time_to_epoch):
+        mock_convert_rfc3339_time_to_epoch.return_value = 100
+        self.db_handler.get_local_file_path.side_effect = lambda remote_id: 'path' if remote_id == 'deleted' else None
+        local_entries = iter([_create_local_entry('file2', 'local/file2', mtime=100),
+                              _create_local_entry('file1', 'local/file1', mtime=101),
+                              _create_local_entry('same', 'local/same'),
+                              _create_local_entry('dir1', 'local/dir1',
+                                                  children=iter([_create_local_entry('file3', 'local/dir1/file3')]))])
+        remote_entries = iter([_create_remote_entry('same', 'same_id', children=iter([])),
+                               _create_remote_entry('file1', 'file1_id'),
+                               _create_remote_entry('file2', 'file2_id'),
+                               _create_remote_entry('deleted', 'deleted'),
+                               _create_remote_entry('dir1', 'dir1_id', children=iter([]))])
+
+        changes = list(self.tree_diff.diff(local_entries, remote_entries, 'local', 'remote_id'))
+
+        self.assertEqual([(Change.DELETE_REMOTE, 'local/deleted'),
+                          (Change.CREATE_REMOTE, 'local/dir1/file3'),
+                          (Change.UPDATE_REMOTE, 'local/file1'),
+                          (Change.UNCHANGED, 'local/file2')],
+                         [(change.kind, change.local_path) for change in changes])
+        # The file created at remote goes into the remote dir of its local dir
+        self.assertEqual('dir1_id', changes[1].remote_parent_id)
+        self.assertFalse(changes[1].is_dir)
+
+    def test_deep_tree(self):
+        depth = sys.getrecursionlimit() + 100
+        local_entry = _create_local_entry('file', 'file')
+        for level in range(depth):
+            local_entry = _create_local_entry('dir', 'dir{}'.format(level), children=iter([local_entry]))
+
+        changes = list(self.tree_diff.diff(iter([local_entry]), iter([]), 'local', 'remote_id'))
+
+        self.assertEqual(depth + 1, len(changes))
+        self.assertEqual(['dir{}'.format(depth - 1), 'dir{}'.format(depth - 2)],
+                         [change.local_path for change in changes[:2]])
+        self.assertEqual('file', changes[-1].local_path)
+        self.assertTrue(changes[0].is_dir)
+        self.assertEqual('remote_id', changes[0].remote_parent_id)
+        self.assertIsNone(changes[1].remote_parent_id)
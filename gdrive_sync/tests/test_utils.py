@@ -1,10 +1,34 @@
 import os
+import stat
+import tempfile
 from unittest import TestCase
 from unittest.mock import Mock, patch, MagicMock, call, create_autospec
 
+from googleapiclient import discovery
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpMockSequence
+
 from gdrive_sync import utils
 
 
+class _FakeUploadSessions:
+    """
+    Stores the upload sessions in a dict instead of a Db.
+    """
+
+    def __init__(self):
+        self._sessions = {}
+
+    def get_upload_session(self, local_path):
+        return self._sessions.get(local_path)
+
+    def set_upload_session(self, local_path, session_uri, file_size, local_modification_date, committed_offset):
+        self._sessions[local_path] = (session_uri, file_size, local_modification_date, committed_offset)
+
+    def delete_upload_session(self, local_path):
+        self._sessions.pop(local_path, None)
+
+
 class TestUtils(TestCase):
 
     def test_get_gdrive_sync_home(self):
@@ -31,31 +55,15 @@ class TestUtils(TestCase):
 
         mocked_service.files.assert_called_once_with()
         mocked_service.files.return_value.list.assert_called_once_with(
-            q="query", corpora="user", fields="fields", pageToken=None)
+            q="query", corpora="user", fields="fields", pageToken=None, pageSize=None)
         mocked_service.files.return_value.list.return_value.execute.assert_called_once_with()
 
-    @patch('os.scandir', autospec=True)
-    def test_list_files_under_local_dir(self, mock_scandir):
-        mock_direntry_1 = Mock()
-        mock_direntry_1.is_dir.return_value = False
-        mock_direntry_2 = Mock()
-        mock_direntry_2.is_dir.return_value = True
-        mock_direntry_2.path = '/path/to/some/dir'
-        mock_direntry_3 = Mock()
-        mock_direntry_3.is_dir.return_value = False
-        mock_scandir.side_effect = [[mock_direntry_1, mock_direntry_2], [mock_direntry_3]]
-
-        # self.assertEqual([mock_direntry_1, {mock_direntry_2: [mock_direntry_3]}],
-        #                  utils.list_files_under_local_dir('dir_path'))
-        result_iter = utils.list_files_under_local_dir('dir_path')
-
-        self.assertEqual(mock_direntry_1, next(result_iter))
-        tmp_next = next(result_iter)
-        key = next(iter(tmp_next))
-        self.assertEqual(mock_direntry_2, key)
-        self.assertEqual(mock_direntry_3, next(tmp_next[key]))
-
-        mock_scandir.assert_has_calls([call(path='dir_path'), call(path='/path/to/some/dir')])
+    @patch('gdrive_sync.LocalScanner.scan_local_dir', autospec=True)
+    def test_list_files_under_local_dir(self, mock_scan_local_dir):
+        mock_scan_local_dir.return_value = iter(['local_entry'])
+
+        self.assertEqual(['local_entry'], list(utils.list_files_under_local_dir('dir_path')))
+        mock_scan_local_dir.assert_called_once_with('dir_path')
 
     def test_convert_rfc3339_time_to_epoch(self):
         self.assertEqual(1498620320, utils.convert_rfc3339_time_to_epoch('2017-06-28T03:25:20.954Z'))
@@ -63,11 +71,11 @@ class TestUtils(TestCase):
     def test_convert_epoch_time_to_rfc3339(self):
         self.assertEqual('2017-06-28T03:25:20Z', utils.convert_epoch_time_to_rfc3339(1498620320))
 
-    @patch('magic.from_file', autospec=True)
-    def test_overwrite_remote_file_with_local(self, mocked_magic):
+    @patch('gdrive_sync.utils.get_mime_type', autospec=True)
+    def test_overwrite_remote_file_with_local(self, mocked_get_mime_type):
         mocked_service = Mock()
         mocked_service.files.return_value.update.return_value.execute.return_value = 'final return'
-        mocked_magic.return_value = 'test_mime_type'
+        mocked_get_mime_type.return_value = 'test_mime_type'
 
         self.assertEqual('final return', utils.overwrite_remote_file_with_local(
             mocked_service, 'test id', 'test path'))
@@ -77,35 +85,74 @@ class TestUtils(TestCase):
                                                                          media_body='test path',
                                                                          media_mime_type='test_mime_type')
         mocked_service.files.return_value.update.return_value.execute.assert_called_once_with()
-        mocked_magic.assert_called_once_with('test path', True)
+        mocked_get_mime_type.assert_called_once_with('test path')
 
+    @patch.object(utils._DownloadSettings, 'preallocate', True)
+    @patch.object(utils._DownloadSettings, 'chunk_size', 4)
     def test_copy_remote_file_to_local(self):
-        mocked_service = Mock()
-        mocked_service.files.return_value.get_media.return_value.execute.return_value = b'test content'
-
-        utils.copy_remote_file_to_local(mocked_service,
-                                        '/tmp/gdrive_test.txt',
-                                        'Test id')
-
-        mocked_service.files.assert_called_once_with()
-        mocked_service.files.return_value.get_media.assert_called_once_with(fileId='Test id')
-        mocked_service.files.return_value.get_media.return_value.execute.assert_called_once_with()
-        with open('/tmp/gdrive_test.txt', 'r') as file:
-            self.assertEqual('test content', file.read())
-        os.remove('/tmp/gdrive_test.txt')
-
-    @patch('magic.from_file', autospec=True)
+        service, received_requests = self._build_service([({'status': '206', 'content-range': 'bytes 0-3/10'},
+                                                           'test'),
+                                                          ({'status': '206', 'content-range': 'bytes 4-7/10'},
+                                                           ' con'),
+                                                          ({'status': '206', 'content-range': 'bytes 8-9/10'},
+                                                           'te')])
+        with tempfile.TemporaryDirectory() as local_dir:
+            local_file_path = os.path.join(local_dir, 'gdrive_test.txt')
+            with open(local_file_path, 'w') as _file:
+                _file.write('old content')
+
+            # The remote file shrank after its size was listed
+            utils.copy_remote_file_to_local(service, local_file_path, 'Test id', file_size=16)
+
+            with open(local_file_path, 'r') as _file:
+                self.assertEqual('test conte', _file.read())
+            self.assertEqual(['gdrive_test.txt'], os.listdir(local_dir))
+        self.assertEqual(['bytes=0-3', 'bytes=4-7', 'bytes=8-11'],
+                         [headers['range'] for _, _, headers in received_requests])
+
+    @patch.object(utils._DownloadSettings, 'new_file_mode', 0o644)
+    def test_copy_remote_file_to_local_mode(self):
+        service, _ = self._build_service([({'status': '200'}, 'content'), ({'status': '200'}, 'content')])
+        with tempfile.TemporaryDirectory() as local_dir:
+            new_file_path = os.path.join(local_dir, 'new.txt')
+            existing_file_path = os.path.join(local_dir, 'existing.txt')
+            with open(existing_file_path, 'w') as _file:
+                _file.write('old content')
+            os.chmod(existing_file_path, 0o640)
+
+            utils.copy_remote_file_to_local(service, new_file_path, 'Test id')
+            utils.copy_remote_file_to_local(service, existing_file_path, 'Test id')
+
+            self.assertEqual(0o644, stat.S_IMODE(os.stat(new_file_path).st_mode))
+            self.assertEqual(0o640, stat.S_IMODE(os.stat(existing_file_path).st_mode))
+
+    @patch.object(utils._DownloadSettings, 'chunk_size', 4)
+    def test_copy_remote_file_to_local_interrupted(self):
+        service, _ = self._build_service([({'status': '206', 'content-range': 'bytes 0-3/10'}, 'test'),
+                                          ({'status': '500'}, '')])
+        with tempfile.TemporaryDirectory() as local_dir:
+            local_file_path = os.path.join(local_dir, 'gdrive_test.txt')
+            with open(local_file_path, 'w') as _file:
+                _file.write('old content')
+
+            self.assertRaises(HttpError, utils.copy_remote_file_to_local, service, local_file_path, 'Test id')
+
+            with open(local_file_path, 'r') as _file:
+                self.assertEqual('old content', _file.read())
+            self.assertEqual(['gdrive_test.txt'], os.listdir(local_dir))
+
+    @patch('gdrive_sync.utils.get_mime_type', autospec=True)
     @patch('os.path.basename', autospec=True)
     @patch('gdrive_sync.utils.check_and_get_service', autospec=True)
     def test_copy_local_file_to_remote(self,
                                        check_and_get_service_mock,
                                        path_basename_mock,
-                                       mocked_magic):
+                                       mocked_get_mime_type):
         mocked_service = Mock()
         mocked_service.files.return_value.create.return_value.execute.return_value = {'id': 'id1'}
         check_and_get_service_mock.return_value = mocked_service
         path_basename_mock.return_value = 'file'
-        mocked_magic.return_value = 'test_mime_type'
+        mocked_get_mime_type.return_value = 'test_mime_type'
 
         self.assertEqual('id1',
                          utils.copy_local_file_to_remote('/path/to/local/file',
@@ -119,12 +166,122 @@ class TestUtils(TestCase):
             media_mime_type='test_mime_type')
         mocked_service.files.return_value.create.return_value.execute.assert_called_once_with()
         check_and_get_service_mock.assert_called_once_with('service')
-        mocked_magic.assert_called_once_with('/path/to/local/file', True)
+        mocked_get_mime_type.assert_called_once_with('/path/to/local/file')
 
         self.assertEqual('id1',
                          utils.copy_local_file_to_remote('/path/to/local/file',
                                                          'test_remote_parent_dir_id'))
 
+    def _build_service(self, responses):
+        """
+        Returns a service whose requests are answered in order by a fake endpoint,
+        and the list of the (method, uri, headers) of the requests it receives.
+        """
+        received_requests = []
+        fake_endpoint = HttpMockSequence(responses)
+        fake_request = fake_endpoint.request
+
+        def request(uri, method='GET', body=None, headers=None, **kwargs):
+            received_requests.append((method, uri, headers))
+            return fake_request(uri, method=method, body=body, headers=headers, **kwargs)
+        fake_endpoint.request = request
+        return discovery.build('drive', 'v3', http=fake_endpoint, static_discovery=True), received_requests
+
+    @patch.object(utils._UploadSettings, 'resumable_threshold', 8)
+    @patch.object(utils._UploadSettings, 'chunk_size', 4)
+    @patch('gdrive_sync.utils.get_mime_type', autospec=True)
+    def test_copy_local_file_to_remote_resumable(self, mocked_get_mime_type):
+        mocked_get_mime_type.return_value = 'text/plain'
+        upload_sessions = _FakeUploadSessions()
+        with tempfile.NamedTemporaryFile() as local_file:
+            local_file.write(b'0123456789')
+            local_file.flush()
+
+            # The upload fails after the first chunk
+            service, _ = self._build_service([({'status': '200', 'location': 'http://upload/session1'}, ''),
+                                              ({'status': '308', 'range': 'bytes=0-3'}, ''),
+                                              ({'status': '400'}, '')])
+            self.assertRaises(HttpError, utils.copy_local_file_to_remote, local_file.name, 'parent_id', service,
+                              upload_sessions)
+            self.assertEqual(('http://upload/session1', 10, os.stat(local_file.name).st_mtime, 4),
+                             upload_sessions.get_upload_session(local_file.name))
+
+            # The restarted upload asks for the committed offset and sends the rest only
+            service, received_requests = self._build_service([({'status': '308', 'range': 'bytes=0-3'}, ''),
+                                                              ({'status': '308', 'range': 'bytes=0-7'}, ''),
+                                                              ({'status': '200'}, '{"id": "id1"}')])
+            self.assertEqual('id1', utils.copy_local_file_to_remote(local_file.name, 'parent_id', service,
+                                                                    upload_sessions))
+        self.assertEqual([('PUT', 'http://upload/session1', 'bytes */10'),
+                          ('PUT', 'http://upload/session1', 'bytes 4-7/10'),
+                          ('PUT', 'http://upload/session1', 'bytes 8-9/10')],
+                         [(method, uri, headers['Content-Range']) for method, uri, headers in received_requests])
+        self.assertIsNone(upload_sessions.get_upload_session(local_file.name))
+
+    @patch.object(utils._UploadSettings, 'resumable_threshold', 8)
+    @patch.object(utils._UploadSettings, 'chunk_size', 4)
+    @patch('gdrive_sync.RateGovernor.RateGovernor.backoff', autospec=True)
+    @patch('gdrive_sync.utils.get_mime_type', autospec=True)
+    def test_copy_local_file_to_remote_throttled_chunk(self, mocked_get_mime_type, mocked_backoff):
+        mocked_get_mime_type.return_value = 'text/plain'
+        with tempfile.NamedTemporaryFile() as local_file:
+            local_file.write(b'0123456789')
+            local_file.flush()
+            service, received_requests = self._build_service([({'status': '200', 'location': 'http://upload/s'}, ''),
+                                                              ({'status': '308', 'range': 'bytes=0-3'}, ''),
+                                                              ({'status': '429'}, ''),
+                                                              ({'status': '308', 'range': 'bytes=0-3'}, ''),
+                                                              ({'status': '308', 'range': 'bytes=0-7'}, ''),
+                                                              ({'status': '200'}, '{"id": "id1"}')])
+
+            self.assertEqual('id1', utils.copy_local_file_to_remote(local_file.name, 'parent_id', service))
+
+        # The throttled chunk is sent again from the offset committed by the server
+        self.assertEqual(['bytes 0-3/10', 'bytes 4-7/10', 'bytes */10', 'bytes 4-7/10', 'bytes 8-9/10'],
+                         [headers['Content-Range'] for _, _, headers in received_requests[1:]])
+        self.assertEqual(1, mocked_backoff.call_count)
+
+    @patch.object(utils._UploadSettings, 'resumable_threshold', 8)
+    @patch.object(utils._UploadSettings, 'chunk_size', 16)
+    @patch('gdrive_sync.utils.get_mime_type', autospec=True)
+    def test_update_remote_file_expired_session(self, mocked_get_mime_type):
+        mocked_get_mime_type.return_value = 'text/plain'
+        upload_sessions = _FakeUploadSessions()
+        with tempfile.NamedTemporaryFile() as local_file:
+            local_file.write(b'0123456789')
+            local_file.flush()
+            upload_sessions.set_upload_session(local_file.name, 'http://upload/expired', 10,
+                                               os.stat(local_file.name).st_mtime, 4)
+            service, received_requests = self._build_service([({'status': '404'}, ''),
+                                                              ({'status': '200', 'location': 'http://upload/new'}, ''),
+                                                              ({'status': '200'}, '{"id": "remote_file_id"}')])
+
+            utils.update_remote_file('remote_file_id', local_file.name, service, upload_sessions)
+
+        self.assertEqual(['http://upload/expired',
+                          'https://www.googleapis.com/upload/drive/v3/files/remote_file_id?alt=json&uploadType=resumable',
+                          'http://upload/new'],
+                         [uri for _, uri, _ in received_requests])
+        self.assertIsNone(upload_sessions.get_upload_session(local_file.name))
+
+    @patch('gdrive_sync.utils.check_and_get_service', autospec=True)
+    def test_move_remote_file(self, mock_check_and_get_service):
+        mocked_service = Mock()
+        mock_check_and_get_service.return_value = mocked_service
+        mocked_service.files.return_value.update.return_value.execute.return_value = 'remote_file'
+
+        self.assertEqual('remote_file', utils.move_remote_file('remote_file_id', 'new_name', 'new_parent_id',
+                                                               'old_parent_id'))
+        utils.move_remote_file('remote_file_id', 'new_name', 'parent_id', 'parent_id', 'service')
+
+        mock_check_and_get_service.assert_has_calls([call(None), call('service')])
+        mocked_service.files.return_value.update.assert_has_calls([
+            call(fileId='remote_file_id', body={'name': 'new_name'}, fields='id, modifiedTime',
+                 addParents='new_parent_id', removeParents='old_parent_id'),
+            call().execute(),
+            call(fileId='remote_file_id', body={'name': 'new_name'}, fields='id, modifiedTime'),
+            call().execute()])
+
     def test_get_remote_files_from_dir(self):
         mocked_service = Mock()
         mocked_result_1 = {'files': ['file1', 'file2'], 'nextPageToken': 'nextPageToken'}
@@ -136,11 +293,11 @@ class TestUtils(TestCase):
                              [x for x in utils.get_remote_files_from_dir(mocked_service, 'test_parent_dir_id')])
 
         calls = [call(mocked_service,
-                      'nextPageToken, files(id, name, modifiedTime, mimeType)',
+                      'nextPageToken, files(id, name, modifiedTime, mimeType, size, md5Checksum)',
                       query="'test_parent_dir_id' in parents and trashed = false",
                       next_page_token=None),
                  call(mocked_service,
-                      'nextPageToken, files(id, name, modifiedTime, mimeType)',
+                      'nextPageToken, files(id, name, modifiedTime, mimeType, size, md5Checksum)',
                       query="'test_parent_dir_id' in parents and trashed = false",
                       next_page_token='nextPageToken')]
         mocked_list_drive_files.assert_has_calls(calls)
@@ -158,6 +315,40 @@ class TestUtils(TestCase):
         self.assertEqual(mock_dir, next(result_iter))
         self.assertEqual(mock_file, next(mock_dir['children']))
 
+    def test_list_all_remote_files(self):
+        mocked_service = Mock()
+        file_1 = {'id': 'id1', 'mimeType': 'application/vnd.google-apps.folder', 'parents': ['root_id']}
+        file_2 = {'id': 'id2', 'mimeType': 'not_dir', 'parents': ['id1', 'root_id']}
+        file_3 = {'id': 'id3', 'mimeType': 'not_dir', 'parents': ['id1']}
+        mocked_list_drive_files = Mock(side_effect=[{'files': [file_1, file_2], 'nextPageToken': 'token'},
+                                                    {'files': [file_3]}])
+
+        with patch('gdrive_sync.utils.list_drive_files', mocked_list_drive_files):
+            remote_tree = utils.list_all_remote_files(mocked_service, 500)
+
+        self.assertEqual({'root_id': [file_1, file_2], 'id1': [file_2, file_3]}, remote_tree)
+        self.assertNotIn('parents', file_2)
+        fields = 'nextPageToken, files(id, name, modifiedTime, mimeType, size, md5Checksum, parents)'
+        mocked_list_drive_files.assert_has_calls([call(mocked_service, fields,
+                                                       query='trashed = false',
+                                                       next_page_token=None, page_size=500),
+                                                  call(mocked_service, fields,
+                                                       query='trashed = false',
+                                                       next_page_token='token', page_size=500)])
+
+    def test_list_remote_files_from_tree(self):
+        mock_file = {'mimeType': 'not_dir', 'id': 'id2'}
+        mock_dir = {'mimeType': 'application/vnd.google-apps.folder', 'id': 'id1'}
+        remote_tree = {'root_id': [mock_dir, mock_file], 'id1': [mock_file]}
+
+        result_iter = utils.list_remote_files_from_tree(remote_tree, 'root_id')
+
+        remote_dir = next(result_iter)
+        self.assertEqual('id1', remote_dir['id'])
+        self.assertEqual([mock_file], list(remote_dir['children']))
+        self.assertEqual(mock_file, next(result_iter))
+        self.assertEqual([], list(utils.list_remote_files_from_tree(remote_tree, 'id2')))
+
     def test_get_remote_dir(self):
         mocked_service = Mock()
         mocked_result_1 = {'files': [{'id': 'id_1', 'modifiedTime': ', modifiedTime_1'}]}
@@ -170,12 +361,58 @@ class TestUtils(TestCase):
 
         calls = [call(mocked_service,
                       "nextPageToken, files(id, modifiedTime)",
-                      query="'root' in parents and name = 'dir1'"),
+                      query="'root' in parents and name = 'dir1' and trashed = false"),
                  call(mocked_service,
                       "nextPageToken, files(id, modifiedTime)",
-                      query="'id_1' in parents and name = 'dir2'")]
+                      query="'id_1' in parents and name = 'dir2' and trashed = false")]
         mocked_list_drive_files.assert_has_calls(calls)
 
+    @patch('gdrive_sync.utils.get_remote_dir', autospec=True)
+    def test_resolve_remote_dir(self, mock_get_remote_dir):
+        mock_get_remote_dir.side_effect = lambda service, parent_dir_id, dir_list: {
+            'id': parent_dir_id + '/' + dir_list[0], 'modifiedTime': 'modifiedTime'}
+        remote_dirs = Mock()
+        remote_dirs.get_remote_dir.side_effect = lambda remote_path: (
+            ('id_1', 'modifiedTime_1') if remote_path == '/dir1' else None)
+
+        self.assertEqual({'id': 'id_1/dir2', 'modifiedTime': 'modifiedTime'},
+                         utils.resolve_remote_dir('service', '/dir1/dir2', remote_dirs))
+
+        # Only the dir that was not stored is looked up, and then stored
+        mock_get_remote_dir.assert_called_once_with('service', 'id_1', ['dir2'])
+        remote_dirs.set_remote_dir.assert_called_once_with('/dir1/dir2', 'id_1/dir2', 'modifiedTime')
+
+        self.assertEqual({'id': 'root/dir1', 'modifiedTime': 'modifiedTime'},
+                         utils.resolve_remote_dir('service', '/dir1'))
+
+    @patch('gdrive_sync.utils.get_remote_dir', autospec=True)
+    def test_resolve_stored_remote_dir(self, mock_get_remote_dir):
+        mock_get_remote_dir.side_effect = lambda service, parent_dir_id, dir_list: {
+            'id': parent_dir_id + '/' + dir_list[0], 'modifiedTime': 'modifiedTime'}
+        stored_dirs = {'/dir1': ('id_1', 'modifiedTime_1'), '/dir1/dir2': ('id_2', 'modifiedTime_2')}
+        remote_dirs = Mock()
+        remote_dirs.get_remote_dir.side_effect = stored_dirs.get
+        remote_dirs.delete_remote_dirs_under.side_effect = lambda remote_path: stored_dirs.clear()
+        mocked_service = Mock()
+        mocked_get = mocked_service.files.return_value.get
+        mocked_get.return_value.execute.return_value = {'id': 'id_2', 'modifiedTime': 'modifiedTime_3',
+                                                        'trashed': False}
+
+        # The stored dir is checked with a single request
+        self.assertEqual({'id': 'id_2', 'modifiedTime': 'modifiedTime_3'},
+                         utils.resolve_remote_dir(mocked_service, '/dir1/dir2', remote_dirs))
+        mocked_get.assert_called_once_with(fileId='id_2', fields='id, modifiedTime, trashed')
+        mock_get_remote_dir.assert_not_called()
+
+        # The trashed dir is forgotten and looked up again
+        mocked_get.return_value.execute.return_value = {'id': 'id_2', 'modifiedTime': 'modifiedTime_3',
+                                                        'trashed': True}
+        self.assertEqual({'id': 'root/dir1/dir2', 'modifiedTime': 'modifiedTime'},
+                         utils.resolve_remote_dir(mocked_service, '/dir1/dir2', remote_dirs))
+        remote_dirs.delete_remote_dirs_under.assert_called_once_with('/dir1')
+        self.assertEqual([call(mocked_service, 'root', ['dir1']), call(mocked_service, 'root/dir1', ['dir2'])],
+                         mock_get_remote_dir.call_args_list)
+
     @patch('oauth2client.tools.run_flow', autospec=True)
     @patch('oauth2client.client.flow_from_clientsecrets', autospec=True)
     @patch('oauth2client.file.Storage', autospec=True)
@@ -218,12 +455,12 @@ class TestUtils(TestCase):
         mocked_store.get.assert_called_once_with()
 
     @patch('httplib2.Http', autospec=True)
-    @patch('googleapiclient.discovery.build', autospec=True)
+    @patch('gdrive_sync.utils.build_service', autospec=True)
     @patch('gdrive_sync.utils.get_credentials', autospec=True)
-    def test_get_service(self, mocked_get_credentials, mocked_build, http_mock):
+    def test_get_service(self, mocked_get_credentials, mocked_build_service, http_mock):
         mocked_credentials = Mock()
         mocked_get_credentials.return_value = mocked_credentials
-        mocked_build.return_value = 'service'
+        mocked_build_service.return_value = 'service'
         mocked_credentials.authorize.return_value = 'authorized'
         http_mock.return_value = 'http11'
 
@@ -232,7 +469,59 @@ class TestUtils(TestCase):
         mocked_get_credentials.assert_called_once_with()
         http_mock.assert_called_once_with()
         mocked_credentials.authorize.assert_called_once_with('http11')
-        mocked_build.assert_called_once_with('drive', 'v3', http='authorized')
+        mocked_build_service.assert_called_once_with('authorized')
+
+    @patch('gdrive_sync.utils.get_discovery_document', autospec=True)
+    @patch('googleapiclient.discovery.build_from_document', autospec=True)
+    def test_build_service(self, mocked_build_from_document, mocked_get_discovery_document):
+        mocked_get_discovery_document.return_value = 'document'
+        mocked_build_from_document.return_value = 'service'
+
+        self.assertEqual('service', utils.build_service('http'))
+
+        self.assertEqual('http', mocked_build_from_document.call_args[1]['http']._http)
+
+    @patch('httplib2.Http', autospec=True)
+    @patch('gdrive_sync.utils.get_gdrive_sync_home', autospec=True)
+    def test_get_discovery_document(self, mock_get_gdrive_sync_home, http_mock):
+        http_mock.return_value.request.return_value = (Mock(status=200), b'{"revision": "1"}')
+        with tempfile.TemporaryDirectory() as home_dir, \
+                patch.object(utils._DiscoveryCache, 'document', None):
+            mock_get_gdrive_sync_home.return_value = home_dir
+
+            self.assertEqual('{"revision": "1"}', utils.get_discovery_document())
+            self.assertEqual('{"revision": "1"}', utils.get_discovery_document())
+            http_mock.return_value.request.assert_called_once_with(
+                'https://www.googleapis.com/discovery/v1/apis/drive/v3/rest')
+
+            # A new process reads the document from the disk
+            utils._DiscoveryCache.document = None
+            self.assertEqual('{"revision": "1"}', utils.get_discovery_document())
+            http_mock.return_value.request.assert_called_once()
+
+            # A stale document is fetched again, and kept if the fetch fails
+            utils._DiscoveryCache.document = None
+            http_mock.return_value.request.side_effect = OSError('offline')
+            with patch.object(utils._DiscoveryCache, 'max_age', 0):
+                self.assertEqual('{"revision": "1"}', utils.get_discovery_document())
+            self.assertEqual(2, http_mock.return_value.request.call_count)
+
+    @patch('httplib2.Http', autospec=True)
+    @patch('gdrive_sync.utils.get_gdrive_sync_home', autospec=True)
+    def test_get_discovery_document_offline(self, mock_get_gdrive_sync_home, http_mock):
+        http_mock.return_value.request.side_effect = OSError('offline')
+        with tempfile.TemporaryDirectory() as home_dir, \
+                patch.object(utils._DiscoveryCache, 'document', None):
+            mock_get_gdrive_sync_home.return_value = home_dir
+
+            # Falls back to the document bundled with google-api-python-client
+            self.assertIn('"name": "drive"', utils.get_discovery_document())
+
+    def test_compute_md5(self):
+        with tempfile.NamedTemporaryFile() as local_file:
+            local_file.write(b'test content')
+            local_file.flush()
+            self.assertEqual('9473fdd0d880a43c21b7778d34872157', utils.compute_md5(local_file.name, chunk_size=5))
 
     @patch('os.stat', autospec=True)
     def test_get_inode_no(self, os_stat_mock):
@@ -243,14 +532,14 @@ class TestUtils(TestCase):
 
         os_stat_mock.assert_called_once_with('path')
 
-    @patch('gdrive_sync.utils.get_service', autospec=True)
-    def test_check_and_get_service(self, mock_get_service):
-        mock_get_service.return_value = 'service'
+    @patch('gdrive_sync.utils.get_pooled_service', autospec=True)
+    def test_check_and_get_service(self, mock_get_pooled_service):
+        mock_get_pooled_service.return_value = 'service'
 
         self.assertEqual('service_1', utils.check_and_get_service('service_1'))
         self.assertEqual('service', utils.check_and_get_service())
 
-        mock_get_service.assert_called_once_with()
+        mock_get_pooled_service.assert_called_once_with()
 
     @patch('gdrive_sync.utils.check_and_get_service', autospec=True)
     def test_delete_file_on_remote(self, mock_check_and_get_service):
@@ -264,12 +553,12 @@ class TestUtils(TestCase):
         mocked_service.files.return_value.delete.assert_called_once_with(fileId='remote_file_id')
         mocked_service.files.return_value.delete.return_value.execute.assert_called_once_with()
 
-    @patch('magic.from_file', autospec=True)
+    @patch('gdrive_sync.utils.get_mime_type', autospec=True)
     @patch('gdrive_sync.utils.check_and_get_service', autospec=True)
-    def test_update_remote_file(self, mock_check_and_get_service, mocked_magic):
+    def test_update_remote_file(self, mock_check_and_get_service, mocked_get_mime_type):
         mocked_service = Mock()
         mock_check_and_get_service.return_value = mocked_service
-        mocked_magic.return_value = 'test_mime_type'
+        mocked_get_mime_type.return_value = 'test_mime_type'
 
         utils.update_remote_file('remote_file_id', 'local_file_path')
 
@@ -279,7 +568,7 @@ class TestUtils(TestCase):
                                                                          media_body='local_file_path',
                                                                          media_mime_type='test_mime_type')
         mocked_service.files.return_value.update.return_value.execute.assert_called_once_with()
-        mocked_magic.assert_called_once_with('local_file_path', True)
+        mocked_get_mime_type.assert_called_once_with('local_file_path')
 
     @patch('os.mkdir', autospec=True)
     def test_create_local_dir(self, mock_mkdir):
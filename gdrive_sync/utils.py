@@ -1,17 +1,19 @@
+import hashlib
 import os
 import logging
 import shutil
+import stat
+import tempfile
+import threading
+import time
 
 from gdrive_sync import configs
 import json
-from pyrfc3339 import parse, generate
 from datetime import datetime
-from oauth2client import file
-from oauth2client import tools, client
 from os import path
-import httplib2
-from googleapiclient import discovery
-import magic
+
+# pyrfc3339, oauth2client, httplib2 and googleapiclient take a large share of the
+# start up time, they are imported by the functions that use them.
 
 _user_settings_template = {'synced_dirs': {}}
 
@@ -23,6 +25,25 @@ class _Flags:
     auth_host_name = 'localhost'
 
 
+class _UploadSettings:
+    chunk_size = configs.get_configs().getint('TRANSFER', 'chunk_size')
+    resumable_threshold = configs.get_configs().getint('TRANSFER', 'resumable_threshold')
+
+
+def _get_umask():
+    # The umask can only be read by setting it, which is done once, at import
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+class _DownloadSettings:
+    chunk_size = configs.get_configs().getint('TRANSFER', 'download_chunk_size')
+    preallocate = configs.get_configs().getboolean('TRANSFER', 'preallocate')
+    # The mode of the downloaded new files, the replaced files keep theirs
+    new_file_mode = 0o666 & ~_get_umask()
+
+
 def get_gdrive_sync_home():
     """
     Returns the gdrive-sync config directory for user.
@@ -43,7 +64,8 @@ def create_logger(name):
     logger = logging.getLogger(name)
     logger.setLevel(configs.get_config('LOGGING', 'log_level'))
     formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    fh = logging.FileHandler(get_gdrive_sync_home() + '/gdrive-sync.log')
+    # The log file is opened by the first record, not at import time
+    fh = logging.FileHandler(get_gdrive_sync_home() + '/gdrive-sync.log', delay=True)
     fh.setFormatter(formatter)
     logger.addHandler(fh)
     if configs.get_configs().getboolean('LOGGING', 'console_logging'):
@@ -53,6 +75,9 @@ def create_logger(name):
     return logger
 
 
+logger = create_logger(__name__)
+
+
 def get_user_settings():
     """
     Gets the user settings
@@ -73,27 +98,24 @@ def store_user_settings(settings):
         json.dump(settings, _file)
 
 
-def list_drive_files(service, fields, query=None, next_page_token=None):
+def list_drive_files(service, fields, query=None, next_page_token=None, page_size=None):
     """
     Gets the results from google drive with the input parameters
     """
-    return service.files().list(q=query, corpora="user", fields=fields, pageToken=next_page_token).execute()
+    return service.files().list(q=query, corpora="user", fields=fields, pageToken=next_page_token,
+                                pageSize=page_size).execute()
 
 
 def list_files_under_local_dir(dir_path):
     """
-    Lists the files as os.DirEntry under a dir in local filesystem.
-    If the file is a dir, it creates a map for that entry where the key is
-    the os.DirEntry for that dir and the value is the list of files under
-    that dir.
-    :return Generator of os.DirEntry and dict if file is dir
+    Lists the files and dirs under a dir in local filesystem, stat'ing every entry once.
+    Args:
+        dir_path: 'A String' path of the local dir
+    Returns:
+        Generator of LocalScanner.LocalEntry, the entries of the dirs have their children
     """
-    files = os.scandir(path=dir_path)
-    for each in files:
-        if each.is_dir():
-            yield {each: list_files_under_local_dir(each.path)}
-        else:
-            yield each
+    from gdrive_sync import LocalScanner
+    return LocalScanner.scan_local_dir(dir_path)
 
 
 def convert_rfc3339_time_to_epoch(timestamp):  # TODO: Modify test
@@ -104,6 +126,7 @@ def convert_rfc3339_time_to_epoch(timestamp):  # TODO: Modify test
     Returns:
         Integer, the converted epoch timestamp
     """
+    from pyrfc3339 import parse
     return int(parse(timestamp=timestamp).timestamp())
 
 
@@ -115,50 +138,196 @@ def convert_epoch_time_to_rfc3339(timestamp):
     Returns:
         A string in rfc3339 format
     """
+    from pyrfc3339 import generate
     return generate(datetime.utcfromtimestamp(timestamp), accept_naive=True)
 
 
-def overwrite_remote_file_with_local(service, remote_file_id, local_file_path):
+def overwrite_remote_file_with_local(service, remote_file_id, local_file_path, upload_sessions=None):
     """
     Overwrites the remote file with the local file.
     Args:
         service: A googleapiclient.discovery.Resource object
         remote_file_id: 'A String' that represents path the local file
         local_file_path: A os.DirEntry object that represents the local file
+        upload_sessions: A Db.DbHandler object that stores the sessions of the resumable uploads
     """
-    return service.files().update(fileId=remote_file_id,
-                                  media_body=local_file_path,
-                                  media_mime_type=magic.from_file(local_file_path, True)).execute()
+    return _upload_local_file(lambda **media: service.files().update(fileId=remote_file_id, **media),
+                              local_file_path,
+                              upload_sessions)
 
 
-def copy_remote_file_to_local(service, local_file_path, remote_file_id):
+def copy_remote_file_to_local(service, local_file_path, remote_file_id, file_size=None):
     """
     Copies the remote file to local.
+    The content is streamed in chunks of download_chunk_size bytes into a temporary file in the
+    same dir, which replaces the local file once it is complete and synced to the disk. So the
+    memory used does not grow with the file size, and an interrupted download never leaves a
+    truncated local file. The replaced local file keeps its permissions, a new one gets the
+    default permissions of the umask.
     Args:
         service: A googleapiclient.discovery.Resource object
         local_file_path: 'A String' that represents path the local file
         remote_file_id: 'A String' that represents id for the file object from google drive
-    """
-    remote_content = service.files().get_media(fileId=remote_file_id).execute()
-    with open(local_file_path, 'bw') as _file:
-        _file.write(remote_content)
-
-
-def copy_local_file_to_remote(local_file_path, remote_parent_dir_id, service=None):
+        file_size: Integer, the size of the remote file. If known, the space of the temporary
+            file is allocated upfront when preallocate is set
+    """
+    from googleapiclient.http import MediaIoBaseDownload
+    echo_registry = get_echo_registry()
+    request = service.files().get_media(fileId=remote_file_id)
+    local_dir_path, local_file_name = os.path.split(local_file_path)
+    echo_registry.expect_download(local_file_path)
+    temp_file = tempfile.NamedTemporaryFile(dir=local_dir_path or None,
+                                            prefix='.{}.'.format(local_file_name),
+                                            suffix='.part',
+                                            delete=False)
+    try:
+        with temp_file:
+            if file_size and _DownloadSettings.preallocate and hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(temp_file.fileno(), 0, file_size)
+            downloader = MediaIoBaseDownload(temp_file, request, chunksize=_DownloadSettings.chunk_size)
+            done = False
+            while not done:
+                _, done = downloader.next_chunk()
+            # Drops the preallocated space beyond the end of the downloaded content
+            temp_file.truncate()
+            temp_file.flush()
+            # The temporary file is created with mode 0600, which os.replace would keep
+            os.fchmod(temp_file.fileno(), _get_file_mode(local_file_path))
+            os.fsync(temp_file.fileno())
+        echo_registry.expect_file(local_file_path, os.stat(temp_file.name))
+        os.replace(temp_file.name, local_file_path)
+    except BaseException:
+        os.remove(temp_file.name)
+        raise
+
+
+def _get_file_mode(local_file_path):
+    try:
+        return stat.S_IMODE(os.stat(local_file_path).st_mode)
+    except FileNotFoundError:
+        return _DownloadSettings.new_file_mode
+
+
+def copy_local_file_to_remote(local_file_path, remote_parent_dir_id, service=None, upload_sessions=None):
     """
     Copies the local file under remote_parent_dir
     Args:
         service: A googleapiclient.discovery.Resource object
         local_file_path: A String path of the local file
         remote_parent_dir_id: 'A String' that represents id for the file object from google drive
+        upload_sessions: A Db.DbHandler object that stores the sessions of the resumable uploads
     Returns:
         'A String' ID of the created google drive file
     """
-    return check_and_get_service(service).files().create(body={'parents': [remote_parent_dir_id],
-                                                               'name': os.path.basename(local_file_path)},
-                                                         media_body=local_file_path,
-                                                         media_mime_type=magic.from_file(local_file_path,
-                                                                                         True)).execute()['id']
+    service = check_and_get_service(service)
+    return _upload_local_file(lambda **media: service.files().create(body={'parents': [remote_parent_dir_id],
+                                                                           'name': os.path.basename(local_file_path)},
+                                                                     **media),
+                              local_file_path,
+                              upload_sessions)['id']
+
+
+def _upload_local_file(request_function, local_file_path, upload_sessions=None):
+    """
+    Executes a create or update request that uploads the content of the local file.
+    Files smaller than resumable_threshold are uploaded with a single request. Larger files
+    are uploaded in chunks of chunk_size bytes, so that an interrupted upload only resends
+    the chunk in flight.
+    Args:
+        request_function: A function that takes media_body and media_mime_type keyword arguments
+            and returns a googleapiclient.http.HttpRequest object
+        local_file_path: 'A String' path of the local file
+        upload_sessions: A Db.DbHandler object that stores the sessions of the resumable uploads
+    Returns:
+        The response of the request
+    """
+    from googleapiclient.http import MediaFileUpload
+    mime_type = get_mime_type(local_file_path)
+    if not os.path.isfile(local_file_path) or os.path.getsize(local_file_path) < _UploadSettings.resumable_threshold:
+        return request_function(media_body=local_file_path, media_mime_type=mime_type).execute()
+    media_body = MediaFileUpload(local_file_path,
+                                 mimetype=mime_type,
+                                 chunksize=_UploadSettings.chunk_size,
+                                 resumable=True)
+    return _execute_resumable_upload(request_function(media_body=media_body), local_file_path, upload_sessions)
+
+
+def get_mime_type(local_file_path):
+    """
+    Args:
+        local_file_path: 'A String' path of the local file
+    Returns:
+        'A String' mime type of the file, detected by the shared MimeDetector
+    """
+    from gdrive_sync import MimeDetector
+    return MimeDetector.get_default_detector().detect(local_file_path)
+
+
+def get_echo_registry():
+    """
+    Returns:
+        The shared EchoRegistry.EchoRegistry, where the local changes made by the sync are registered
+    """
+    from gdrive_sync import EchoRegistry
+    return EchoRegistry.get_default_registry()
+
+
+def _execute_resumable_upload(request, local_file_path, upload_sessions=None):
+    """
+    Uploads the content of the local file chunk by chunk. After every chunk, the session uri
+    and the number of bytes committed by the server are stored with upload_sessions, so that
+    the upload of an unchanged file continues from the stored session after a crash or restart.
+    A throttled or failed chunk is retried after the backoff of the RateGovernor.
+    Args:
+        request: A googleapiclient.http.HttpRequest object with a resumable media body
+        local_file_path: 'A String' path of the local file
+        upload_sessions: A Db.DbHandler object that stores the sessions of the resumable uploads
+    Returns:
+        The response of the request
+    """
+    from googleapiclient.errors import HttpError
+    from gdrive_sync import RateGovernor
+    governor = get_rate_governor()
+    file_stat = os.stat(local_file_path)
+    resumed = False
+    retries = 0
+    if upload_sessions:
+        session = upload_sessions.get_upload_session(local_file_path)
+        if session and session[1:3] == (file_stat.st_size, file_stat.st_mtime):
+            request.resumable_uri, _, _, request.resumable_progress = session
+            # Asks the server for the committed offset before sending the next chunk
+            request._in_error_state = True
+            resumed = True
+        elif session:
+            upload_sessions.delete_upload_session(local_file_path)
+    response = None
+    while response is None:
+        try:
+            status, response = request.next_chunk()
+        except HttpError as error:
+            if RateGovernor.is_retryable(error.resp.status, error.content) and retries < governor.max_retries:
+                # The next chunk starts at the offset committed by the server
+                governor.backoff(retries)
+                retries += 1
+                continue
+            if not resumed or error.resp.status not in (404, 410):
+                raise
+            # The stored session has expired, the upload starts again from the first byte
+            request.resumable_uri = None
+            request.resumable_progress = 0
+            request._in_error_state = False
+            resumed = False
+            continue
+        retries = 0
+        if status and upload_sessions:
+            upload_sessions.set_upload_session(local_file_path,
+                                               request.resumable_uri,
+                                               file_stat.st_size,
+                                               file_stat.st_mtime,
+                                               status.resumable_progress)
+    if upload_sessions:
+        upload_sessions.delete_upload_session(local_file_path)
+    return response
 
 
 def create_remote_dir(name, parent_dir, service=None):
@@ -175,11 +344,33 @@ def create_remote_dir(name, parent_dir, service=None):
         .execute()['id']
 
 
+def move_remote_file(remote_file_id, new_name, new_parent_dir_id, old_parent_dir_id, service=None):
+    """
+    Renames and moves a remote file or dir with a metadata update, without uploading any content.
+    The files under a moved dir move along with it.
+    Args:
+        remote_file_id: 'A String' id of the file/directory from google drive
+        new_name: 'A String' name of the file/directory after the move
+        new_parent_dir_id: 'A String' id of the remote parent dir after the move
+        old_parent_dir_id: 'A String' id of the remote parent dir before the move
+        service: A googleapiclient.discovery.Resource object
+    Returns:
+        A dict of the id and modifiedTime of the moved file
+    """
+    parents = {}
+    if new_parent_dir_id != old_parent_dir_id:
+        parents = {'addParents': new_parent_dir_id, 'removeParents': old_parent_dir_id}
+    return check_and_get_service(service).files().update(fileId=remote_file_id,
+                                                         body={'name': new_name},
+                                                         fields='id, modifiedTime',
+                                                         **parents).execute()
+
+
 def get_remote_files_from_dir(service, parent_dir_id, next_page_token=None):
     """
     Gets the remote file information from remote, returns file with
-    id, name, modifiedTime, mimeType fields. For most of the use-cases, list_remote_files_from_dir
-    is a more suitable option.
+    id, name, modifiedTime, mimeType, size, md5Checksum fields. For most of the use-cases,
+    list_remote_files_from_dir is a more suitable option.
     Args:
         service: A googleapiclient.discovery.Resource object
         parent_dir_id: 'A String' representing the id of the parent dir of the remote files
@@ -188,7 +379,7 @@ def get_remote_files_from_dir(service, parent_dir_id, next_page_token=None):
         A generator of files dir object
     """
     results = list_drive_files(service,
-                               'nextPageToken, files(id, name, modifiedTime, mimeType)',
+                               'nextPageToken, files(id, name, modifiedTime, mimeType, size, md5Checksum)',
                                query="'{}' in parents and trashed = false".format(parent_dir_id),
                                next_page_token=next_page_token)
     if 'nextPageToken' in results:
@@ -214,6 +405,54 @@ def list_remote_files_from_dir(service, parent_dir_id):
         yield each
 
 
+def list_all_remote_files(service, page_size=1000):
+    """
+    Gets the information of every non-trashed file and dir the user can see, with the
+    ids of their parent dirs, in pages of page_size files. It costs one request per
+    page instead of one request per dir as list_remote_files_from_dir does.
+    The files owned by other users are included, as they can be in the synced dirs too.
+    Only the files under a synced dir are reached by list_remote_files_from_tree.
+    Args:
+        service: A googleapiclient.discovery.Resource object
+        page_size: Integer, the number of files per page
+    Returns:
+        A dict of 'A String' parent dir id vs the list of files and dir objects under it
+    """
+    remote_tree = {}
+    next_page_token = None
+    while True:
+        results = list_drive_files(service,
+                                   'nextPageToken, '
+                                   'files(id, name, modifiedTime, mimeType, size, md5Checksum, parents)',
+                                   query='trashed = false',
+                                   next_page_token=next_page_token,
+                                   page_size=page_size)
+        for each in results['files']:
+            for parent_id in each.pop('parents', []):
+                remote_tree.setdefault(parent_id, []).append(each)
+        next_page_token = results.get('nextPageToken')
+        if not next_page_token:
+            return remote_tree
+
+
+def list_remote_files_from_tree(remote_tree, parent_dir_id):
+    """
+    Same as list_remote_files_from_dir, but reads the files and dirs from the output of
+    list_all_remote_files instead of querying google drive.
+
+    :param remote_tree: A dict of parent dir id vs files, returned by list_all_remote_files
+    :param parent_dir_id: 'A String' representing the id of the parent dir of the remote files
+    :return: A generator of files and dir object
+    """
+    for each in remote_tree.get(parent_dir_id, []):
+        each = dict(each)
+
+        if each['mimeType'] == 'application/vnd.google-apps.folder':
+            each['children'] = list_remote_files_from_tree(remote_tree, each['id'])
+
+        yield each
+
+
 def get_remote_dir(service, parent_dir_id, dir_list):
     """
     Gets the remote dir id from drive.
@@ -232,7 +471,10 @@ def get_remote_dir(service, parent_dir_id, dir_list):
 
     """
     results = list_drive_files(service, "nextPageToken, files(id, modifiedTime)",
-                               query="'{}' in parents and name = '{}'".format(parent_dir_id, dir_list[0]))
+                               query="'{}' in parents and name = '{}' and trashed = false".format(parent_dir_id,
+                                                                                                  dir_list[0]))
+    if not results['files']:
+        raise FileNotFoundError('No remote dir {} under {}.'.format(dir_list[0], parent_dir_id))
     this_dir_id = results['files'][0]['id']
     if len(dir_list) == 1:
         return results['files'][0]
@@ -240,6 +482,66 @@ def get_remote_dir(service, parent_dir_id, dir_list):
         return get_remote_dir(service, this_dir_id, dir_list[1:])
 
 
+def resolve_remote_dir(service, remote_dir_path, remote_dirs=None):
+    """
+    Gets the remote dir of a remote path, one path component at a time. The ids of the dirs on
+    the path are looked up in and stored with remote_dirs, so that resolving a path again costs
+    a single request, which checks that the stored dir still exists and is not trashed. Else the
+    stored dirs of the path are forgotten and the path is looked up again, so that the sync never
+    takes a deleted remote dir for an empty one.
+    Args:
+        service: A googleapiclient.discovery.Resource object
+        remote_dir_path: 'A String' path of the remote dir, like /parent_dir/child_dir
+        remote_dirs: A Db.DbHandler object that stores the ids of the remote dirs by their path
+    Returns:
+        A dict of below form:
+            {
+                'id': 'A String' id of the directory from google drive
+                'modifiedTime': 'A string' date in rfc3339 format
+            }
+    """
+    remote_dir = {'id': 'root'}
+    current_path = ''
+    stored = False
+    for dir_name in remote_dir_path.split('/')[1:]:
+        current_path += '/' + dir_name
+        stored_dir = remote_dirs.get_remote_dir(current_path) if remote_dirs else None
+        if stored_dir:
+            remote_dir = {'id': stored_dir[0], 'modifiedTime': stored_dir[1]}
+            stored = True
+            continue
+        remote_dir = get_remote_dir(service, remote_dir['id'], [dir_name])
+        stored = False
+        if remote_dirs:
+            remote_dirs.set_remote_dir(current_path, remote_dir['id'], remote_dir['modifiedTime'])
+    if not stored:
+        return remote_dir
+    # A dir is trashed with its parent dir, so checking the last one is enough
+    existing_dir = _get_existing_remote_dir(service, remote_dir['id'])
+    if existing_dir:
+        return existing_dir
+    logger.warning('The stored remote dir of %s was deleted or trashed, looking it up again.', remote_dir_path)
+    remote_dirs.delete_remote_dirs_under('/' + remote_dir_path.split('/')[1])
+    return resolve_remote_dir(service, remote_dir_path, remote_dirs)
+
+
+def _get_existing_remote_dir(service, remote_dir_id):
+    """
+    Returns:
+        A dict of the id and modifiedTime of the remote dir, None if it was deleted or trashed
+    """
+    from googleapiclient.errors import HttpError
+    try:
+        remote_dir = service.files().get(fileId=remote_dir_id, fields='id, modifiedTime, trashed').execute()
+    except HttpError as error:
+        if error.resp.status == 404:
+            return None
+        raise
+    if remote_dir.pop('trashed', False):
+        return None
+    return remote_dir
+
+
 def get_credentials():
     """
     Retrieves the credential from user's home directory. If credential
@@ -248,6 +550,7 @@ def get_credentials():
     Returns:
         An object of type oauth2client.client.Credentials
     """
+    from oauth2client import client, file, tools
     credential_path = path.join(get_gdrive_sync_home(), 'credential.json')
     store = file.Storage(credential_path)
     credentials = store.get()
@@ -263,9 +566,113 @@ def get_service():
     Returns:
         A googleapiclient.discovery.Resource object with methods for interacting with the service.
     """
+    import httplib2
     credentials = get_credentials()
     http = credentials.authorize(httplib2.Http())
-    return discovery.build('drive', 'v3', http=http)
+    return build_service(http)
+
+
+def build_service(http):
+    """
+    Builds the Drive API resource from the cached discovery document, without a network round trip.
+    Its requests are paced and retried by the shared RateGovernor.
+    Args:
+        http: An authorized httplib2.Http object
+    Returns:
+        A googleapiclient.discovery.Resource object
+    """
+    from googleapiclient import discovery
+    from gdrive_sync import RateGovernor
+    return discovery.build_from_document(get_discovery_document(),
+                                         http=RateGovernor.GovernedHttp(http, get_rate_governor()))
+
+
+def get_rate_governor():
+    """
+    Returns:
+        The RateGovernor.RateGovernor object that paces all the Drive API requests of the process
+    """
+    from gdrive_sync import RateGovernor
+    return RateGovernor.get_default_governor()
+
+
+def get_discovery_document():
+    """
+    Returns the Drive v3 discovery document. It is kept in memory and in a file under
+    ~/.gdrive-sync/discovery, whose name has the version of google-api-python-client that reads it.
+    The file is fetched again once it is older than discovery_cache_max_age seconds. If the fetch
+    fails, the stale file is used, else the document bundled with google-api-python-client.
+    Returns:
+        'A String' discovery document in json format
+    """
+    with _DiscoveryCache.lock:
+        if _DiscoveryCache.document is None:
+            _DiscoveryCache.document = _load_discovery_document()
+        return _DiscoveryCache.document
+
+
+class _DiscoveryCache:
+    max_age = configs.get_configs().getfloat('SERVICE', 'discovery_cache_max_age')
+    lock = threading.Lock()
+    document = None
+
+
+def _load_discovery_document():
+    from googleapiclient import discovery, discovery_cache, version
+    cache_dir = os.path.join(get_gdrive_sync_home(), 'discovery')
+    cache_path = os.path.join(cache_dir, 'drive-v3-{}.json'.format(version.__version__))
+    try:
+        if time.time() - os.path.getmtime(cache_path) < _DiscoveryCache.max_age:
+            with open(cache_path, mode='r', encoding='utf-8') as _file:
+                return _file.read()
+    except OSError:
+        pass
+    try:
+        import httplib2
+        response, content = httplib2.Http(timeout=30).request(
+            discovery.DISCOVERY_URI.format(api='drive', apiVersion='v3'))
+        if response.status != 200:
+            raise IOError('Fetching the discovery document failed with status {}'.format(response.status))
+        document = content.decode('utf-8')
+        json.loads(document)
+    except Exception:
+        logger.warning('Unable to fetch the discovery document:', exc_info=True)
+        try:
+            with open(cache_path, mode='r', encoding='utf-8') as _file:
+                return _file.read()
+        except OSError:
+            return discovery_cache.get_static_doc('drive', 'v3')
+    os.makedirs(cache_dir, exist_ok=True)
+    with tempfile.NamedTemporaryFile(mode='w', encoding='utf-8', dir=cache_dir, suffix='.part',
+                                     delete=False) as temp_file:
+        temp_file.write(document)
+    os.replace(temp_file.name, cache_path)
+    return document
+
+
+def get_pooled_service():
+    """
+    Returns:
+        The googleapiclient.discovery.Resource object of the calling thread from the shared ServicePool
+    """
+    from gdrive_sync import ServicePool
+    return ServicePool.get_default_pool().get_service()
+
+
+def compute_md5(local_file_path, chunk_size=1024 * 1024):
+    """
+    Computes the md5 checksum of a local file, reading it in chunks.
+    Args:
+        local_file_path: 'A String' path of the local file
+        chunk_size: Integer, the number of bytes read at a time
+    Returns:
+        'A String' hex digest, as the md5Checksum of the google drive files
+    """
+    md5 = hashlib.md5()
+    with open(local_file_path, 'rb') as _file:
+        for chunk in iter(lambda: _file.read(chunk_size), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
 
 
 def get_inode_no(path_to_file):
@@ -280,7 +687,7 @@ def get_inode_no(path_to_file):
 
 def check_and_get_service(service=None):
     """
-    If the input service is None, it creates a new one and returns.
+    If the input service is None, it returns the one of the calling thread from the shared ServicePool.
     Else, returns the same object.
     Args:
         service: A googleapiclient.discovery.Resource object
@@ -288,7 +695,7 @@ def check_and_get_service(service=None):
         service: A googleapiclient.discovery.Resource object
     """
     if not service:
-        return get_service()
+        return get_pooled_service()
     return service
 
 
@@ -303,18 +710,19 @@ def delete_file_on_remote(remote_file_id, service=None):
     check_and_get_service(service).files().delete(fileId=remote_file_id).execute()
 
 
-def update_remote_file(remote_file_id, local_file_path, service=None):
+def update_remote_file(remote_file_id, local_file_path, service=None, upload_sessions=None):
     """
     Updates the content of the remote file with local file content
     Args:
         remote_file_id: 'A String' id of the file/directory from google drive
         local_file_path: 'A String' representation of the local file path
         service: A googleapiclient.discovery.Resource object
+        upload_sessions: A Db.DbHandler object that stores the sessions of the resumable uploads
     """
-    check_and_get_service(service).files().update(fileId=remote_file_id,
-                                                  media_body=local_file_path,
-                                                  media_mime_type=magic.from_file(local_file_path,
-                                                                                  True)).execute()
+    service = check_and_get_service(service)
+    _upload_local_file(lambda **media: service.files().update(fileId=remote_file_id, **media),
+                       local_file_path,
+                       upload_sessions)
 
 
 def create_local_dir(dir_path):
@@ -323,6 +731,7 @@ def create_local_dir(dir_path):
     :param dir_path:
     :return:
     """
+    get_echo_registry().expect_dir(dir_path)
     os.mkdir(dir_path, 0o755)
 
 
@@ -332,6 +741,7 @@ def delete_file_from_local(file_path):
     :param file_path: A string path to the file
     :return:
     """
+    get_echo_registry().expect_deleted(file_path)
     if os.path.isfile(file_path):
         os.remove(file_path)
     else:
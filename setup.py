@@ -20,7 +20,7 @@ setup(
                           'python-magic'],
         entry_points={
             'console_scripts': [
-                #'run-ios-push-server=batch.servers.ios_push_client_server:run_server'
+                'gdrive-sync=gdrive_sync.GdriveSync:main'
             ]
         },
         include_package_data=True,